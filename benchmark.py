@@ -0,0 +1,489 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+Benchmarks the parts of Synctity that run profiles.  Synthetic trees are
+generated in a scratch directory and copied locally with each runner mode,
+and the scheduler, output handling, command line rendering and runner are
+timed on their own, the runner against fakersync.py.  With --startup, starting the graphical
+interface is timed too:
+
+    python benchmark.py [--scale N] [--output FILE] [--baseline FILE] [--startup]
+
+Each result is written as one line of JSON.  Given the results of an
+earlier run as a baseline, any case that became slower by more than the
+tolerance is listed and the exit status is 1.
+'''
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import headless
+import index
+import progress
+import rsync
+import scheduler
+import store
+
+# The number of top-level directories in each synthetic tree, which is also
+# the number of commands in the profiles that copy it
+BRANCHES = 4
+# The number of processes and shards used by the parallel modes
+PARALLEL = 4
+# A case is a regression if it takes this much longer than its baseline
+TOLERANCE = 0.25
+# Random data is written in blocks of this size
+BLOCK_SIZE = 1024 * 1024
+# The startup case fails if the profiles have not loaded after this many
+# seconds
+STARTUP_TIMEOUT = 60
+
+def writeFile(filename, size, rand):
+    '''
+    Writes a file of the given size filled with random data.  The data is
+    taken from one block of random bytes at a random offset, which is fast
+    and still differs from file to file.
+    '''
+    global randomBlock
+    if randomBlock == None:
+        generator = random.Random(0)
+        randomBlock = ''.join([chr(generator.randint(0, 255)) for i in range(BLOCK_SIZE)])
+    offset = rand.randint(0, BLOCK_SIZE - 1)
+    data = randomBlock[offset:] + randomBlock[:offset]
+    out = open(filename, 'wb')
+    try:
+        while size > 0:
+            out.write(data[:size])
+            size -= BLOCK_SIZE
+    finally:
+        out.close()
+randomBlock = None
+
+def makeTiny(root, scale, rand):
+    ''' Many small files in a few wide directories. '''
+    for branch in range(BRANCHES):
+        directory = os.path.join(root, "branch%d" % branch)
+        os.makedirs(directory)
+        for idx in range(2500 * scale):
+            writeFile(os.path.join(directory, "file%05d" % idx), 100, rand)
+
+def makeHuge(root, scale, rand):
+    ''' A few large files. '''
+    for branch in range(BRANCHES):
+        directory = os.path.join(root, "branch%d" % branch)
+        os.makedirs(directory)
+        writeFile(os.path.join(directory, "huge"), 16 * BLOCK_SIZE * scale, rand)
+
+def makeDeep(root, scale, rand):
+    ''' Directories nested deeply, with a few files at every level. '''
+    for branch in range(BRANCHES):
+        directory = os.path.join(root, "branch%d" % branch)
+        for depth in range(32 * scale):
+            directory = os.path.join(directory, "level%d" % depth)
+            os.makedirs(directory)
+            for idx in range(8):
+                writeFile(os.path.join(directory, "file%d" % idx), 1000, rand)
+
+def makeMixed(root, scale, rand):
+    ''' Files of widely varying size in directories of varying depth. '''
+    for branch in range(BRANCHES):
+        for idx in range(500 * scale):
+            directory = os.path.join(root, "branch%d" % branch,
+                                     *["dir%d" % rand.randint(0, 3)
+                                       for depth in range(rand.randint(0, 4))])
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            # mostly small files, with the occasional large one
+            size = int(rand.paretovariate(1.2) * 2000)
+            writeFile(os.path.join(directory, "file%04d" % idx),
+                      min(size, 8 * BLOCK_SIZE), rand)
+
+# Synthetic trees, by name
+TREES = [('tiny', makeTiny), ('huge', makeHuge), ('deep', makeDeep),
+         ('mixed', makeMixed)]
+
+def discard(data, error):
+    ''' Output handler for rsync.run() that ignores the output. '''
+    pass
+
+def copyProfile(source, destination, parallel=1):
+    '''
+    Returns a profile that copies each top-level directory of source to
+    destination with its own command.
+    '''
+    profile = rsync.Profile("benchmark")
+    profile.setParallel(parallel)
+    for name in sorted(os.listdir(source)):
+        options = rsync.Option()
+        options.enable('a')
+        profile.add(rsync.Command(rsync.Path(os.path.join(source, name)),
+                                  rsync.Path(destination + '/'), options))
+    return profile
+
+def incrementalProfile(source, destination, parallel):
+    '''
+    Returns a profile like copyProfile(), whose commands only transfer what
+    changed since their last run.
+    '''
+    profile = copyProfile(source, destination, parallel)
+    for command in profile:
+        command.setIncremental(True)
+    return profile
+
+def shardProfile(source, destination, shards):
+    '''
+    Returns a profile that copies source to destination with one command,
+    split among the given number of shards.
+    '''
+    profile = rsync.Profile("benchmark")
+    profile.setParallel(shards)
+    options = rsync.Option()
+    options.enable('a')
+    command = rsync.Command(rsync.Path(source + '/'), rsync.Path(destination + '/'),
+                            options)
+    command.setShards(shards)
+    command.setShardMode(rsync.SHARD_BY_SIZE)
+    profile.add(command)
+    return profile
+
+def runSequential(profile):
+    ''' Runs a profile one command at a time, as Profile.execute() does. '''
+    return profile.execute(output=discard)
+
+def runParallel(profile):
+    ''' Runs a profile with the headless runner. '''
+    return headless.runProfile(profile, maxProcesses=PARALLEL)
+
+# Ways to run a copy profile: a name, the function that makes the profile,
+# and the function that runs it
+MODES = [('sequential', lambda source, dest: copyProfile(source, dest), runSequential),
+         ('parallel', lambda source, dest: copyProfile(source, dest, PARALLEL), runParallel),
+         ('sharded', lambda source, dest: shardProfile(source, dest, PARALLEL), runParallel),
+         ('incremental', lambda source, dest: incrementalProfile(source, dest, PARALLEL), runParallel)]
+
+def measure(name, function):
+    '''
+    Runs a function in a child process and returns a result holding the
+    case name, its wall time in seconds, the peak memory in kilobytes of
+    the child and of the processes it ran, and what the function returned.
+    The child's output is discarded, so it does not mix with the results.
+    '''
+    (reader, writer) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(reader)
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        result = {'name': name}
+        try:
+            start = time.time()
+            result['value'] = function()
+            result['wall'] = time.time() - start
+        except Exception, e:
+            result['error'] = str(e)
+        result['maxrss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['childrss'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        os.write(writer, json.dumps(result))
+        os._exit(0)
+    os.close(writer)
+    data = ''
+    chunk = os.read(reader, rsync.CHUNK_SIZE)
+    while chunk != '':
+        data += chunk
+        chunk = os.read(reader, rsync.CHUNK_SIZE)
+    os.close(reader)
+    os.waitpid(pid, 0)
+    if data == '':
+        return {'name': name, 'error': "benchmark process died"}
+    return json.loads(data)
+
+def benchmarkCopies(scratch, scale, results):
+    '''
+    Generates each synthetic tree and copies it with each runner mode, first
+    to an empty destination and then again once it is up to date.  The
+    value of each result is the number of failed commands.
+    '''
+    rand = random.Random(1)
+    # keep the indexes of incremental commands with the trees
+    index.INDEX_DIR = os.path.join(scratch, "index")
+    for (tree, make) in TREES:
+        source = os.path.join(scratch, tree)
+        make(source, scale, rand)
+        for (mode, makeProfile, run) in MODES:
+            destination = os.path.join(scratch, "copy")
+            os.makedirs(destination)
+            profile = makeProfile(source, destination)
+            for case in ('copy', 'update'):
+                results.append(measure("%s.%s.%s" % (tree, mode, case),
+                                       lambda: run(profile)))
+            shutil.rmtree(destination)
+        shutil.rmtree(source)
+
+def benchmarkScheduler(count):
+    '''
+    Queues a profile of many commands and takes each job through the
+    scheduler without running it.  Returns the number of jobs.
+    '''
+    profile = rsync.Profile("benchmark")
+    profile.setParallel(PARALLEL)
+    profile.setHostLimit(2)
+    for idx in range(count):
+        command = rsync.Command(rsync.Path("/source/%d" % idx),
+                                rsync.Path("/dest/%d" % idx, "host%d" % (idx % 8), "user"))
+        if idx > 0 and idx % 10 != 0:
+            command.setDepends([profile.get(idx - 1)])
+        profile.add(command)
+    jobs = scheduler.Scheduler()
+    jobs.queueProfile(profile)
+    finished = 0
+    while not jobs.isIdle():
+        job = jobs.next()
+        while job != None:
+            job = jobs.next()
+        for job in list(jobs.running):
+            jobs.finish(job, 0)
+            finished += 1
+    return finished
+
+def benchmarkRunner(commands, files):
+    '''
+    Runs a profile of many commands with the headless runner, against
+    fakersync.py rather than rsync, so the runner's scheduling and output
+    handling are measured without copying anything.  Each command names
+    the given number of files, with progress lines, itemized changes and
+    stats.  Returns the number of failed commands.
+    '''
+    rsync.RSYNC = "%s %s" % (sys.executable,
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakersync.py"))
+    os.environ['FAKERSYNC_FILES'] = str(files)
+    os.environ['FAKERSYNC_SIZE'] = str(64 * 1024)
+    profile = rsync.Profile("benchmark")
+    profile.setParallel(PARALLEL)
+    for idx in range(commands):
+        options = rsync.Option()
+        options.enable('a')
+        options.enable('i')
+        options.enable('P')
+        options.enable('stats')
+        profile.add(rsync.Command(rsync.Path("/source/%d/" % idx),
+                                  rsync.Path("/dest/%d/" % idx, "host%d" % (idx % 8)), options))
+    return headless.runProfile(profile, maxProcesses=PARALLEL)
+
+def benchmarkStartup(scratch, profiles):
+    '''
+    Starts the graphical interface with a profile file holding the given
+    number of profiles, and waits until the window has been shown and the
+    profiles loaded.  This needs PyQt and a display.  Returns the seconds
+    taken to import the interface, and to show the window.
+    '''
+    filename = os.path.join(scratch, "startup.db")
+    saved = list()
+    for idx in range(profiles):
+        profile = rsync.Profile("profile%d" % idx)
+        for branch in range(BRANCHES):
+            profile.add(rsync.Command(rsync.Path("/source/%d/" % branch),
+                                      rsync.Path("/dest/%d/%d/" % (idx, branch), "host")))
+        saved.append(profile)
+    store.write(filename, saved)
+
+    start = time.time()
+    from PyQt4 import QtGui
+    import synctity
+    imported = time.time() - start
+    synctity.DEFAULT_CONFIG = filename
+    app = QtGui.QApplication([])
+    window = synctity.SynctityWindow()
+    window.show()
+    deadline = time.time() + STARTUP_TIMEOUT
+    while window.profileModel.rowCount() < profiles:
+        if time.time() > deadline:
+            raise RuntimeError("%d of %d profiles loaded" %
+                               (window.profileModel.rowCount(), profiles))
+        app.processEvents()
+    return {'import': imported, 'window': time.time() - start - imported}
+
+def optionProfile(commands, options):
+    '''
+    Returns a profile of commands that each have many options, as profiles
+    generated with long lists of exclude patterns do.
+    '''
+    profile = rsync.Profile("options")
+    for idx in range(commands):
+        command = rsync.Command(rsync.Path("/source/%d/" % idx),
+                                rsync.Path("/dest/%d" % idx, "host%d" % (idx % 8), "user"))
+        command.getOptions().enable('a')
+        for opt in range(options):
+            command.getOptions().enable('exclude', "*.tmp%d" % opt)
+        profile.add(command)
+    return profile
+
+def benchmarkRendering(profile, passes):
+    '''
+    Writes out every command line and description in a profile the given
+    number of times, as the command list and a run being prepared do.  The
+    first pass writes out each command; later passes reuse what it wrote.
+    Returns the number of command lines written.
+    '''
+    rendered = 0
+    for idx in range(passes):
+        for command in profile:
+            command.forward()
+            command.reverse()
+            command.getDescription()
+            rendered += 1
+    return rendered
+
+def benchmarkExcludes(count):
+    '''
+    Adds many exclude patterns to a command, each once and then again, and
+    works out the arguments it runs with.  Returns the number of arguments.
+    '''
+    command = rsync.Command(rsync.Path("/source/"), rsync.Path("/dest"))
+    for idx in range(count) + range(count):
+        command.getOptions().enable('exclude', "build%d/*.o" % idx)
+    return len(command.arguments())
+
+def syntheticOutput(lines):
+    '''
+    Returns rsync output naming the given number of files, with a progress
+    line after each, and a --stats summary.
+    '''
+    output = ["sending incremental file list"]
+    for idx in range(lines):
+        output.append("branch%d/dir/file%06d" % (idx % BRANCHES, idx))
+        output.append("         %d 100%%    1.23MB/s    0:00:00 (xfr#%d, to-chk=%d/%d)" %
+                      (idx * 10, idx + 1, lines - idx - 1, lines))
+    output.extend(["", "Number of files: %d" % lines,
+                   "Total file size: %d bytes" % (lines * 10),
+                   "sent %d bytes  received 35 bytes  1,234.00 bytes/sec" % (lines * 12),
+                   "total size is %d  speedup is 1.00" % (lines * 10)])
+    return '\r\n'.join(output) + '\n'
+
+def benchmarkParser(lines):
+    '''
+    Feeds synthetic output through a progress parser in chunks as a process
+    would write it.  Returns the number of files the parser counted.
+    '''
+    data = syntheticOutput(lines)
+    parser = progress.ProgressParser(lambda event: None)
+    for offset in range(0, len(data), rsync.CHUNK_SIZE):
+        parser.feed(data[offset:offset + rsync.CHUNK_SIZE])
+    parser.close()
+    return parser.files
+
+def benchmarkStreaming(size, parse):
+    '''
+    Runs a process that writes the given number of bytes of output and
+    reads it all, optionally through a progress parser.  Returns the
+    process' exit status.
+    '''
+    commandline = "head -c %d /dev/zero | tr '\\0' 'x' | fold -w 79" % size
+    if parse:
+        parser = progress.ProgressParser()
+        return rsync.run(commandline, parser.tee(discard))
+    return rsync.run(commandline, discard)
+
+def compare(results, baseline, tolerance):
+    '''
+    Compares results with baseline results, and returns a message for each
+    case that took longer than its baseline by more than tolerance.
+    '''
+    previous = dict()
+    for result in baseline:
+        previous[result['name']] = result
+    regressions = list()
+    for result in results:
+        before = previous.get(result['name'])
+        if before == None or 'wall' not in before or 'wall' not in result:
+            continue
+        if result['wall'] > before['wall'] * (1 + tolerance):
+            regressions.append("%s: %.3f s, was %.3f s" %
+                               (result['name'], result['wall'], before['wall']))
+    return regressions
+
+def readResults(filename):
+    '''
+    Reads results written by an earlier run.
+    '''
+    results = list()
+    for line in open(filename):
+        if line.strip() != '':
+            results.append(json.loads(line))
+    return results
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="benchmark",
+                                     description="Benchmark running Synctity profiles.")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="multiply the size of the synthetic trees (default: %(default)s)")
+    parser.add_argument("--output", help="write results to this file as well")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="fraction a case may slow down before it is reported "
+                        "(default: %(default)s)")
+    parser.add_argument("--dir", help="directory to generate trees in (default: a temporary directory)")
+    parser.add_argument("--startup", action="store_true",
+                        help="also time starting the graphical interface, which needs a display")
+    args = parser.parse_args(argv)
+
+    results = list()
+    scratch = tempfile.mkdtemp(prefix="synctity-benchmark-", dir=args.dir)
+    # keep the filter files that shards and long exclude lists write with
+    # the trees, rather than in the user's own directory
+    rsync.FILTER_DIR = os.path.join(scratch, "filters")
+    try:
+        results.append(measure("scheduler.jobs", lambda: benchmarkScheduler(2000 * args.scale)))
+        results.append(measure("output.parser", lambda: benchmarkParser(100000 * args.scale)))
+        results.append(measure("output.stream", lambda: benchmarkStreaming(64 * BLOCK_SIZE * args.scale, False)))
+        results.append(measure("output.stream-parsed", lambda: benchmarkStreaming(64 * BLOCK_SIZE * args.scale, True)))
+        results.append(measure("runner.fake", lambda: benchmarkRunner(32 * args.scale, 2000)))
+        options = optionProfile(200 * args.scale, 1000)
+        results.append(measure("render.first", lambda: benchmarkRendering(options, 1)))
+        results.append(measure("render.cached", lambda: benchmarkRendering(options, 100)))
+        results.append(measure("options.excludes", lambda: benchmarkExcludes(20000 * args.scale)))
+        if args.startup:
+            results.append(measure("startup", lambda: benchmarkStartup(scratch, 50 * args.scale)))
+        benchmarkCopies(scratch, args.scale, results)
+    finally:
+        shutil.rmtree(scratch)
+
+    lines = [json.dumps(result, sort_keys=True) for result in results]
+    print '\n'.join(lines)
+    if args.output != None:
+        out = open(args.output, 'w')
+        out.write('\n'.join(lines) + '\n')
+        out.close()
+
+    if args.baseline != None:
+        regressions = compare(results, readResults(args.baseline), args.tolerance)
+        for regression in regressions:
+            print >> sys.stderr, "Slower: " + regression
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -44,6 +44,12 @@ optionSet = {'a': ['archive mode', 'archive mode; same as -rlptgoD', None],
              'E': ['extended attributes', 'copy extended attributes', None],
              'D': ['devices + specials', 'preserve device files and special files', None]}
 
+# Ways to split a command's source among parallel rsync processes, with the
+# descriptions shown for them
+shardModes = [(rsync.SHARD_BY_ENTRY, 'top-level entries'),
+              (rsync.SHARD_BY_SIZE, 'balanced by size'),
+              (rsync.SHARD_BY_FILES, 'balanced by file count')]
+
 class OptionModel(QtCore.QAbstractTableModel):
     '''
     A model for maintaining a list of options as name-value pairs.  This is a
@@ -170,6 +176,7 @@ class CommandForm(QtGui.QDialog):
         self.ui = Ui_CommandForm()
         self.ui.setupUi(self)
         self.initializeOptions()
+        self.initializeScheduling()
         
         self.optionModel = OptionModel(self)
         self.ui.tableOptions.setModel(self.optionModel)
@@ -181,12 +188,18 @@ class CommandForm(QtGui.QDialog):
                 
         # set up the rsync command
         self.command = None
+        # the commands this one may depend on
+        self.candidates = list()
                         
-    def setCommand(self, command):
+    def setCommand(self, command, commands=()):
         '''
-        Set the command that this form configures.
+        Set the command that this form configures.  commands are the other
+        commands in its profile, which it may depend on.
         '''
         self.command = command
+        # a command cannot depend on itself, or on a command that depends on it
+        self.candidates = [other for other in commands 
+                           if other is not command and not other.dependsOn(command)]
         self.dataToForm()
         
     def dataToForm(self):
@@ -210,6 +223,31 @@ class CommandForm(QtGui.QDialog):
                 
         self.optionModel.setOptions(self.command.getOptions())
         
+        # list the commands this one may depend on, checking the ones it does
+        self.listDepends.blockSignals(True)
+        self.listDepends.clear()
+        for other in self.candidates:
+            item = QtGui.QListWidgetItem(other.getDescription(), self.listDepends)
+            item.setFlags(QtCore.Qt.ItemIsUserCheckable | QtCore.Qt.ItemIsEnabled)
+            if other in self.command.getDepends():
+                item.setCheckState(QtCore.Qt.Checked)
+            else:
+                item.setCheckState(QtCore.Qt.Unchecked)
+        self.listDepends.blockSignals(False)
+        
+        # the sharding settings
+        self.spinShards.blockSignals(True)
+        self.spinShards.setValue(self.command.getShards())
+        self.spinShards.blockSignals(False)
+        self.comboShardMode.blockSignals(True)
+        for (idx, (mode, description)) in enumerate(shardModes):
+            if mode == self.command.getShardMode():
+                self.comboShardMode.setCurrentIndex(idx)
+        self.comboShardMode.blockSignals(False)
+        self.checkIncremental.blockSignals(True)
+        self.checkIncremental.setChecked(self.command.getIncremental())
+        self.checkIncremental.blockSignals(False)
+        
         # update the text that shows the command written out
         self.ui.labelCommand.setText(str(self.command))
         
@@ -227,6 +265,25 @@ class CommandForm(QtGui.QDialog):
         # update the text that shows the command written out
         self.ui.labelCommand.setText(str(self.command))
         
+    def onCheckDepends(self, item):
+        '''
+        Respond to dependencies being checked.
+        '''
+        depends = list()
+        for row in range(self.listDepends.count()):
+            if self.listDepends.item(row).checkState() == QtCore.Qt.Checked:
+                depends.append(self.candidates[row])
+        self.command.setDepends(depends)
+        
+    def onShards(self, value):
+        self.command.setShards(value)
+        
+    def onShardMode(self, index):
+        self.command.setShardMode(shardModes[index][0])
+        
+    def onIncremental(self, checked):
+        self.command.setIncremental(checked)
+        
     def onAdvancedOption(self, index1, index2):
         self.onCheckOption()
         
@@ -334,3 +391,40 @@ class CommandForm(QtGui.QDialog):
             optionSet[key][2] = button
             layout.addWidget(button, idx % rows, idx / rows)
             idx += 1
+            
+    def initializeScheduling(self):
+        '''
+        Build the scheduling tab.  This lists the other commands in the
+        profile; a command only runs after the commands checked here have
+        succeeded.  It also sets how many parallel rsync processes the 
+        source is split among.
+        '''
+        tab = QtGui.QWidget()
+        layout = QtGui.QGridLayout(tab)
+        label = QtGui.QLabel("Run this command after these commands succeed:", tab)
+        layout.addWidget(label, 0, 0, 1, 3)
+        self.listDepends = QtGui.QListWidget(tab)
+        layout.addWidget(self.listDepends, 1, 0, 1, 3)
+        self.connect(self.listDepends, QtCore.SIGNAL("itemChanged(QListWidgetItem*)"), 
+                     self.onCheckDepends)
+        
+        label = QtGui.QLabel("Shards", tab)
+        layout.addWidget(label, 2, 0)
+        self.spinShards = QtGui.QSpinBox(tab)
+        self.spinShards.setRange(1, 64)
+        self.spinShards.setToolTip("Split a local source among this many parallel rsync processes")
+        layout.addWidget(self.spinShards, 2, 1)
+        self.connect(self.spinShards, QtCore.SIGNAL("valueChanged(int)"), self.onShards)
+        self.comboShardMode = QtGui.QComboBox(tab)
+        for (mode, description) in shardModes:
+            self.comboShardMode.addItem(description)
+        layout.addWidget(self.comboShardMode, 2, 2)
+        self.connect(self.comboShardMode, QtCore.SIGNAL("currentIndexChanged(int)"), 
+                     self.onShardMode)
+        
+        self.checkIncremental = QtGui.QCheckBox("Only transfer what changed since the last run", tab)
+        self.checkIncremental.setToolTip("Keep an index of a local source and give rsync a list of "
+                                         "the changed paths; a full run is still made once a day")
+        layout.addWidget(self.checkIncremental, 3, 0, 1, 3)
+        self.connect(self.checkIncremental, QtCore.SIGNAL("toggled(bool)"), self.onIncremental)
+        self.ui.tabPaths.addTab(tab, "Scheduling")
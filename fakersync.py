@@ -0,0 +1,226 @@
+#!/usr/bin/env python2.7
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+A stand-in for rsync that copies nothing, for testing how Synctity runs
+profiles without a network or large trees.  It takes the same command line
+as rsync, and writes the output rsync would for the options given: file
+names, or itemized changes with -i, progress lines with -P or --progress,
+and the closing totals with -v or --stats.  Point Synctity at it with the
+SYNCTITY_RSYNC environment variable, or with --rsync on the command line:
+
+    SYNCTITY_RSYNC=./fakersync.py python headless.py run PROFILE
+
+What it pretends to do is set with environment variables:
+
+    FAKERSYNC_FILES     files to name (default 100), or the paths listed by
+                        --files-from, if given
+    FAKERSYNC_SIZE      size of each file in bytes (default 1 MB)
+    FAKERSYNC_RATE      bytes per second the transfer takes, if set
+    FAKERSYNC_DURATION  seconds the whole run takes, overriding the rate
+    FAKERSYNC_PROGRESS  progress lines per file with -P (default 4)
+    FAKERSYNC_ERRORS    error lines to write to standard error (default 0)
+    FAKERSYNC_EXIT      exit status (default 0); CODE:FRACTION exits with
+                        CODE from that fraction of command lines, and 0
+                        from the others
+
+The same command line always gives the same output and exit status.
+'''
+import hashlib
+import os
+import random
+import sys
+import time
+
+# rsync's exit status for a transfer that partly failed
+PARTIAL_TRANSFER = 23
+
+def setting(name, default, convert=int):
+    '''
+    Reads a setting from the environment.
+    '''
+    value = os.environ.get('FAKERSYNC_' + name, '')
+    if value == '':
+        return default
+    return convert(value)
+
+def parseArgs(args):
+    '''
+    Returns the flags and parameters given, the source and destination.
+    Short flags are split out of groups, and long options map to their
+    parameter, or '' if they have none.
+    '''
+    flags = set()
+    params = dict()
+    paths = list()
+    idx = 0
+    while idx < len(args):
+        arg = args[idx]
+        if arg.startswith('--'):
+            if '=' in arg:
+                (name, value) = arg[2:].split('=', 1)
+            else:
+                (name, value) = (arg[2:], '')
+            params[name] = value
+        elif arg.startswith('-') and len(arg) > 1:
+            for flag in arg[1:]:
+                flags.add(flag)
+                if flag == 'e' and idx + 1 < len(args):
+                    # -e takes the next argument
+                    idx += 1
+                    break
+        else:
+            paths.append(arg)
+        idx += 1
+    paths = (['.', '.'] + paths)[-2:]
+    return (flags, params, paths[0], paths[1])
+
+def listed(filename, separator):
+    '''
+    Returns the paths in a --files-from list.
+    '''
+    source = open(filename, 'rb')
+    try:
+        return [path for path in source.read().split(separator) if path != '']
+    finally:
+        source.close()
+
+def human(count):
+    ''' Writes a number with thousands separators, as rsync does. '''
+    return "{0:,}".format(int(count))
+
+def main(args):
+    (flags, params, source, destination) = parseArgs(args)
+    commandline = ' '.join(args)
+    seed = int(hashlib.sha1(commandline).hexdigest()[:8], 16)
+    rand = random.Random(seed)
+
+    if 'files-from' in params:
+        separator = '\n'
+        if 'from0' in params or '0' in flags:
+            separator = '\0'
+        try:
+            paths = listed(params['files-from'], separator)
+        except IOError, e:
+            sys.stderr.write("rsync: failed to open files-from file %s: %s\n" %
+                             (params['files-from'], e.strerror))
+            return 3
+    else:
+        top = os.path.basename(source.rstrip('/')) + '/'
+        if source.endswith('/') or top == '/':
+            top = ''
+        paths = ["%sdir%03d/file%06d" % (top, idx % 97, idx)
+                 for idx in range(setting('FILES', 100))]
+    size = setting('SIZE', 1024 * 1024)
+    dryRun = 'n' in flags or 'dry-run' in params
+    itemize = 'i' in flags or 'itemize-changes' in params
+    showProgress = 'P' in flags or 'progress' in params
+    verbose = 'v' in flags or 'verbose' in params or 'stats' in params
+    total = size * len(paths)
+
+    # spread the run's time over its files
+    duration = setting('DURATION', None, float)
+    if duration == None:
+        rate = setting('RATE', None, float)
+        duration = 0.0
+        if rate != None and rate > 0:
+            duration = total / rate
+    if dryRun:
+        duration = 0.0
+    pause = 0.0
+    if len(paths) > 0:
+        pause = duration / len(paths)
+    updates = 0
+    if showProgress and not dryRun:
+        updates = max(1, setting('PROGRESS', 4))
+
+    out = sys.stdout
+    out.write("sending incremental file list\n")
+    for (idx, path) in enumerate(paths):
+        if itemize:
+            out.write(">f+++++++++ %s\n" % path)
+        else:
+            out.write(path + "\n")
+        for step in range(1, updates + 1):
+            done = size * step / updates
+            elapsed = pause * step / updates
+            speed = size / max(pause, 0.001)
+            out.write("%15s %3d%% %7.2fMB/s    0:00:%02d" %
+                      (human(done), 100 * step / updates, speed / 1000000.0,
+                       int(pause - elapsed) % 60))
+            if step == updates:
+                out.write(" (xfr#%d, to-chk=%d/%d)\n" % (idx + 1, len(paths) - idx - 1,
+                                                        len(paths)))
+            else:
+                out.write("\r")
+            out.flush()
+            if pause > 0:
+                time.sleep(pause / updates)
+        if updates == 0 and pause > 0:
+            out.flush()
+            time.sleep(pause)
+    out.flush()
+
+    errors = setting('ERRORS', 0)
+    for idx in range(errors):
+        path = source
+        if len(paths) > 0:
+            path = paths[rand.randrange(len(paths))]
+        sys.stderr.write('rsync: send_files failed to open "%s": Permission denied (13)\n' % path)
+    sys.stderr.flush()
+
+    (sent, literal) = (0, 0)
+    if not dryRun:
+        (sent, literal) = (total + 40 * len(paths), total)
+    received = 30 * len(paths) + 35
+    # the rate is worked out from the time the run should take, so the
+    # output is the same however long it took
+    elapsed = max(duration, 0.001)
+    if 'stats' in params:
+        out.write("\nNumber of files: %s\n" % human(len(paths)))
+        out.write("Number of created files: %s\n" % human(len(paths)))
+        out.write("Number of deleted files: 0\n")
+        out.write("Number of regular files transferred: %s\n" % human(len(paths)))
+        out.write("Total file size: %s bytes\n" % human(total))
+        out.write("Total transferred file size: %s bytes\n" % human(total))
+        out.write("Literal data: %s bytes\n" % human(literal))
+        out.write("Matched data: 0 bytes\n")
+        out.write("Total bytes sent: %s\n" % human(sent))
+        out.write("Total bytes received: %s\n" % human(received))
+    if verbose:
+        out.write("\nsent %s bytes  received %s bytes  %s.00 bytes/sec\n" %
+                  (human(sent), human(received), human((sent + received) / elapsed)))
+        out.write("total size is %s  speedup is 1.00%s\n" %
+                  (human(total), dryRun and " (DRY RUN)" or ""))
+    out.flush()
+
+    status = os.environ.get('FAKERSYNC_EXIT', '0')
+    if ':' in status:
+        (code, fraction) = status.split(':', 1)
+        # decided by the command line alone, whatever else is set
+        if seed / float(0x100000000) < float(fraction):
+            return int(code)
+        return 0
+    if int(status) == 0 and errors > 0:
+        return PARTIAL_TRANSFER
+    return int(status)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
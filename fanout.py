@@ -0,0 +1,119 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+Copies one source to several mirrors with a single transfer.  Of the
+commands that copy the same source with the same options, the first is run
+with --write-batch, which records the changes it makes to its destination
+in a batch file.  The batch is then applied to each of the other
+destinations with --read-batch, which needs neither the source nor a scan
+of it.
+
+A batch only applies cleanly to a destination that was the same as the
+first one before the transfer.  A mirror that has drifted is copied from
+the source as usual, as is every mirror if the first transfer fails.
+'''
+import hashlib
+import os
+import pipes
+
+import rsync
+
+# Where batch files are written
+BATCH_DIR = os.path.expanduser("~/.synctity/batch")
+
+def key(command):
+    '''
+    Returns what commands must share to be copied from one batch.
+    '''
+    return (str(command.getSource()), str(command.getOptions()))
+
+def groups(commands):
+    '''
+    Returns lists of two or more of the commands that copy the same source
+    with the same options, in profile order.  Sharded and incremental
+    commands are left out, since they do not run as a single transfer.
+    '''
+    found = dict()
+    order = list()
+    for command in commands:
+        if command.getShards() > 1 or command.getIncremental():
+            continue
+        if key(command) not in found:
+            found[key(command)] = list()
+            order.append(key(command))
+        found[key(command)].append(command)
+    return [found[k] for k in order if len(found[k]) > 1]
+
+def batchFile(command):
+    '''
+    Returns the name of the batch file the first command of a group writes.
+    '''
+    return os.path.join(BATCH_DIR, hashlib.sha1(command.forward()).hexdigest() + '.batch')
+
+def writeCommand(command):
+    '''
+    Returns a copy of the first command of a group that writes its changes
+    to the batch file.
+    '''
+    if not os.path.isdir(BATCH_DIR):
+        os.makedirs(BATCH_DIR)
+    options = command.getOptions().copy()
+    options.enable('write-batch', pipes.quote(batchFile(command)))
+    return rsync.Command(command.getSource(), command.getDestination(), options)
+
+def readCommandline(command, first):
+    '''
+    Returns the command line that applies the first command's batch to
+    another command's destination, as it is shown.
+    '''
+    return "%s %s --read-batch=%s %s" % (rsync.RSYNC, command.getOptions(),
+                                         pipes.quote(batchFile(first)),
+                                         command.getDestination())
+
+def readArguments(command, first):
+    '''
+    Returns the arguments that apply the first command's batch to another
+    command's destination.
+    '''
+    return (rsync.program() + command.getOptions().getArguments() +
+            ("--read-batch=" + batchFile(first), command.getDestination().getArgument()))
+
+class Cleanup:
+    '''
+    Deletes a batch file once every command reading it has finished.  One
+    is shared by the jobs that read the batch, as their update, so it is
+    told as each of them finishes, whether or not it succeeded.
+    '''
+    def __init__(self, filename, readers):
+        self.filename = filename
+        self.readers = readers
+
+    def commit(self):
+        self.readers -= 1
+        if self.readers == 0:
+            # rsync also writes a script that replays the batch
+            for name in (self.filename, self.filename + '.sh'):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+
+    def discard(self):
+        self.commit()
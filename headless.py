@@ -0,0 +1,308 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+Runs Synctity profiles from the command line, without the graphical
+interface.  Nothing here imports PyQt, so profiles can be run from cron or
+on a server with no display:
+
+    python headless.py run PROFILE [--reverse] [--preview | --apply] [--file FILE]
+    python headless.py watch PROFILE [--file FILE]
+    python headless.py list [--file FILE]
+    python headless.py history PROFILE [--history FILE]
+    python headless.py space PROFILE [--file FILE]
+'''
+import argparse
+import Queue
+import select
+import sqlite3
+import sys
+import threading
+
+import history
+import preview
+import progress
+import rsync
+import scheduler
+import snapshot
+import space
+import store
+import watch
+
+def findProfile(profiles, name):
+    '''
+    Returns the profile, or store entry, with the given name, or None if
+    there is none.
+    '''
+    for profile in profiles:
+        if profile.getName() == name:
+            return profile
+    return None
+
+def runProfile(profile, reverse=False, maxProcesses=scheduler.MAX_PROCESSES,
+               runs=None, mode=None, release=None):
+    '''
+    Runs all commands in a profile, honouring the same pre-sync, post-sync
+    and concurrency rules as the graphical runner.  Process output is
+    echoed to this process' standard output and error as it arrives.  If
+    runs is a history.History, every command run is recorded in it.  mode
+    previews the commands or applies their previews, and release is called
+    with each command once it has finished; see
+    scheduler.Scheduler.queueProfile.
+    Returns the number of commands that failed or were skipped.  Raises a
+    ValueError if the commands' dependencies form a cycle.
+    '''
+    jobs = scheduler.Scheduler(maxProcesses)
+    jobs.queueProfile(profile, reverse, mode, release)
+
+    # each job runs on its own thread, which reports back through a queue
+    finished = Queue.Queue()
+    def run(job):
+        # the loop below waits for every job it starts, so a job that
+        # cannot be prepared or run is reported as failed rather than lost
+        try:
+            if job.prepare != None:
+                # preparing may scan the command's source, so it is done
+                # here rather than holding up the jobs still to start
+                try:
+                    job.prepare(job)
+                except Exception, e:
+                    print >> sys.stderr, "Cannot prepare %s: %s" % (job.description, e)
+                    finished.put((job, -1, None, None))
+                    return
+            print "Executing: " + job.commandline
+            sys.stdout.flush()
+            parser = progress.ProgressParser(job.listener)
+            if job.argv != None:
+                exitCode = rsync.run(job.argv, parser.tee())
+            else:
+                exitCode = rsync.run(job.commandline, parser.tee())
+            if exitCode != 0 and job.fallback != None:
+                (job.commandline, job.argv) = job.fallback
+                print "Failed (%d), so executing: %s" % (exitCode, job.commandline)
+                sys.stdout.flush()
+                exitCode = rsync.run(job.argv, parser.tee())
+            parser.close()
+        except Exception, e:
+            print >> sys.stderr, "Cannot run %s: %s" % (job.description, e)
+            finished.put((job, -1, None, None))
+            return
+        finished.put((job, exitCode, parser.stats, parser.changes))
+
+    failures = 0
+    while not jobs.isIdle():
+        # start everything the scheduler allows
+        job = jobs.next()
+        while job != None:
+            if job.skipped:
+                print "Skipped: %s (a command it depends on did not succeed)" % job.commandline
+                failures += 1
+                job = jobs.next()
+                continue
+            thread = threading.Thread(target=run, args=(job,))
+            thread.daemon = True
+            thread.start()
+            job = jobs.next()
+        if len(jobs.running) == 0:
+            # everything left was skipped
+            continue
+
+        # wait for a job to finish, which may free a slot for the next one
+        (job, exitCode, stats, changes) = finished.get()
+        job.stats = stats
+        job.changes = changes
+        # shards of a command are reported once, when the last one finishes
+        job = jobs.finish(job, exitCode)
+        if job == None:
+            continue
+        if runs != None:
+            try:
+                runs.record(job)
+            except sqlite3.Error, e:
+                print >> sys.stderr, "Cannot record %s in the history: %s" % (
+                    job.description, e)
+        print "Finished (%d) in %.1f s: %s" % (job.exitCode, job.duration(), 
+                                              job.commandline)
+        if job.changes != None and str(job.changes) != "":
+            print "Changes: " + str(job.changes)
+        if job.exitCode != 0:
+            failures += 1
+
+    # expired snapshots are deleted in the background, which exiting would
+    # cut short, so wait for that once everything else is done
+    for pruner in jobs.pruners:
+        if pruner.ident != None:
+            pruner.join()
+            print pruner.summary()
+    return failures
+
+def watchProfile(profile, maxProcesses=scheduler.MAX_PROCESSES, runs=None):
+    '''
+    Runs a profile forward, then keeps watching the local sources of its
+    commands and copies whatever changes, until interrupted.  Raises an
+    OSError if the sources cannot be watched, and a ValueError if the
+    commands' dependencies form a cycle.
+    '''
+    # watch first, so nothing that changes during the first run is missed
+    watcher = watch.Watcher(profile)
+    try:
+        runProfile(profile, False, maxProcesses, runs)
+        print "Watching for changes"
+        sys.stdout.flush()
+        while True:
+            (ready, _, _) = select.select([watcher], [], [], watcher.timeout())
+            if len(ready) > 0:
+                watcher.process()
+            if watcher.ready():
+                runProfile(watcher.take(), False, maxProcesses, runs,
+                           release=watcher.release)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+def printHistory(runs, name):
+    '''
+    Prints how long each command in a profile takes, slowest first.
+    '''
+    print "%6s %10s %10s %10s %10s  %s" % ("runs", "average", "latest", 
+                                          "sent", "received", "command")
+    for row in runs.summary(name):
+        print "%6d %9.1fs %9.1fs %10s %10s  %s" % (
+            row["runs"], row["average"] or 0, row["latest"] or 0,
+            progress.size(row["sent"] or 0), 
+            progress.size(row["received"] or 0), row["command"])
+
+def printSpace(profile):
+    '''
+    Prints how much disk space each of a profile's backup snapshots takes,
+    and how much they take together.  Returns the exit status of the scan.
+    '''
+    accounting = space.Accounting(profile.getSnapshot(),
+                                  snapshot.remoteShell(profile.getCommands()))
+    try:
+        exitCode = accounting.update()
+        if exitCode != 0:
+            print >> sys.stderr, "Could not scan the snapshots of %s (%d)" % (
+                profile.getName(), exitCode)
+        (rows, size, total) = accounting.report()
+    finally:
+        accounting.close()
+    print "%10s %10s %10s  %s" % ("size", "added", "unique", "snapshot")
+    for (name, used, added, unique) in rows:
+        print "%10s %10s %10s  %s" % (progress.size(used), progress.size(added),
+                                     progress.size(unique), name)
+    print "%10s %10s %10s  %s" % (progress.size(size), "", progress.size(total), "total")
+    return exitCode
+
+def main(argv):
+    # options shared by every action, given after the action name
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--file", default=store.DEFAULT_CONFIG,
+                        help="profile file to read (default: %(default)s)")
+    common.add_argument("--history", default=history.DEFAULT_HISTORY,
+                        help="run history database (default: %(default)s)")
+    common.add_argument("--rsync", default=rsync.RSYNC,
+                        help="rsync program to run, such as fakersync.py for testing "
+                        "(default: %(default)s)")
+
+    parser = argparse.ArgumentParser(prog="synctity",
+                                     description="Run Synctity profiles without the graphical interface.")
+    commands = parser.add_subparsers(dest="action")
+    run = commands.add_parser("run", parents=[common], help="run a profile")
+    run.add_argument("profile", help="name of the profile to run")
+    run.add_argument("--reverse", action="store_true",
+                     help="run the profile from destination to source")
+    dry = run.add_mutually_exclusive_group()
+    dry.add_argument("--preview", dest="mode", action="store_const", const=preview.DRY_RUN,
+                     help="dry run the commands, and keep the changes they would make")
+    dry.add_argument("--apply", dest="mode", action="store_const", const=preview.APPLY,
+                     help="run the commands for real, copying just the previewed "
+                     "changes where the source has not changed since")
+    follow = commands.add_parser("watch", parents=[common],
+                                 help="run a profile, then copy changes as they happen")
+    follow.add_argument("profile", help="name of the profile to watch")
+    commands.add_parser("list", parents=[common], 
+                        help="list the profiles in the profile file")
+    report = commands.add_parser("history", parents=[common],
+                                 help="show how long a profile's commands take")
+    report.add_argument("profile", help="name of the profile to report on")
+    usage = commands.add_parser("space", parents=[common],
+                                help="show how much space a profile's snapshots take")
+    usage.add_argument("profile", help="name of the profile to report on")
+    args = parser.parse_args(argv)
+    rsync.RSYNC = args.rsync
+
+    if args.action == "history":
+        printHistory(history.History(args.history), args.profile)
+        return 0
+
+    # only the names are read, and then the one profile wanted
+    profiles = store.Store(args.file)
+    try:
+        entries = profiles.index()
+    except Exception:
+        entries = None
+    if entries == None:
+        print >> sys.stderr, "Cannot read profiles from " + args.file
+        return 2
+
+    if args.action == "list":
+        for entry in entries:
+            print entry.getName()
+        return 0
+
+    entry = findProfile(entries, args.profile)
+    if entry == None:
+        print >> sys.stderr, "No profile named " + args.profile
+        return 2
+    profile = profiles.get(entry)
+    if profile == None:
+        print >> sys.stderr, "Cannot read profile " + args.profile
+        return 2
+    if args.action == "space":
+        if profile.getSnapshot() == None:
+            print >> sys.stderr, "Profile %s does not keep snapshots" % args.profile
+            return 2
+        try:
+            if printSpace(profile) != 0:
+                return 1
+        except (sqlite3.Error, EnvironmentError), e:
+            print >> sys.stderr, "Cannot account for snapshots: " + str(e)
+            return 2
+        return 0
+    if args.action == "watch":
+        try:
+            watchProfile(profile, runs=history.History(args.history))
+        except (OSError, ValueError), e:
+            print >> sys.stderr, "Cannot watch profile: " + str(e)
+            return 2
+        return 0
+    try:
+        failures = runProfile(profile, args.reverse, runs=history.History(args.history),
+                              mode=args.mode)
+    except ValueError, e:
+        print >> sys.stderr, "Cannot run profile: " + str(e)
+        return 2
+    if failures > 0:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
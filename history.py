@@ -0,0 +1,131 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+'''
+import os
+import sqlite3
+
+DEFAULT_HISTORY=os.path.expanduser("~/synctity-history.db")
+
+# Columns filled in from the rsync --stats summary, and the progress.Stats
+# attributes they come from
+STATS_COLUMNS = (('files', 'files'),
+                 ('transferred', 'transferred'),
+                 ('totalsize', 'totalSize'),
+                 ('transferredsize', 'transferredSize'),
+                 ('literal', 'literalData'),
+                 ('matched', 'matchedData'),
+                 ('sent', 'bytesSent'),
+                 ('received', 'bytesReceived'))
+
+def text(value):
+    '''
+    Converts a value to a plain string for storing, as names and commands
+    may come from the window as QStrings, which sqlite3 cannot store.
+    None is kept as it is.
+    '''
+    if value == None:
+        return None
+    return str(value)
+
+class History:
+    '''
+    A record of every command run, kept in an SQLite database.  Each run
+    is stored with its profile name and command description, when it was
+    queued, started and finished, its exit code, the transfer totals
+    rsync reported, if any, and the counts of itemized changes, written out
+    by progress.Tally.encode.
+    '''
+    def __init__(self, filename=DEFAULT_HISTORY):
+        self.connection = sqlite3.connect(filename)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "id INTEGER PRIMARY KEY, profile TEXT, command TEXT, "
+            "commandline TEXT, queued REAL, started REAL, finished REAL, "
+            "exitcode INTEGER, " +
+            ", ".join(["%s INTEGER" % column for (column, attr) in STATS_COLUMNS]) +
+            ", changes TEXT)")
+        # databases written before changes were counted lack the column
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(runs)")]
+        if 'changes' not in columns:
+            self.connection.execute("ALTER TABLE runs ADD COLUMN changes TEXT")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS runs_command ON runs (profile, command)")
+        self.connection.commit()
+
+    def record(self, job):
+        '''
+        Stores a finished scheduler.Job, along with the progress.Stats and
+        progress.Tally parsed from its output, if there were any.
+        '''
+        stats = job.stats
+        values = [text(job.profile), text(job.description),
+                  text(job.commandline), job.queued, job.started,
+                  job.finished, job.exitCode]
+        for (column, attr) in STATS_COLUMNS:
+            value = None
+            if stats != None:
+                value = getattr(stats, attr)
+            if value != None:
+                value = int(value)
+            values.append(value)
+        changes = job.changes
+        if changes != None:
+            changes = changes.encode()
+        values.append(changes)
+        self.connection.execute(
+            "INSERT INTO runs (profile, command, commandline, queued, started, "
+            "finished, exitcode, " +
+            ", ".join([column for (column, attr) in STATS_COLUMNS]) +
+            ", changes) VALUES (" + ", ".join(["?"] * len(values)) + ")", values)
+        self.connection.commit()
+
+    def runs(self, profile, command=None, limit=100):
+        '''
+        Returns the most recent runs of a profile, or of one command in it,
+        newest first.
+        '''
+        if command == None:
+            return self.connection.execute(
+                "SELECT * FROM runs WHERE profile = ? "
+                "ORDER BY started DESC LIMIT ?", (profile, limit)).fetchall()
+        return self.connection.execute(
+            "SELECT * FROM runs WHERE profile = ? AND command = ? "
+            "ORDER BY started DESC LIMIT ?", (profile, command, limit)).fetchall()
+
+    def summary(self, profile):
+        '''
+        Summarizes the runs of each command in a profile: the number of
+        runs, the average and most recent run times in seconds, and the
+        average bytes sent and received.  The commands that take longest
+        come first.
+        '''
+        return self.connection.execute(
+            "SELECT command, COUNT(*) AS runs, "
+            "AVG(finished - started) AS average, "
+            "(SELECT finished - started FROM runs AS last "
+            " WHERE last.profile = runs.profile AND last.command = runs.command "
+            " ORDER BY started DESC LIMIT 1) AS latest, "
+            "AVG(sent) AS sent, AVG(received) AS received "
+            "FROM runs WHERE profile = ? GROUP BY command "
+            "ORDER BY average DESC", (profile,)).fetchall()
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,307 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+Keeps an index of what a command's local source looked like the last time
+the command succeeded, so the next run can give rsync only the paths that
+changed since then instead of making it compare the whole tree.
+'''
+import hashlib
+import os
+import Queue
+import sqlite3
+import stat
+import sys
+import threading
+import time
+
+import rsync
+import shard
+
+# Where the indexes and the lists of changed paths are kept
+INDEX_DIR = os.path.expanduser("~/.synctity/index")
+# An incremental command still runs in full once this many seconds have
+# passed since its last full run, to catch anything the index missed
+FULL_INTERVAL = 24 * 3600
+# The number of threads that scan a source
+SCAN_THREADS = 8
+
+# Options that a list of changed paths cannot stand in for: the command
+# already has a file list, compares against another tree, decides what
+# changed by content or by following links, or does not transfer at all.
+UNINDEXABLE = ('files-from', 'delete-excluded', 'link-dest', 'compare-dest',
+               'copy-dest', 'c', 'checksum', 'x', 'one-file-system', 'L',
+               'copy-links', 'k', 'copy-dirlinks', 'H', 'hard-links',
+               'n', 'dry-run')
+# Options that make rsync recurse.  One of them is needed for a full run to
+# cover the whole tree.
+RECURSIVE = ('a', 'archive', 'r', 'recursive')
+
+def scan(root, threads=SCAN_THREADS, visit=None):
+    '''
+    Walks a local directory with several threads, and returns a dictionary
+    mapping the path of everything below it, relative to root, to its size,
+    modification and change times, inode and whether it is a directory.
+    Also returns whether the whole tree could be read.  If visit is given,
+    it is called from the scanning threads with the path and entry of
+    everything found, instead of the entries being collected, and the
+    dictionary returned is empty.  An error other than an unreadable file
+    stops the scan and is raised again here.
+    '''
+    entries = dict()
+    errors = list()
+    failures = list()
+    pending = Queue.Queue()
+
+    def work():
+        while True:
+            relative = pending.get()
+            if relative == None:
+                return
+            try:
+                if len(failures) > 0:
+                    # the scan has failed, so the rest is skipped
+                    continue
+                try:
+                    names = os.listdir(os.path.join(root, relative))
+                except OSError:
+                    errors.append(relative)
+                    names = list()
+                for name in names:
+                    path = os.path.join(relative, name)
+                    try:
+                        info = os.lstat(os.path.join(root, path))
+                    except OSError:
+                        # removed since the directory was listed
+                        continue
+                    isdir = stat.S_ISDIR(info.st_mode)
+                    entry = (info.st_size, info.st_mtime, info.st_ctime,
+                             info.st_ino, isdir)
+                    if visit != None:
+                        visit(path, entry)
+                    else:
+                        entries[path] = entry
+                    if isdir:
+                        pending.put(path)
+            except Exception:
+                failures.append(sys.exc_info())
+            finally:
+                pending.task_done()
+
+    workers = [threading.Thread(target=work) for idx in range(threads)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    pending.put('')
+    pending.join()
+    for worker in workers:
+        pending.put(None)
+    for worker in workers:
+        worker.join()
+    if len(failures) > 0:
+        raise failures[0][0], failures[0][1], failures[0][2]
+    return (entries, len(errors) == 0)
+
+def changes(old, new):
+    '''
+    Compares two scans, and returns the paths that are new or changed and the
+    paths that are gone, each sorted.
+    '''
+    changed = [path for (path, entry) in new.iteritems() if old.get(path) != entry]
+    deleted = [path for path in old if path not in new]
+    changed.sort()
+    deleted.sort()
+    return (changed, deleted)
+
+def topmost(paths):
+    '''
+    Drops the paths from a sorted list that lie below another path in it.
+    '''
+    result = list()
+    for path in paths:
+        if len(result) == 0 or not path.startswith(result[-1] + '/'):
+            result.append(path)
+    return result
+
+class Index:
+    '''
+    The scan of a command's source as of its last successful run, kept in
+    an SQLite database, along with when the command last ran in full.
+    '''
+    def __init__(self, key):
+        if not os.path.isdir(INDEX_DIR):
+            os.makedirs(INDEX_DIR)
+        # the index is read where the job is prepared and updated where it
+        # finishes, which may be different threads, though never at once
+        self.connection = sqlite3.connect(os.path.join(INDEX_DIR, key + '.db'),
+                                          check_same_thread=False)
+        self.connection.text_factory = str
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, "
+            "size INTEGER, mtime REAL, ctime REAL, inode INTEGER, isdir INTEGER)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value REAL)")
+        self.connection.commit()
+
+    def entries(self):
+        '''
+        Returns the indexed entries, in the form scan() returns them.
+        '''
+        entries = dict()
+        for row in self.connection.execute(
+                "SELECT path, size, mtime, ctime, inode, isdir FROM entries"):
+            entries[row[0]] = (row[1], row[2], row[3], row[4], bool(row[5]))
+        return entries
+
+    def lastFull(self):
+        '''
+        Returns when the command last succeeded in a full run, or None if it
+        never has.
+        '''
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE name = 'full'").fetchone()
+        if row == None:
+            return None
+        return row[0]
+
+    def update(self, entries, changed, deleted, full):
+        '''
+        Saves a new scan.  After a full run the index is replaced; after an
+        incremental run only the changed and deleted paths are written.
+        '''
+        if full:
+            self.connection.execute("DELETE FROM entries")
+            changed = entries.keys()
+        for path in deleted:
+            # everything below a deleted directory goes with it
+            self.connection.execute(
+                "DELETE FROM entries WHERE path = ? OR (path > ? AND path < ?)",
+                (path, path + '/', path + '0'))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+            [(path,) + entries[path] for path in changed])
+        if full:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('full', ?)", (time.time(),))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+class Update:
+    '''
+    A scan of a command's source, which is saved to its index once the
+    command has succeeded.  If the command fails, the index is left as it
+    was, so the next run transfers these changes again.
+    '''
+    def __init__(self, index, entries, changed, deleted, full):
+        self.index = index
+        self.entries = entries
+        self.changed = changed
+        self.deleted = deleted
+        self.full = full
+
+    def commit(self):
+        self.index.update(self.entries, self.changed, self.deleted, self.full)
+        self.index.close()
+
+    def discard(self):
+        self.index.close()
+
+def indexable(command, reverse=False):
+    '''
+    Determines whether a command's runs can be narrowed down to the paths
+    that changed: it must ask for it, copy recursively from a local source
+    directory, and use no option that a list of paths cannot stand in for.
+    '''
+    path = shard.sender(command, reverse)
+    options = command.getOptions()
+    return (command.getIncremental() and path.getHost() == '' and
+            path.getUser() == '' and
+            len([opt for opt in UNINDEXABLE if opt in options]) == 0 and
+            len([opt for opt in RECURSIVE if opt in options]) > 0 and
+            os.path.isdir(os.path.expanduser(path.getPath())))
+
+def plan(command, reverse=False):
+    '''
+    Scans the source of an incremental command and returns the command to
+    run and an Update to commit once it succeeds.  When the index is up to
+    date, the command returned copies only the paths that changed since
+    the last successful run, and deletes those that are gone if the command
+    deletes.  Otherwise it is the command itself, run in full.  Commands that
+    cannot be narrowed down are returned with no Update.
+    '''
+    if not indexable(command, reverse):
+        return (command, None)
+    path = shard.sender(command, reverse)
+    root = os.path.expanduser(path.getPath())
+    # the full command line names the index, so changing any part of the
+    # command starts a new one
+    if reverse:
+        commandline = command.reverse()
+    else:
+        commandline = command.forward()
+    key = hashlib.sha1(commandline).hexdigest()
+
+    (entries, complete) = scan(root)
+    if not complete:
+        # something could not be read, so the scan proves nothing
+        return (command, None)
+    index = Index(key)
+    lastFull = index.lastFull()
+    if lastFull == None or time.time() - lastFull > FULL_INTERVAL:
+        return (command, Update(index, entries, None, list(), True))
+    (changed, deleted) = changes(index.entries(), entries)
+
+    narrowed = narrow(command, reverse, changed, deleted, INDEX_DIR)
+    return (narrowed, Update(index, entries, changed, deleted, False))
+
+def narrow(command, reverse, changed, deleted, directory):
+    '''
+    Returns a copy of command that only copies the changed paths, and
+    deletes the deleted paths if the command deletes.  Paths are relative to
+    the command's source directory.  They are listed for rsync in a file in
+    directory, named by its content.
+    '''
+    path = shard.sender(command, reverse)
+    root = os.path.expanduser(path.getPath())
+    # listed paths are relative to the top of the transfer, which is the
+    # source directory itself if it ends with a slash, or its parent if not
+    options = command.getOptions().copy()
+    if path.getPath().endswith('/'):
+        prefix = ''
+        top = path.getPath()
+    else:
+        prefix = os.path.basename(root.rstrip('/')) + '/'
+        top = (os.path.dirname(path.getPath().rstrip('/')) or '.') + '/'
+    listed = [prefix + name for name in changed]
+    deleting = [opt for opt in options if opt.startswith('del')]
+    if len(deleting) > 0:
+        listed.extend([prefix + name for name in topmost(sorted(deleted))])
+        options.enable('delete-missing-args')
+    # with a file list, archive mode does not recurse, but -r still would
+    for opt in deleting + ['r', 'recursive']:
+        options.disable(opt)
+    options.enable('from0')
+    options.enable('files-from', rsync.listFile(listed, directory, '.files', '\0'))
+
+    sender = rsync.Path(top, path.getHost(), path.getUser())
+    if reverse:
+        return rsync.Command(command.getSource(), sender, options)
+    return rsync.Command(sender, command.getDestination(), options)
@@ -0,0 +1,207 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+Previews a command with a dry run, and keeps the list of changes it would
+make, so a later run can copy just those paths rather than compare the
+whole tree again.  A preview is only used if a scan of the command's local
+source shows nothing has changed since the dry run started, and only once.
+'''
+import cPickle
+import hashlib
+import os
+import threading
+
+import index
+import progress
+import rsync
+import shard
+
+# Where previews and the lists of paths they copy are kept
+PREVIEW_DIR = os.path.expanduser("~/.synctity/preview")
+# Ways to run a profile's commands: as a dry run that is kept as a
+# preview, or applying the kept previews
+DRY_RUN = 'preview'
+APPLY = 'apply'
+# Options that a list of changed paths cannot stand in for, apart from the
+# dry run option, which is what a preview is run with
+UNPREVIEWABLE = tuple([opt for opt in index.UNINDEXABLE if opt not in ('n', 'dry-run')])
+
+def real(command):
+    '''
+    Returns a copy of command that is not a dry run.
+    '''
+    options = command.getOptions().copy()
+    options.disable('n')
+    options.disable('dry-run')
+    return rsync.Command(command.getSource(), command.getDestination(), options)
+
+def dryRun(command):
+    '''
+    Returns a copy of command that is a dry run listing every change.
+    '''
+    copy = real(command)
+    copy.getOptions().enable('n')
+    copy.getOptions().enable('i')
+    return copy
+
+def previewable(command, reverse=False):
+    '''
+    Determines whether a command can be previewed: it must copy recursively
+    from a local source directory, with no option a list of paths cannot
+    stand in for.
+    '''
+    path = shard.sender(command, reverse)
+    options = command.getOptions()
+    return (path.getHost() == '' and path.getUser() == '' and
+            len([opt for opt in UNPREVIEWABLE if opt in options]) == 0 and
+            len([opt for opt in index.RECURSIVE if opt in options]) > 0 and
+            os.path.isdir(os.path.expanduser(path.getPath())))
+
+def previewFile(command, reverse=False):
+    '''
+    Returns the name of the file a command's preview is kept in.  The real
+    command line names it, so changing any part of the command drops it.
+    '''
+    command = real(command)
+    if reverse:
+        commandline = command.reverse()
+    else:
+        commandline = command.forward()
+    return os.path.join(PREVIEW_DIR, hashlib.sha1(commandline).hexdigest() + '.preview')
+
+def fingerprint(command, reverse=False):
+    '''
+    Sums up the size, times and inode of everything in a command's source,
+    or returns None if some of it could not be read.  Each entry is hashed
+    as it is scanned, and the hashes are added up, so the sum does not
+    depend on the order the scanning threads find them in and the scan is
+    never held in memory.
+    '''
+    total = [0]
+    lock = threading.Lock()
+    def visit(path, entry):
+        digest = long(hashlib.sha1(repr((path, entry))).hexdigest(), 16)
+        lock.acquire()
+        try:
+            total[0] += digest
+        finally:
+            lock.release()
+    (entries, complete) = index.scan(os.path.expanduser(shard.sender(command, reverse).getPath()),
+                                     visit=visit)
+    if not complete:
+        return None
+    return "%040x" % (total[0] % (1 << 160))
+
+def relative(command, reverse, path):
+    '''
+    Returns a path from the dry run's output relative to the source
+    directory.  Without a trailing slash, rsync names the source directory
+    itself at the start of each path.
+    '''
+    source = shard.sender(command, reverse).getPath()
+    path = path.rstrip('/')
+    if not source.endswith('/'):
+        top = os.path.basename(source.rstrip('/'))
+        if path == top:
+            return '.'
+        path = path[len(top) + 1:]
+    return path or '.'
+
+class Recorder:
+    '''
+    Collects the changes a dry run lists, and keeps them as the command's
+    preview if the dry run succeeds.  It is prepared with the job just
+    before the dry run starts, which is when the source is scanned, then
+    listens to the job's output and is the job's update.
+    '''
+    def __init__(self, command, reverse=False):
+        self.command = command
+        self.reverse = reverse
+        self.fingerprint = None
+        self.changed = list()
+        self.deleted = list()
+
+    def prepare(self, job):
+        self.fingerprint = fingerprint(self.command, self.reverse)
+
+    def listen(self, event):
+        if isinstance(event, (progress.Transfer, progress.Change)):
+            path = relative(self.command, self.reverse, event.path)
+            if event.deleted:
+                self.deleted.append(path)
+            else:
+                self.changed.append(path)
+
+    def commit(self):
+        if self.fingerprint == None:
+            return
+        if not os.path.isdir(PREVIEW_DIR):
+            os.makedirs(PREVIEW_DIR)
+        filename = previewFile(self.command, self.reverse)
+        temp = "%s.%d.tmp" % (filename, os.getpid())
+        out = open(temp, 'wb')
+        try:
+            cPickle.dump((self.fingerprint, self.changed, self.deleted), out,
+                         cPickle.HIGHEST_PROTOCOL)
+        finally:
+            out.close()
+        os.rename(temp, filename)
+
+    def discard(self):
+        pass
+
+class Applied:
+    '''
+    Drops a preview once the run applying it has succeeded.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+
+    def commit(self):
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+    def discard(self):
+        pass
+
+def plan(command, reverse=False):
+    '''
+    Returns the command to run in place of command, and an update to commit
+    once it succeeds.  If the command has a preview and its source has not
+    changed since, the command returned copies only the previewed changes.
+    Otherwise it is the command itself, run in full, with no update.
+    '''
+    command = real(command)
+    filename = previewFile(command, reverse)
+    if not previewable(command, reverse) or not os.path.exists(filename):
+        return (command, None)
+    try:
+        saved = open(filename, 'rb')
+        try:
+            (kept, changed, deleted) = cPickle.load(saved)
+        finally:
+            saved.close()
+    except (EnvironmentError, cPickle.UnpicklingError, EOFError, ValueError):
+        return (command, None)
+    if fingerprint(command, reverse) != kept:
+        return (command, None)
+    return (index.narrow(command, reverse, changed, deleted, PREVIEW_DIR), Applied(filename))
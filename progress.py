@@ -0,0 +1,434 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+'''
+import collections
+import re
+
+import rsync
+
+# The longest partial line kept while waiting for its end.  Anything longer
+# is not rsync progress output, and is dropped.
+MAX_LINE = 64 * 1024
+
+# Multipliers for the unit suffixes rsync uses with --human-readable
+UNITS = {'': 1, 'K': 1000, 'k': 1000, 'M': 1000 ** 2, 'G': 1000 ** 3,
+         'T': 1000 ** 4, 'P': 1000 ** 5}
+
+# A progress line from -P or --info=progress2, e.g.
+#     1,048,576  45%  999.02MB/s    0:00:01 (xfr#1, to-chk=3/10)
+PROGRESS_LINE = re.compile(r'^\s*([\d,.]+)([KMGTP]?)\s+(\d+)%\s+'
+                           r'([\d,.]+)([kKMGTP]?)B/s\s+(\d+):(\d\d):(\d\d)'
+                           r'(?:\s+\((?:xfr|xfer)#(\d+),\s*'
+                           r'(?:to-chk|to-check|ir-chk)=(\d+)/(\d+)\))?\s*$')
+# A line of the --stats summary, e.g. "Literal data: 1,234 bytes"
+STATS_LINE = re.compile(r'^([A-Z][A-Za-z ]+): ([\d,.]+)([KMGTP]?)\b')
+# The closing lines written with -v or --stats
+SENT_LINE = re.compile(r'^sent ([\d,.]+)([KMGTP]?) bytes\s+received ([\d,.]+)([KMGTP]?) bytes'
+                       r'\s+([\d,.]+)([KMGTP]?) bytes/sec')
+TOTAL_LINE = re.compile(r'^total size is ([\d,.]+)([KMGTP]?)\s+speedup is ([\d,.]+)')
+# A line of --itemize-changes output, e.g. ">f.st...... docs/notes.txt",
+# or "*deleting   docs/old.txt"
+ITEM_LINE = re.compile(r'^([<>ch.])([fdLDS])([cstpoguaxnb+?. ]{9}) (.+)$')
+DELETING_LINE = re.compile(r'^\*deleting +(.+)$')
+# What the first character of an itemized line says happened to the path,
+# and what its second says the path is
+UPDATES = {'<': 'sent', '>': 'received', 'c': 'local', 'h': 'linked',
+           '.': 'unchanged', '*': 'deleted'}
+KINDS = {'f': 'files', 'd': 'directories', 'L': 'links', 'D': 'devices',
+         'S': 'specials'}
+# The attributes flagged in the rest of an itemized line, in order
+ATTRIBUTES = ('checksum', 'size', 'time', 'permissions', 'owner', 'group',
+              'atime', 'acl', 'xattr')
+
+# Names of --stats summary lines, and the Stats attributes they fill in
+STATS_NAMES = {'Number of files': 'files',
+               'Number of created files': 'created',
+               'Number of deleted files': 'deleted',
+               'Number of files transferred': 'transferred',
+               'Number of regular files transferred': 'transferred',
+               'Total file size': 'totalSize',
+               'Total transferred file size': 'transferredSize',
+               'Literal data': 'literalData',
+               'Matched data': 'matchedData',
+               'Total bytes sent': 'bytesSent',
+               'Total bytes received': 'bytesReceived'}
+
+# Status lines rsync writes that are not about a particular file
+NOISE = ('sending incremental file list', 'receiving incremental file list',
+         'building file list', 'receiving file list', 'sending file list',
+         'created directory ', 'rsync: ', 'rsync error: ', 'rsync warning: ')
+
+def number(digits, unit=''):
+    '''
+    Converts a number as rsync prints it, e.g. "1,234" or "1.23" with unit
+    "M", to a float.
+    '''
+    return float(digits.replace(',', '')) * UNITS[unit]
+
+def size(bytes):
+    '''
+    Formats a number of bytes for people to read, e.g. "12.3 MB".
+    '''
+    for unit in ('B', 'kB', 'MB', 'GB', 'TB'):
+        if bytes < 1000:
+            break
+        bytes = bytes / 1000.0
+    if unit == 'B':
+        return "%d %s" % (bytes, unit)
+    return "%.1f %s" % (bytes, unit)
+
+class Progress:
+    '''
+    Progress of a transfer, from one -P or --info=progress2 line.  bytes is
+    the amount transferred so far, rate is in bytes per second and eta in
+    seconds.  transfers, remaining and total are the transfer number and the
+    files left to check out of the total, or None if rsync did not say.
+    '''
+    def __init__(self, bytes, percent, rate, eta,
+                 transfers=None, remaining=None, total=None):
+        self.bytes = bytes
+        self.percent = percent
+        self.rate = rate
+        self.eta = eta
+        self.transfers = transfers
+        self.remaining = remaining
+        self.total = total
+        
+    def __str__(self):
+        return "%d%%, %s at %s/s, %d:%02d:%02d left" % (
+            self.percent, size(self.bytes), size(self.rate),
+            self.eta / 3600, self.eta / 60 % 60, self.eta % 60)
+
+class Transfer:
+    '''
+    A file named in the output, either being transferred or deleted.
+    '''
+    def __init__(self, path, deleted=False):
+        self.path = path
+        self.deleted = deleted
+
+class Change(collections.namedtuple('Change', 'update kind flags path')):
+    '''
+    One path from --itemize-changes output: what happened to it, one of the
+    UPDATES, what it is, one of the KINDS or '' if rsync did not say, the
+    attribute flags, and the path as rsync wrote it, without any link
+    target.  Changes are tuples, so they can be kept in bulk cheaply.
+    '''
+    __slots__ = ()
+    
+    @property
+    def deleted(self):
+        return self.update == '*'
+    
+    def created(self):
+        '''
+        Determines whether the path is new.
+        '''
+        return self.flags.startswith('+')
+    
+    def attributes(self):
+        '''
+        Returns the names of the attributes that changed.
+        '''
+        return [name for (name, flag) in zip(ATTRIBUTES, self.flags)
+                if flag not in '.+ ?']
+    
+    def __str__(self):
+        if self.deleted:
+            return "*deleting   " + self.path
+        return self.update + self.kind + self.flags + ' ' + self.path
+
+def parseItem(line):
+    '''
+    Returns the Change an itemized line describes, or None if it is not one.
+    '''
+    match = ITEM_LINE.match(line)
+    if match != None:
+        (update, kind, flags, path) = match.groups()
+        # links are followed by what they point to
+        if kind == 'L' and ' -> ' in path:
+            path = path[:path.rindex(' -> ')]
+        if update == 'h' and ' => ' in path:
+            path = path[:path.rindex(' => ')]
+        return Change(update, kind, flags, path)
+    match = DELETING_LINE.match(line)
+    if match != None:
+        path = match.group(1)
+        kind = ''
+        if path.endswith('/'):
+            kind = 'd'
+        return Change('*', kind, '', path)
+    return None
+
+def itemized(stream):
+    '''
+    Yields the Changes in rsync output read from stream, such as a file or
+    a pipe, one line at a time.  Other lines are skipped.
+    '''
+    for line in stream:
+        change = parseItem(line.rstrip('\r\n'))
+        if change != None:
+            yield change
+
+def select(changes, updates=None, kinds=None, attribute=None):
+    '''
+    Yields the changes that match: whose update is one of updates, whose
+    kind is one of kinds, and that changed the named attribute, for those
+    given.  updates and kinds are given as the characters rsync writes.
+    '''
+    for change in changes:
+        if updates != None and change.update not in updates:
+            continue
+        if kinds != None and change.kind not in kinds:
+            continue
+        if attribute != None and attribute not in change.attributes():
+            continue
+        yield change
+
+class Tally:
+    '''
+    Counts the changes in a run, by UPDATES and KINDS, along with the
+    number of paths created.  A tally is written as "name=count,..." for
+    storing.
+    '''
+    def __init__(self, counts=None):
+        if counts != None:
+            self.counts = counts
+        else:
+            self.counts = dict()
+    
+    def add(self, change):
+        names = [UPDATES[change.update]]
+        if change.kind in KINDS:
+            names.append(KINDS[change.kind])
+        if change.created():
+            names.append('created')
+        for name in names:
+            self.counts[name] = self.counts.get(name, 0) + 1
+    
+    def get(self, name):
+        return self.counts.get(name, 0)
+    
+    def __len__(self):
+        return sum([self.get(name) for name in UPDATES.values()])
+    
+    def __str__(self):
+        return ", ".join(["%d %s" % (self.get(name), name) for name in
+                          ('received', 'sent', 'local', 'linked', 'created', 'deleted')
+                          if self.get(name) > 0])
+    
+    def encode(self):
+        return ",".join(["%s=%d" % (name, count) for (name, count)
+                         in sorted(self.counts.items())])
+    
+    @staticmethod
+    def decode(text):
+        counts = dict()
+        for item in text.split(','):
+            if '=' in item:
+                (name, count) = item.split('=', 1)
+                counts[name] = int(count)
+        return Tally(counts)
+
+def combineTallies(tallies):
+    '''
+    Adds up the Tallies of several runs, or returns None if there are none.
+    '''
+    tallies = [tally for tally in tallies if tally != None]
+    if len(tallies) == 0:
+        return None
+    total = Tally()
+    for tally in tallies:
+        for (name, count) in tally.counts.items():
+            total.counts[name] = total.counts.get(name, 0) + count
+    return total
+
+class Stats:
+    '''
+    The summary rsync writes at the end of a run.  Counts and sizes from
+    --stats are None if the run did not use that option.
+    '''
+    def __init__(self):
+        self.files = None
+        self.created = None
+        self.deleted = None
+        self.transferred = None
+        self.totalSize = None
+        self.transferredSize = None
+        self.literalData = None
+        self.matchedData = None
+        self.bytesSent = None
+        self.bytesReceived = None
+        self.rate = None
+        self.speedup = None
+
+def combine(statsList):
+    '''
+    Adds up the Stats of several runs, such as the shards of one command.
+    Totals stay None if no run reported them, and None is returned if no
+    run had stats at all.
+    '''
+    statsList = [stats for stats in statsList if stats != None]
+    if len(statsList) == 0:
+        return None
+    total = Stats()
+    for stats in statsList:
+        for (attr, value) in vars(stats).items():
+            if value != None and attr != 'speedup':
+                setattr(total, attr, (getattr(total, attr) or 0) + value)
+    return total
+
+class ProgressParser:
+    '''
+    ProgressParser reads rsync output as it arrives and turns it into
+    Progress, Transfer, Change and Stats events, which are passed to
+    handler.  Itemized lines, from --itemize-changes, become Changes, and
+    other lines naming a file become Transfers.  Output can be fed in chunks
+    of any size; only the current partial line is kept.  The most recent
+    progress and the stats, once seen, are also kept on the parser, along
+    with a count of files named in the output and a Tally of the changes.
+    '''
+    def __init__(self, handler=None):
+        self.handler = handler
+        self.buffer = ''
+        self.progress = None
+        self.stats = None
+        self.files = 0
+        self.changes = Tally()
+        # stats are collected as they are read, and reported at the end
+        self.collecting = None
+
+    def feed(self, data):
+        '''
+        Parses a chunk of output.  Progress lines end with a carriage return
+        rather than a newline, so both end a line.
+        '''
+        lines = re.split('[\r\n]', self.buffer + data)
+        self.buffer = lines.pop()
+        if len(self.buffer) > MAX_LINE:
+            self.buffer = ''
+        for line in lines:
+            self.parseLine(line)
+
+    def close(self):
+        '''
+        Parses anything left over at the end of the output.
+        '''
+        if self.buffer != '':
+            self.parseLine(self.buffer)
+            self.buffer = ''
+        if self.collecting != None:
+            self.emitStats()
+
+    def output(self, data, error):
+        '''
+        Handler for rsync.run(), which parses standard output.
+        '''
+        if not error:
+            self.feed(data)
+
+    def tee(self, output=rsync.writeOutput):
+        '''
+        Returns a handler for rsync.run() that parses standard output and
+        also passes all output on to another handler.
+        '''
+        def handler(data, error):
+            self.output(data, error)
+            output(data, error)
+        return handler
+
+    def emit(self, event):
+        if self.handler != None:
+            self.handler(event)
+
+    def emitStats(self):
+        self.stats = self.collecting
+        self.collecting = None
+        self.emit(self.stats)
+
+    def parseLine(self, line):
+        '''
+        Parses one line of output.
+        '''
+        if line.strip() == '':
+            return
+
+        match = PROGRESS_LINE.match(line)
+        if match != None:
+            groups = match.groups()
+            eta = int(groups[5]) * 3600 + int(groups[6]) * 60 + int(groups[7])
+            self.progress = Progress(number(groups[0], groups[1]), int(groups[2]),
+                                     number(groups[3], groups[4].upper()), eta)
+            if groups[8] != None:
+                self.progress.transfers = int(groups[8])
+                self.progress.remaining = int(groups[9])
+                self.progress.total = int(groups[10])
+            self.emit(self.progress)
+            return
+
+        match = STATS_LINE.match(line)
+        if match != None and match.group(1) in STATS_NAMES:
+            if self.collecting == None:
+                self.collecting = Stats()
+            setattr(self.collecting, STATS_NAMES[match.group(1)],
+                    number(match.group(2), match.group(3)))
+            return
+        if match != None and line.startswith('File list'):
+            # file list timings carry nothing we keep
+            return
+
+        match = SENT_LINE.match(line)
+        if match != None:
+            if self.collecting == None:
+                self.collecting = Stats()
+            groups = match.groups()
+            # these repeat the --stats totals, if they were written
+            if self.collecting.bytesSent == None:
+                self.collecting.bytesSent = number(groups[0], groups[1])
+            if self.collecting.bytesReceived == None:
+                self.collecting.bytesReceived = number(groups[2], groups[3])
+            self.collecting.rate = number(groups[4], groups[5])
+            return
+
+        match = TOTAL_LINE.match(line)
+        if match != None:
+            if self.collecting == None:
+                self.collecting = Stats()
+            if self.collecting.totalSize == None:
+                self.collecting.totalSize = number(match.group(1), match.group(2))
+            self.collecting.speedup = number(match.group(3))
+            # this is the last line rsync writes
+            self.emitStats()
+            return
+
+        if line.startswith(NOISE) or line == 'done':
+            return
+        change = parseItem(line)
+        if change != None:
+            self.files += 1
+            self.changes.add(change)
+            self.emit(change)
+            return
+        if line.startswith('deleting '):
+            self.files += 1
+            self.emit(Transfer(line[len('deleting '):], True))
+        else:
+            self.files += 1
+            self.emit(Transfer(line))
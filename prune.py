@@ -0,0 +1,159 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+Deletes backup snapshots that a profile's retention policy no longer keeps.
+Deleting a hard-linked snapshot means removing every one of its directory
+entries, which can take a long time, so it is done in the background after
+a backup, by a few low priority processes on the backup host.
+'''
+import datetime
+import pipes
+import posixpath
+import re
+import subprocess
+import threading
+
+import rsync
+import snapshot
+
+# The periods snapshots can be kept for, newest first within each, and the
+# function that tells which period a snapshot's time falls in
+PERIODS = zip(rsync.RETENTION_PERIODS,
+              [lambda when: when.strftime('%Y%m%d%H'),
+               lambda when: when.strftime('%Y%m%d'),
+               lambda when: when.isocalendar()[:2],
+               lambda when: when.strftime('%Y%m')])
+# The number of snapshots deleted at the same time
+PRUNE_PROCESSES = 2
+# The time stamp in a snapshot's name
+STAMP_FORMAT = '%Y%m%d-%H%M%S'
+
+def stamps(names, name):
+    '''
+    Returns (time, snapshot) pairs for the snapshot names in a list of file
+    names, newest first.  Other names are left out.
+    '''
+    pattern = re.compile('^' + re.escape(name) + r'-(\d{8}-\d{6})$')
+    found = list()
+    for entry in names:
+        match = pattern.match(entry)
+        if match != None:
+            try:
+                found.append((datetime.datetime.strptime(match.group(1), STAMP_FORMAT), entry))
+            except ValueError:
+                # digits that are not a date
+                pass
+    found.sort(reverse=True)
+    return found
+
+def expired(names, name, retention, keep=()):
+    '''
+    Returns the snapshots in a list of file names that a retention policy
+    does not keep.  retention maps each of the PERIODS to the number of
+    them to keep a snapshot for; the newest snapshot in each period is kept.
+    The newest snapshot of all and those named in keep are never expired.
+    '''
+    ordered = stamps(names, name)
+    kept = set(keep)
+    if len(ordered) > 0:
+        kept.add(ordered[0][1])
+    for (period, bucket) in PERIODS:
+        count = retention.get(period, 0)
+        seen = set()
+        for (when, snap) in ordered:
+            if len(seen) >= count:
+                break
+            if bucket(when) not in seen:
+                seen.add(bucket(when))
+                kept.add(snap)
+    return [snap for (when, snap) in ordered if snap not in kept]
+
+def listScript(snap):
+    '''
+    Returns a script that writes the snapshot the current link points to,
+    then the names in the snapshot root, one per line.
+    '''
+    return "cd %s && echo \"$(readlink %s)\" && ls -1" % (
+        pipes.quote(snap.getRoot().getPath()), pipes.quote(snap.getCurrent()))
+
+def deleteScript(snap, names, processes=PRUNE_PROCESSES):
+    '''
+    Returns a script that deletes snapshots, a few at a time, at low CPU
+    and, where ionice is available, idle I/O priority.
+    '''
+    return ("cd %s && io= && { command -v ionice >/dev/null 2>&1 && io='ionice -c 3' || true; } && "
+            "printf '%%s\\0' %s | xargs -0 -n 1 -P %d $io nice -n 19 rm -rf" %
+            (pipes.quote(snap.getRoot().getPath()),
+             " ".join([pipes.quote(name) for name in names]), processes))
+
+class Pruner(threading.Thread):
+    '''
+    Deletes a profile's expired snapshots on a background thread.  The
+    thread is started by commit(), so a pruner can stand in as the update
+    of the job that rotates the snapshots, and prunes only after a
+    successful backup.  Once done, it calls report with itself, if given,
+    on its own thread.  deleted then names the snapshots deleted and
+    exitCode is the exit status of the deletion, or of the listing if
+    that failed.
+    '''
+    def __init__(self, snap, shell='ssh', report=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.snapshot = snap
+        self.shell = shell
+        self.report = report
+        self.deleted = list()
+        self.exitCode = None
+
+    def commit(self):
+        self.start()
+
+    def discard(self):
+        pass
+
+    def run(self):
+        listing = subprocess.Popen(snapshot.session(self.snapshot, listScript(self.snapshot),
+                                                    self.shell),
+                                   shell=True, stdout=subprocess.PIPE, close_fds=True)
+        lines = listing.communicate()[0].splitlines()
+        self.exitCode = listing.returncode
+        if self.exitCode == 0 and len(lines) > 0:
+            # the first line is the current snapshot, which is always kept
+            current = posixpath.basename(lines[0].rstrip('/'))
+            self.deleted = expired(lines[1:], self.snapshot.getName(),
+                                   self.snapshot.getRetention(), [current])
+            if len(self.deleted) > 0:
+                self.exitCode = subprocess.call(
+                    snapshot.session(self.snapshot, deleteScript(self.snapshot, self.deleted),
+                                     self.shell), shell=True, close_fds=True)
+        if self.report != None:
+            self.report(self)
+
+    def summary(self):
+        '''
+        Describes what the pruner did, once it is done.
+        '''
+        if self.exitCode != 0:
+            return "Could not prune snapshots of %s (%d)" % (self.snapshot.getName(),
+                                                            self.exitCode)
+        if len(self.deleted) == 0:
+            return "No snapshots of %s have expired" % self.snapshot.getName()
+        return "Deleted %d expired snapshots: %s" % (len(self.deleted),
+                                                     ", ".join(self.deleted))
@@ -18,22 +18,212 @@ along with Synctus.  If not, see <http://www.gnu.org/licenses/>.
 
 Created on Nov 9, 2009
 '''
-import commands
+import hashlib
+import os
+import select
+import shlex
+import subprocess
+import sys
+import time
+
+# The most output read from a running process at a time
+CHUNK_SIZE = 4096
+
+# Ways a command's source can be split among parallel rsync processes: deal
+# out the top-level entries in name order, or balance them by total size or
+# by number of files
+SHARD_BY_ENTRY = 'entry'
+SHARD_BY_SIZE = 'size'
+SHARD_BY_FILES = 'files'
+
+# The periods a snapshot retention policy counts snapshots for, shortest
+# first; see the prune module
+RETENTION_PERIODS = ('hourly', 'daily', 'weekly', 'monthly')
+
+# The rsync program commands run, which can be pointed at a stand-in such as
+# fakersync.py for testing
+RSYNC = os.environ.get('SYNCTITY_RSYNC', 'rsync')
+
+# Where generated rsync filter files are kept
+FILTER_DIR = os.path.expanduser("~/.synctity/filters")
+# Options whose parameters are filter rules, which are given to rsync in a
+# filter file rather than one by one once a command has more than
+# FILTER_LIMIT of them
+FILTER_OPTIONS = {'exclude': '- ', 'filter': '', 'include': '+ '}
+FILTER_LIMIT = 100
+# Filter files that no saved command refers to are deleted once they have
+# gone unused for this many seconds
+FILTER_AGE = 24 * 60 * 60
+
+def filterFile(rules):
+    ''' Write a list of rsync filter rules to a file and return its name. '''
+    return listFile(rules, FILTER_DIR, '.rules')
+
+def filterName(rules):
+    ''' The name of the file filterFile writes a list of rules to. '''
+    return listName(rules, FILTER_DIR, '.rules')
+
+def pruneFilters(keep, age=FILTER_AGE):
+    ''' Deletes the filter files not named in keep that have gone unused
+    for age seconds; commands write their filter files again when they are
+    missing.  Returns the number of files deleted. '''
+    try:
+        names = os.listdir(FILTER_DIR)
+    except OSError:
+        return 0
+    deleted = 0
+    cutoff = time.time() - age
+    for name in names:
+        filename = os.path.join(FILTER_DIR, name)
+        if not name.endswith('.rules') or filename in keep:
+            continue
+        try:
+            if os.path.getmtime(filename) < cutoff:
+                os.remove(filename)
+                deleted += 1
+        except OSError:
+            # deleted meanwhile, or not ours to delete
+            pass
+    return deleted
+
+def listName(lines, directory, suffix, separator='\n'):
+    ''' The name of the file listFile writes lines to. '''
+    content = ''.join([line + separator for line in lines])
+    return os.path.join(directory, hashlib.sha1(content).hexdigest() + suffix)
+
+def listFile(lines, directory, suffix, separator='\n'):
+    ''' Write lines to a file in directory and return its name.  Files are
+    named by their content, so the same lines always give the same file, and
+    an existing file is reused rather than written again, though its time is
+    updated to show it is still in use. '''
+    content = ''.join([line + separator for line in lines])
+    filename = os.path.join(directory, hashlib.sha1(content).hexdigest() + suffix)
+    if os.path.exists(filename):
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+    else:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # write to a temporary name and rename, so the file is never partial
+        temp = "%s.%d.tmp" % (filename, os.getpid())
+        out = open(temp, 'w')
+        try:
+            out.write(content)
+        finally:
+            out.close()
+        os.rename(temp, filename)
+    return filename
+
+def writeOutput(data, error):
+    ''' Default output handler for run(), which echoes process output to
+    this process' standard output or standard error. '''
+    if error:
+        stream = sys.stderr
+    else:
+        stream = sys.stdout
+    stream.write(data)
+    stream.flush()
+
+# Characters the shell takes out of a word, or splits words on
+QUOTING = '\'"\\ \t\n'
+
+def word(text, tilde=False):
+    ''' Returns the argument a shell would make of text.  Options and paths
+    may be written with quotes, as they were when commands ran through a
+    shell, but text the shell would split into several words is taken
+    whole, since it was meant as one argument.  With tilde, a leading ~ is
+    expanded, as the shell does for a word of its own. '''
+    if len([c for c in QUOTING if c in text]) == 0:
+        # nothing the shell would take out or split on
+        words = [text]
+    else:
+        try:
+            words = shlex.split(text)
+        except ValueError:
+            words = [text]
+    if len(words) == 1:
+        argument = words[0]
+    else:
+        argument = text
+    if tilde and text.startswith('~'):
+        argument = os.path.expanduser(argument)
+    return argument
+
+def program():
+    ''' The arguments that start the rsync program, which may be a command
+    line of its own, such as python fakersync.py. '''
+    return tuple(shlex.split(RSYNC))
+
+def run(commandline, output=writeOutput):
+    ''' Run a command line and pass its output along as it is produced.
+    The command line is either a string, which is run by the shell, or a
+    sequence of arguments, which is run directly.  output is called as 
+    output(data, error) for each chunk the process writes, where error is
+    True for chunks from standard error.  Only one chunk is held in memory
+    at a time, however much the process writes.  Returns the exit status of
+    the process, which is 127 if the program could not be run, as it is
+    from the shell. '''
+    try:
+        process = subprocess.Popen(commandline, shell=isinstance(commandline, basestring),
+                                   close_fds=True, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+    except OSError, e:
+        output("%s: %s\n" % (commandline[0], e.strerror), True)
+        return 127
+    # map each open pipe to whether it carries standard error
+    streams = {process.stdout.fileno(): False, process.stderr.fileno(): True}
+    while len(streams) > 0:
+        (ready, _, _) = select.select(streams.keys(), [], [])
+        for fd in ready:
+            data = os.read(fd, CHUNK_SIZE)
+            if data == '':
+                # end of file, the process closed this stream
+                del streams[fd]
+            else:
+                output(data, streams[fd])
+    process.stdout.close()
+    process.stderr.close()
+    return process.wait()
 
 class Path:
     ''' 
     Represents a fully qualified network path name as recognized by rsync.  
     This includes a user, host, and path. An rsync path is printed as:
         user@host:path.
+    The printed path, and the argument rsync is given for it, are kept
+    until the path is changed with one of its set methods.
     '''
     def __init__(self, path='', host='', user=''):
         ''' Initialize a network path ''' 
         self.user = user
         self.host = host
         self.path = path
+        self.changed()
+    
+    def __getstate__(self):
+        ''' The printed path is not saved with the path, and its parts are
+        saved as plain strings. '''
+        state = self.__dict__.copy()
+        state.pop('rendered', None)
+        state.pop('argument', None)
+        for key in ('user', 'host', 'path'):
+            state[key] = str(state[key])
+        return state
+    
+    def changed(self):
+        self.rendered = None
+        self.argument = None
     
     def __str__(self):
         ''' Build the full network path string'''
+        # paths saved before the printed path was kept have no rendered
+        if getattr(self, 'rendered', None) == None:
+            self.rendered = self.render()
+        return self.rendered
+    
+    def render(self):
         str = ''
         if self.user != '':
             str = str + self.user + "@"
@@ -50,12 +240,32 @@ class Path:
         
         return str
 
+    def getArgument(self):
+        ''' The path as a single argument to rsync, with any quotes taken
+        out, and a leading ~ expanded. '''
+        if getattr(self, 'argument', None) == None:
+            self.argument = word(str(self), True)
+        return self.argument
+
     def getUser(self): return self.user
-    def setUser(self, value): self.user = value
+    def setUser(self, value):
+        self.user = str(value)
+        self.changed()
     def getHost(self): return self.host
-    def setHost(self, value): self.host = value
+    def setHost(self, value):
+        self.host = str(value)
+        self.changed()
     def getPath(self): return self.path
-    def setPath(self, value): self.path = value
+    def setPath(self, value):
+        self.path = str(value)
+        self.changed()
+    
+    def getHostKey(self):
+        ''' The name of the machine this path resides on.  Paths without a
+        host are on the local machine, which is called localhost. '''
+        if self.host != '':
+            return self.host.lower()
+        return 'localhost'
     
 class Option:
     '''
@@ -68,10 +278,42 @@ class Option:
     This approach is used because an rsync option can appear multiple times in 
     a single rsync command, e.g. --exclude=pathA --exclude=pathB.  In this
     example, there would be a single key for the --exclude option and two
-    parameters to specify the paths.
+    parameters to specify the paths.  A set of each option's parameters is
+    kept beside the list, so a parameter is added in constant time however
+    many there are.
+    
+    The printed options, and the arguments rsync is given for them, are
+    kept until they are changed with enable, disable or setOptions, so the
+    dictionary should not be changed any other way.
     '''
     def __init__(self):
         self.options = dict()
+        self.params = dict()
+        self.changed()
+        
+    def __getstate__(self):
+        ''' The printed options and the sets of parameters are not saved
+        with the options. '''
+        state = self.__dict__.copy()
+        state.pop('rendered', None)
+        state.pop('arguments', None)
+        state.pop('rulesFile', None)
+        state.pop('params', None)
+        return state
+    
+    def lookup(self, option):
+        ''' Returns the set of an enabled option's parameters. '''
+        # options saved before the sets were kept have no params
+        if getattr(self, 'params', None) == None:
+            self.params = dict()
+        if option not in self.params:
+            self.params[option] = set(self.options[option])
+        return self.params[option]
+    
+    def changed(self):
+        self.rendered = None
+        self.arguments = None
+        self.rulesFile = None
         
     def __iter__(self):
         return self.options.__iter__()
@@ -79,45 +321,123 @@ class Option:
     def enable(self, option, param=''):
         ''' Enable or turn on a flag.  The flag and optional parameter are
         added to the dictionary of options. '''
+        self.changed()
         if option in self.options:
             # the option is already in the list, 
             # so append the parameter if it is unique
-            if not param in self.options[option]:
+            params = self.lookup(option)
+            if not param in params:
                 self.options[option].append(param)
+                params.add(param)
         else:
             # the option is new, so create an entry in a list
             self.options[option] = [param]
+            self.lookup(option)
     
     def disable(self, option, param=None):
         ''' Disable or turn off a flag.  This removes the first option whose
         flag name matches.'''
+        self.changed()
         if option in self.options:
+            params = self.lookup(option)
             if param == None:
                 del self.options[option]
-            elif param in self.options[option]:
+                del self.params[option]
+            elif param in params:
                 self.options[option].remove(param)
+                params.remove(param)
                 if len(self.options[option]) == 0:
                     del self.options[option]
+                    del self.params[option]
     
     def __str__(self):
-        str = ''
+        # options saved before the printed options were kept have no rendered
+        if getattr(self, 'rendered', None) == None:
+            self.rendered = self.render()
+        return self.rendered
+    
+    def render(self):
+        parts = list()
         for opt in sorted(self.options):
-            ostr = ''
             if len(opt) == 1:
-                for param in self.options[opt]:
-                    ostr = ostr + "-%s %s " % (opt, param)
+                ostr = ''.join(["-%s %s " % (opt, param) for param in self.options[opt]])
             else:
+                ostr = ''.join([(len(param) > 0 and "--%s=%s " % (opt, param)) or "--%s " % opt
+                                for param in self.options[opt]])
+            parts.append(ostr.strip())
+        return " ".join(parts).strip()
+    
+    def getArguments(self):
+        ''' The options as arguments to rsync, one for each flag and each
+        parameter, with any quotes taken out of the parameters.  More filter
+        rules than FILTER_LIMIT are written to a filter file, which is given
+        in their place; see filterRules.  The arguments are worked out again
+        if that file has been deleted since, which writes it again. '''
+        if getattr(self, 'arguments', None) == None or self.rulesMissing():
+            arguments = list()
+            rules = self.filterRules()
+            for opt in sorted(self.options):
+                if rules != None and opt in FILTER_OPTIONS:
+                    if len(rules) > 0:
+                        self.rulesFile = filterFile(rules)
+                        arguments.append("--filter=merge_" + self.rulesFile)
+                        rules = list()
+                    continue
                 for param in self.options[opt]:
-                    if len(param) > 0:
-                        ostr = ostr + "--%s=%s " % (opt, param)
+                    if len(opt) == 1:
+                        arguments.append("-" + opt)
+                        if len(param) > 0:
+                            arguments.append(word(param, True))
+                    elif len(param) > 0:
+                        arguments.append("--%s=%s" % (opt, word(param)))
                     else:
-                        ostr = ostr + "--%s " % opt
-            
-            str = str + " " + ostr.strip()
-        return str.strip()
+                        arguments.append("--" + opt)
+            self.arguments = tuple(arguments)
+        return self.arguments
+    
+    def rulesMissing(self):
+        ''' Determines whether the filter file the arguments were worked
+        out with has been deleted. '''
+        filename = getattr(self, 'rulesFile', None)
+        return filename != None and not os.path.exists(filename)
+    
+    def getFilterName(self):
+        ''' The name of the filter file the filter rules are given to rsync
+        in, or None if they are given one by one. '''
+        rules = self.filterRules()
+        if rules == None:
+            return None
+        return filterName(rules)
+    
+    def filterRules(self):
+        ''' Returns the exclude, include and filter options as filter rules,
+        in the order they are given to rsync, if there are more than
+        FILTER_LIMIT of them.  Otherwise, or if the rules could not be
+        written to a file one per line, returns None.  They are also left
+        alone when they come with --exclude-from or --include-from, whose
+        rules would otherwise come after them. '''
+        rules = list()
+        for opt in sorted(self.options):
+            if opt in FILTER_OPTIONS:
+                rules.extend([FILTER_OPTIONS[opt] + word(param) for param in self.options[opt]])
+        if (len(rules) <= FILTER_LIMIT or 'exclude-from' in self.options or
+            'include-from' in self.options or
+            len([rule for rule in rules if '\n' in rule or rule.strip() == '']) > 0):
+            return None
+        return rules
     
     def getOptions(self): return self.options
-    def setOptions(self, value): self.options = value
+    def setOptions(self, value):
+        self.options = value
+        self.params = dict()
+        self.changed()
+    
+    def copy(self):
+        ''' Returns a new Option with the same flags and parameters. '''
+        options = Option()
+        for opt in self.options:
+            options.options[opt] = list(self.options[opt])
+        return options
     
 class Command:
     '''
@@ -151,28 +471,74 @@ class Command:
         else:
             self.options = Option()
             self.options.enable('n')
+            
+        # commands in the same profile that must succeed before this one runs
+        self.depends = list()
+        # the number of parallel rsync processes to split the source among,
+        # and how to split it; see the shard module
+        self.shards = 1
+        self.shardMode = SHARD_BY_ENTRY
+        # whether to only transfer what changed since the last run; see the
+        # index module
+        self.incremental = False
+        # the command lines last written out, in each direction, with the
+        # program, options and paths they were written from, and the
+        # arguments that run them
+        self.rendered = dict()
+        
+    def __getstate__(self):
+        ''' The command lines written out are not saved with the command. '''
+        state = self.__dict__.copy()
+        state.pop('rendered', None)
+        return state
+        
+    def render(self, first, second):
+        ''' Writes out the command line copying from first to second, and
+        returns [key, command line, arguments], where the arguments are None
+        until they are wanted.  The options and paths keep their own printed
+        forms, so the command line is only written again once one of them
+        has changed. '''
+        key = (RSYNC, str(self.options), str(first), str(second))
+        if not hasattr(self, 'rendered'):
+            self.rendered = dict()
+        direction = first is self.source
+        if direction not in self.rendered or self.rendered[direction][0] != key:
+            self.rendered[direction] = [key, "%s %s %s %s" % key, None]
+        return self.rendered[direction]
         
     def forward(self):
-        return "rsync %s %s %s" % (self.options, self.source, self.destination)
+        return self.render(self.source, self.destination)[1]
     
     def reverse(self):
-        return "rsync %s %s %s" % (self.options, self.destination, self.source)
+        return self.render(self.destination, self.source)[1]
+    
+    def arguments(self, reverse=False):
+        ''' Returns the arguments that run this command without a shell,
+        starting with the rsync program, in either direction. '''
+        if not reverse:
+            (first, second) = (self.source, self.destination)
+        else:
+            (first, second) = (self.destination, self.source)
+        rendered = self.render(first, second)
+        if rendered[2] == None or self.options.rulesMissing():
+            rendered[2] = (program() + self.options.getArguments() +
+                           (first.getArgument(), second.getArgument()))
+        return rendered[2]
     
     def __str__(self):
         return self.forward()
     
-    def execute(self, reverse=False):
-        ''' Execute the rsync command and display the result.  The reverse
-        option specifies whether this command should be run in forward or
-        reverse order, with the default being forward.'''
+    def execute(self, reverse=False, output=writeOutput):
+        ''' Execute the rsync command and display the result as it runs.  The
+        reverse option specifies whether this command should be run in 
+        forward or reverse order, with the default being forward.  Output is
+        passed to the output callback; see run().  Returns the exit status.'''
         if (not reverse):
-            print "Executing: " + self.forward()
-            (status, output) = commands.getstatusoutput(self.forward())
+            commandline = self.forward()
         else:
-            print "Executing: " + self.reverse()
-            (status, output) = commands.getstatusoutput(self.reverse())
-            
-        print output
+            commandline = self.reverse()
+        output("Executing: " + commandline + "\n", False)
+        return run(self.arguments(reverse), output)
         
     def getSource(self): return self.source
     def setSource(self, value): self.source = value
@@ -180,6 +546,41 @@ class Command:
     def setDestination(self, value): self.destination = value
     def getOptions(self): return self.options
     def setOptions(self, value): self.options = value
+    # dependencies were added later, so the get method uses getattr to avoid
+    # problems with old pickled Command objects.
+    def getDepends(self): return getattr(self, 'depends', [])
+    def setDepends(self, value): self.depends = value
+    def getShards(self): return getattr(self, 'shards', 1)
+    def setShards(self, value): self.shards = value
+    def getShardMode(self): return getattr(self, 'shardMode', SHARD_BY_ENTRY)
+    def setShardMode(self, value): self.shardMode = value
+    def getIncremental(self): return getattr(self, 'incremental', False)
+    def setIncremental(self, value): self.incremental = value
+    
+    def dependsOn(self, other):
+        ''' Determines whether this command depends on another, either 
+        directly or through other commands. '''
+        pending = list(self.getDepends())
+        seen = list()
+        while len(pending) > 0:
+            command = pending.pop()
+            if command is other:
+                return True
+            if command not in seen:
+                seen.append(command)
+                pending.extend(command.getDepends())
+        return False
+    
+    def getHosts(self):
+        ''' The machines this command transfers files to or from.  A local 
+        side of the transfer is not counted unless both sides are local. '''
+        hosts = set()
+        for path in (self.getSource(), self.getDestination()):
+            if path.getHostKey() != 'localhost':
+                hosts.add(path.getHostKey())
+        if len(hosts) == 0:
+            hosts.add('localhost')
+        return hosts
     
     def getDescription(self):
         string = ''
@@ -191,6 +592,39 @@ class Command:
         string = string + self.getDestination().getPath()
         return string
         
+class Snapshot:
+    '''
+    Where a profile keeps backup snapshots.  Each run copies into an incoming
+    directory, hard linking unchanged files to the current snapshot, and is
+    then renamed to a time-stamped snapshot that becomes current.  All of
+    these directories are in root, which may be on a remote host, and are
+    named after name:
+        name-incoming, name-YYYYmmdd-HHMMSS, name-current
+    
+    The retention policy maps 'hourly', 'daily', 'weekly' and 'monthly' to
+    the number of each to keep a snapshot for.  Snapshots it does not keep
+    are deleted after a backup; see the prune module.  An empty policy
+    keeps every snapshot.
+    '''
+    def __init__(self, root=None, name='backup'):
+        if root != None:
+            self.root = root
+        else:
+            self.root = Path()
+        self.name = name
+        self.retention = dict()
+        
+    def getRoot(self): return self.root
+    def setRoot(self, value): self.root = value
+    def getName(self): return self.name
+    def setName(self, value): self.name = str(value)
+    
+    def getRetention(self): return getattr(self, 'retention', dict())
+    def setRetention(self, value): self.retention = value
+    
+    def getIncoming(self): return self.name + '-incoming'
+    def getCurrent(self): return self.name + '-current'
+    
 class Profile:
     '''
     A collection of rsync commands.
@@ -200,13 +634,43 @@ class Profile:
         self.commands = list()
         self.presync = ''
         self.postsync = ''
+        self.parallel = 1
+        self.hostlimit = 0
+        # where backup snapshots are kept, or None to copy normally
+        self.snapshot = None
+        # whether commands copying one source to several mirrors share a
+        # single transfer; see the fanout module
+        self.fanout = False
+        
+    def __getstate__(self):
+        ''' The name and the pre-sync and post-sync tasks are saved as plain
+        strings, so reading the profile back does not need Qt, whose QStrings
+        the window edits them as. '''
+        state = self.__dict__.copy()
+        for key in ('name', 'presync', 'postsync'):
+            if key in state:
+                state[key] = str(state[key])
+        return state
         
     def add(self, command):
         self.commands.append(command)
         
     def remove(self, index):
         if index < len(self.commands):
-            self.commands.remove(self.commands[index])
+            removed = self.commands[index]
+            self.commands.remove(removed)
+            # no command can depend on one that is not in the profile
+            for command in self.commands:
+                if removed in command.getDepends():
+                    command.getDepends().remove(removed)
+    
+    def findCycle(self):
+        ''' Returns a command that depends on itself, through any chain of
+        dependencies, or None if the dependencies have no cycles. '''
+        for command in self.commands:
+            if command.dependsOn(command):
+                return command
+        return None
     
     def get(self, index):
         if index < len(self.commands):
@@ -215,20 +679,37 @@ class Profile:
     def __iter__(self):
         return self.commands.__iter__()
     
-    def execute(self, reverse=False):
+    def execute(self, reverse=False, output=writeOutput):
+        ''' Execute each command in turn, streaming output as in 
+        Command.execute.  Returns the number of commands that failed. '''
+        failures = 0
         for command in self.commands:
-            command.execute(reverse);
+            if command.execute(reverse, output) != 0:
+                failures += 1
+        return failures
             
     def getName(self): return self.name
-    def setName(self, value): self.name = value
+    def setName(self, value): self.name = str(value)
     def getCommands(self): return self.commands
     
     # prebackup and postbackup were added later, so the get methods use getattr to 
     # avoid problems with old pickled Profile objects.
     def getPreSync(self): return getattr(self, 'presync', '')
     def getPostSync(self): return getattr(self, 'postsync', '')
-    def setPreSync(self, value): self.presync = value
-    def setPostSync(self, value): self.postsync = value
+    def setPreSync(self, value): self.presync = str(value)
+    def setPostSync(self, value): self.postsync = str(value)
+    # the number of commands that may run at the same time
+    def getParallel(self): return getattr(self, 'parallel', 1)
+    def setParallel(self, value): self.parallel = value
+    # the number of commands that may run against one host at the same time,
+    # where 0 means no limit
+    def getHostLimit(self): return getattr(self, 'hostlimit', 0)
+    def setHostLimit(self, value): self.hostlimit = value
+    # a Snapshot, if the profile makes backup snapshots
+    def getSnapshot(self): return getattr(self, 'snapshot', None)
+    def setSnapshot(self, value): self.snapshot = value
+    def getFanOut(self): return getattr(self, 'fanout', False)
+    def setFanOut(self, value): self.fanout = value
     
 if __name__ == "__main__":
     
@@ -0,0 +1,572 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+'''
+import heapq
+import itertools
+import os
+import sqlite3
+import time
+
+import fanout
+import index
+import preview
+import progress
+import prune
+import shard
+import snapshot
+
+# The most processes that are ever run at the same time, no matter how many
+# commands a profile allows to run in parallel.
+MAX_PROCESSES = 8
+
+class Job:
+    '''
+    A single process to run on behalf of a profile.  A job holds the command
+    line to launch, the number of jobs that may be running when it starts,
+    and whether it is a barrier.  An rsync command's job also holds the
+    arguments that run it directly; other command lines, such as pre-sync
+    and post-sync tasks, are run by the shell.  A barrier (a pre-sync or
+    post-sync task) runs alone: it waits for all running jobs to finish,
+    and no other job starts until it has finished.
+    
+    Jobs that transfer files also name the hosts they talk to.  At most
+    hostLimit jobs may be running against any one host, where 0 means no
+    limit.
+    
+    A job may depend on other jobs, and only starts once they have all
+    succeeded.  If any of them fails, the job is skipped.  A job may also
+    follow other jobs, which it waits for but runs after whether or not
+    they succeed.
+    
+    A command split into shards is represented by one job for the whole
+    command, whose parts are the jobs that are actually run.  The whole job
+    finishes when all of its parts have, and it is what other jobs depend
+    on and what is reported.
+    
+    A job may need to be prepared just before it starts, which the runner
+    does by calling its prepare function with the job once the scheduler
+    has started it.  Preparing may scan the command's source, so it is best
+    done off the runner's main thread.  It may change the command line, and
+    may leave an update to commit if the job succeeds.  It may also leave
+    a fallback, a command line and its arguments, for the runner to run in
+    the same slot if the job's own command fails; the job's command line
+    and exit code are then the fallback's.
+    If a job has a listener, the runner passes it each event parsed from
+    the job's output.  If it has a release function, that is called once
+    the job has finished or been skipped, whether or not it succeeded.
+    
+    The profile name and a description of the job are kept for reporting,
+    along with when the job was queued, started and finished, its exit code
+    once it has finished, and the progress.Stats and progress.Tally of
+    changes parsed from its output.
+    '''
+    def __init__(self, commandline, limit=1, barrier=False, 
+                 hosts=(), hostLimit=0, profile='', description=None, 
+                 argv=None):
+        self.commandline = commandline
+        self.argv = argv
+        self.limit = limit
+        self.barrier = barrier
+        self.hosts = hosts
+        self.hostLimit = hostLimit
+        self.depends = list()
+        self.follows = list()
+        self.skipped = False
+        self.parts = list()
+        self.parent = None
+        self.prepare = None
+        self.update = None
+        self.listener = None
+        self.release = None
+        self.fallback = None
+        self.profile = profile
+        if description != None:
+            self.description = description
+        else:
+            self.description = commandline
+        self.queued = time.time()
+        self.started = None
+        self.finished = None
+        self.exitCode = None
+        self.stats = None
+        self.changes = None
+        
+    def duration(self):
+        '''
+        Returns how long the job ran in seconds, or None if it has not run.
+        '''
+        if self.started == None or self.finished == None:
+            return None
+        return self.finished - self.started
+
+class Scheduler:
+    '''
+    Scheduler decides which queued jobs can be started.  It does not run
+    anything itself; a runner asks for the next job with next(), launches it,
+    and reports back with finish() when the process exits.
+    
+    Rather than looking through the whole queue for a job to start, the
+    scheduler keeps the queued jobs that could start, in the order they
+    were queued.  A job joins them once the jobs it depends on and follows
+    have finished, which finish() counts down, or once one it depends on
+    has failed.  Queued barriers are kept among them throughout, since no
+    job may overtake one.  A job passed over because a host it talks to is
+    at its limit is set aside until a job talking to that host finishes.
+    '''
+    def __init__(self, maxProcesses=MAX_PROCESSES):
+        # queued jobs, each with the number of jobs it depends on or follows
+        # that have not finished yet
+        self.unfinished = dict()
+        # unfinished job -> the queued jobs waiting for it, as (position,
+        # job, whether it depends on it rather than just following it)
+        self.dependents = dict()
+        # queued jobs that could start, are to be skipped, or are barriers,
+        # as (position, job) in a heap, so they are taken in the order queued
+        self.ready = list()
+        # queued jobs whose dependencies have failed
+        self.doomed = set()
+        # host -> ready jobs set aside until it is no longer at its limit
+        self.hostQueues = dict()
+        # host -> the number of running jobs that talk to it
+        self.hostRunning = dict()
+        # numbers the queued jobs in order
+        self.positions = itertools.count()
+        # jobs that have been started but not yet finished
+        self.running = list()
+        self.maxProcesses = maxProcesses
+        # pruners for the snapshots of queued profiles, which run on their
+        # own threads once started
+        self.pruners = list()
+
+    def queueProfile(self, profile, reverse=False, mode=None, release=None):
+        '''
+        Queue up all commands in a profile; see plan().  Raises a ValueError
+        if the commands' dependencies form a cycle, since such a profile
+        could never finish.
+        '''
+        self.queueJobs(self.plan(profile, reverse, mode, release))
+
+    def check(self, profile):
+        '''
+        Raises a ValueError if a profile's commands depend on each other in
+        a cycle.
+        '''
+        cycle = profile.findCycle()
+        if cycle != None:
+            raise ValueError("Command %s depends on itself" % cycle.getDescription())
+
+    def plan(self, profile, reverse=False, mode=None, release=None):
+        '''
+        Returns the jobs that run all commands in a profile, in the order
+        they are to be queued.  Forward runs are bracketed by the profile's
+        pre-sync and post-sync tasks, if any, and for snapshot profiles, by
+        preparing and rotating the snapshot.  Raises a ValueError if the
+        commands' dependencies form a cycle.  Splitting commands into
+        shards may scan their sources, which can take a while; since the
+        scheduler itself is left alone, a runner may plan on another thread
+        and queue the jobs with queueJobs().
+        
+        With mode preview.DRY_RUN, the commands are run as dry runs alone,
+        and the changes they list are kept as previews.  With preview.APPLY,
+        the commands are run for real, and those with a preview copy just
+        the previewed changes if their source has not changed since.
+        
+        If release is given, it is called with each of the profile's
+        commands once the command has finished or been skipped.
+        '''
+        self.check(profile)
+        
+        name = profile.getName()
+        limit = max(1, profile.getParallel())
+        hostLimit = profile.getHostLimit()
+        snap = profile.getSnapshot()
+        # dry runs have nothing to bracket
+        bracketed = not reverse and mode != preview.DRY_RUN
+        # build a job for each command, then link up their dependencies
+        jobs = list()
+        runs = list()
+        for command in profile:
+            if snap != None:
+                command = snapshot.snapshotted(command, snap, reverse)
+            if mode == preview.DRY_RUN:
+                dryRun = preview.dryRun(command)
+            elif mode == preview.APPLY:
+                command = preview.real(command)
+            runs.append(command)
+            job = Job(self.commandline(command, reverse), limit, 
+                      hosts=command.getHosts(), hostLimit=hostLimit, 
+                      profile=name, description=command.getDescription(),
+                      argv=command.arguments(reverse))
+            if mode == preview.DRY_RUN:
+                # the source is scanned as the dry run starts, and the
+                # changes it lists are kept if it succeeds
+                self.setCommand(job, dryRun, reverse)
+                if preview.previewable(command, reverse):
+                    recorder = preview.Recorder(command, reverse)
+                    job.prepare = recorder.prepare
+                    job.listener = recorder.listen
+                    job.update = recorder
+                shards = [command]
+            elif mode == preview.APPLY and os.path.exists(preview.previewFile(command, reverse)):
+                # the preview is checked when the command starts
+                job.prepare = lambda job, command=command: self.apply(job, command, reverse)
+                shards = [command]
+            elif command.getIncremental():
+                # the changed paths are found when the command starts, and
+                # a list of them is not split into shards
+                job.prepare = lambda job, command=command: self.prepare(job, command, reverse)
+                shards = [command]
+            else:
+                shards = shard.split(command, reverse)
+            if len(shards) > 1:
+                for (idx, part) in enumerate(shards):
+                    job.parts.append(Job(self.commandline(part, reverse), limit, 
+                                         hosts=job.hosts, hostLimit=hostLimit, 
+                                         profile=name, description="%s [shard %d/%d]" % 
+                                         (job.description, idx + 1, len(shards)),
+                                         argv=part.arguments(reverse)))
+                    job.parts[-1].parent = job
+            jobs.append(job)
+        commands = profile.getCommands()
+        # the job of each command, and of each command as it is run, looked
+        # up by the command rather than searched for
+        jobOf = dict()
+        runOf = dict()
+        for (command, run, job) in reversed(zip(commands, runs, jobs)):
+            jobOf[command] = job
+            runOf[run] = job
+        for (command, job) in zip(commands, jobs):
+            if release != None:
+                job.release = lambda command=command: release(command)
+            for depend in command.getDepends():
+                if depend in jobOf:
+                    job.depends.append(jobOf[depend])
+        
+        # mirrors of one source are copied once, and the others replay the
+        # changes that copy made
+        if profile.getFanOut() and not reverse and mode == None:
+            for group in fanout.groups(runs):
+                first = runOf[group[0]]
+                self.setCommand(first, fanout.writeCommand(group[0]), False)
+                cleanup = fanout.Cleanup(fanout.batchFile(group[0]), len(group) - 1)
+                for command in group[1:]:
+                    job = runOf[command]
+                    job.follows.append(first)
+                    job.prepare = (lambda job, command=command, first=first, source=group[0]:
+                                   self.replay(job, command, first, source))
+                    job.update = cleanup
+        
+        # forward snapshot runs create the incoming directory first, and
+        # once every command has succeeded, make it the current snapshot
+        if snap != None and bracketed:
+            shell = snapshot.remoteShell(commands)
+            hosts = set([snap.getRoot().getHostKey()])
+            prepare = Job(snapshot.session(snap, snapshot.prepareScript(snap, commands), shell),
+                          barrier=True, hosts=hosts, profile=name, 
+                          description="Prepare snapshot " + snap.getIncoming())
+            rotate = Job(snapshot.session(snap, snapshot.rotateScript(snap), shell),
+                         barrier=True, hosts=hosts, profile=name, 
+                         description="Rotate snapshot " + snap.getCurrent())
+            for job in jobs:
+                job.depends.append(prepare)
+            rotate.depends = list(jobs)
+            if len([count for count in snap.getRetention().values() if count > 0]) > 0:
+                # expired snapshots are deleted in the background once the
+                # new one is current
+                rotate.update = prune.Pruner(snap, shell)
+        for job in jobs:
+            for part in job.parts:
+                part.depends = job.depends
+        
+        # forward direction runs any pre-sync and post-sync commands
+        queued = list()
+        if bracketed and profile.getPreSync() != '':
+            queued.append(Job(profile.getPreSync(), barrier=True, 
+                              profile=name))
+        if snap != None and bracketed:
+            queued.append(prepare)
+        for job in jobs:
+            if len(job.parts) > 0:
+                queued.extend(job.parts)
+            else:
+                queued.append(job)
+        if snap != None and bracketed:
+            queued.append(rotate)
+        if bracketed and profile.getPostSync() != '':
+            queued.append(Job(profile.getPostSync(), barrier=True, 
+                              profile=name))
+        return queued
+
+    def queueJobs(self, jobs):
+        '''
+        Queues the jobs plan() returned.
+        '''
+        for job in jobs:
+            if isinstance(job.update, prune.Pruner):
+                self.pruners.append(job.update)
+            position = self.positions.next()
+            depends = set(job.depends)
+            count = 0
+            for depend in depends.union(job.follows):
+                if depend.skipped or (depend.exitCode != None and depend.exitCode != 0):
+                    if depend in depends:
+                        self.doomed.add(job)
+                elif depend.exitCode == None:
+                    self.dependents.setdefault(depend, list()).append(
+                        (position, job, depend in depends))
+                    count += 1
+            self.unfinished[job] = count
+            # a queued barrier holds back every job after it, so it is
+            # taken in its turn whether or not it is waiting
+            if count == 0 or job in self.doomed or job.barrier:
+                heapq.heappush(self.ready, (position, job))
+
+    def commandline(self, command, reverse):
+        '''
+        Returns the command line that runs a command in either direction.
+        '''
+        if not reverse:
+            return command.forward()
+        return command.reverse()
+
+    def setCommand(self, job, command, reverse):
+        '''
+        Has a job run a command in either direction.
+        '''
+        job.commandline = self.commandline(command, reverse)
+        job.argv = command.arguments(reverse)
+
+    def prepare(self, job, command, reverse):
+        '''
+        Narrows an incremental command down to the paths that changed since
+        its last successful run.  If the index cannot be read, the command
+        runs in full.
+        '''
+        try:
+            (command, job.update) = index.plan(command, reverse)
+        except (sqlite3.Error, EnvironmentError):
+            job.update = None
+        self.setCommand(job, command, reverse)
+
+    def apply(self, job, command, reverse):
+        '''
+        Narrows a command down to the changes its preview listed, if its
+        source has not changed since.  Otherwise the command runs as it
+        would without a preview.
+        '''
+        try:
+            (narrowed, job.update) = preview.plan(command, reverse)
+        except EnvironmentError:
+            (narrowed, job.update) = (command, None)
+        if job.update == None and command.getIncremental():
+            self.prepare(job, command, reverse)
+        else:
+            self.setCommand(job, narrowed, reverse)
+
+    def replay(self, job, command, first, source):
+        '''
+        Has a mirror's command apply the batch its group's first command
+        wrote, if that succeeded, and copy as usual if the batch does not
+        apply.  Otherwise the mirror is copied as usual.
+        '''
+        if first.exitCode == 0:
+            job.fallback = (job.commandline, job.argv)
+            job.commandline = fanout.readCommandline(command, source)
+            job.argv = fanout.readArguments(command, source)
+
+    def canStart(self, job):
+        '''
+        Determines whether a job could be started given the running jobs.
+        '''
+        for running in self.running:
+            if running.barrier:
+                return False
+        if job.barrier:
+            return len(self.running) == 0
+        if len(self.running) >= min(job.limit, self.maxProcesses):
+            return False
+        return not self.hostBusy(job) and not self.waiting(job)
+    
+    def waiting(self, job):
+        '''
+        Determines whether a queued job is waiting for a job it depends on
+        or follows.
+        '''
+        return self.unfinished.get(job, 0) > 0
+    
+    def failed(self, job):
+        '''
+        Determines whether a queued job depends on a job that failed or was
+        skipped.
+        '''
+        return job in self.doomed
+    
+    def busyHost(self, job):
+        '''
+        Returns a host a job talks to that is at the job's limit, or None.
+        '''
+        if job.hostLimit > 0:
+            for host in job.hosts:
+                if self.hostCount(host) >= job.hostLimit:
+                    return host
+        return None
+    
+    def hostBusy(self, job):
+        '''
+        Determines whether any host a job talks to is at its limit.
+        '''
+        return self.busyHost(job) != None
+    
+    def hostCount(self, host):
+        '''
+        Counts the running jobs that talk to a host.
+        '''
+        return self.hostRunning.get(host, 0)
+    
+    def resolve(self, job):
+        '''
+        Counts a job that has finished or been skipped off the queued jobs
+        waiting for it.  Those waiting for nothing more become ready, as do
+        those that depend on it if it did not succeed, to be skipped.
+        '''
+        failed = job.skipped or job.exitCode != 0
+        for (position, waiter, depends) in self.dependents.pop(job, ()):
+            if waiter not in self.unfinished:
+                continue
+            self.unfinished[waiter] -= 1
+            doomed = failed and depends and waiter not in self.doomed
+            if doomed:
+                self.doomed.add(waiter)
+            if doomed or self.unfinished[waiter] == 0:
+                heapq.heappush(self.ready, (position, waiter))
+
+    def next(self):
+        '''
+        Removes and returns the next job that can be started, or None if no
+        job can be started right now.  The job is considered running until
+        it is passed to finish().  It is left to the runner to prepare; see
+        Job.
+        
+        Jobs waiting on a busy host or on the jobs they depend on are passed
+        over in favour of later jobs.  A job waiting for a free slot, or a
+        queued barrier, is never overtaken.
+        
+        A job whose dependencies failed is removed from the queue and
+        returned with its skipped flag set, without being counted as
+        running, so the runner can report it.  All the parts of a sharded
+        job are skipped together, and the whole job is returned.
+        '''
+        while len(self.ready) > 0:
+            (position, job) = self.ready[0]
+            if job not in self.unfinished:
+                # started or skipped since it was made ready
+                heapq.heappop(self.ready)
+                continue
+            if self.failed(job):
+                heapq.heappop(self.ready)
+                if job.parent != None:
+                    job = job.parent
+                for skipped in [job] + job.parts:
+                    self.unfinished.pop(skipped, None)
+                    self.doomed.discard(skipped)
+                    skipped.skipped = True
+                    skipped.finished = time.time()
+                    self.discard(skipped)
+                self.resolve(job)
+                if job.release != None:
+                    job.release()
+                return job
+            if self.canStart(job):
+                heapq.heappop(self.ready)
+                del self.unfinished[job]
+                self.running.append(job)
+                for host in job.hosts:
+                    self.hostRunning[host] = self.hostCount(host) + 1
+                job.started = time.time()
+                return job
+            host = self.busyHost(job)
+            if job.barrier or host == None:
+                break
+            heapq.heappop(self.ready)
+            self.hostQueues.setdefault(host, list()).append((position, job))
+        return None
+
+    def finish(self, job, exitCode):
+        '''
+        Marks a running job as finished with the given exit code, freeing
+        its slot, and commits its update if it succeeded.  Returns the job
+        to report as finished: the job itself, or for the last part of a
+        sharded job to finish, the whole job, with the exit code of the
+        first failed part and the combined stats and changes of all parts.
+        Returns None when other parts are still to finish.
+        '''
+        job.finished = time.time()
+        job.exitCode = exitCode
+        if job in self.running:
+            self.running.remove(job)
+            for host in job.hosts:
+                self.hostRunning[host] -= 1
+                # the jobs set aside for the host may start now
+                for entry in self.hostQueues.pop(host, ()):
+                    heapq.heappush(self.ready, entry)
+        if exitCode == 0:
+            if job.update != None:
+                job.update.commit()
+        else:
+            self.discard(job)
+        
+        whole = job.parent
+        if whole == None:
+            self.resolve(job)
+            if job.release != None:
+                job.release()
+            return job
+        for part in whole.parts:
+            if part.exitCode == None:
+                return None
+        whole.started = min([part.started for part in whole.parts])
+        whole.finished = job.finished
+        whole.exitCode = 0
+        for part in whole.parts:
+            if part.exitCode != 0:
+                whole.exitCode = part.exitCode
+                break
+        whole.stats = progress.combine([part.stats for part in whole.parts])
+        whole.changes = progress.combineTallies([part.changes for part in whole.parts])
+        self.resolve(whole)
+        if whole.release != None:
+            whole.release()
+        return whole
+
+    def discard(self, job):
+        '''
+        Discards the update of a job that failed or was skipped.  A pruner
+        that will not run is forgotten.
+        '''
+        if job.update != None:
+            job.update.discard()
+            if job.update in self.pruners:
+                self.pruners.remove(job.update)
+
+    def isIdle(self):
+        '''
+        Returns True when there is nothing queued or running.
+        '''
+        return len(self.unfinished) == 0 and len(self.running) == 0
@@ -0,0 +1,144 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+Splits one rsync command over a large local tree into several commands that
+can run in parallel.  Each shard transfers some of the top-level entries of
+the source, chosen by filter rules, into the same destination.
+'''
+import os
+
+import rsync
+
+# Options that do not combine with sharding.  Excluded entries would be
+# deleted by every other shard, and a file list replaces the filter rules.
+UNSHARDABLE = ('delete-excluded', 'files-from')
+
+def sender(command, reverse=False):
+    '''
+    Returns the path files are copied from.
+    '''
+    if reverse:
+        return command.getDestination()
+    return command.getSource()
+
+def weigh(path, mode):
+    '''
+    Measures a top-level entry for balancing: its total size in bytes or its
+    number of files, counting everything below it.
+    '''
+    if not os.path.isdir(path) or os.path.islink(path):
+        if mode == rsync.SHARD_BY_SIZE:
+            return os.lstat(path).st_size
+        return 1
+    total = 0
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        if mode == rsync.SHARD_BY_SIZE:
+            for name in filenames:
+                try:
+                    total += os.lstat(os.path.join(dirpath, name)).st_size
+                except OSError:
+                    # the file went away during the scan
+                    pass
+        else:
+            total += len(filenames)
+    return total
+
+def assign(root, names, count, mode):
+    '''
+    Divides entry names into at most count groups.  Entries are dealt out in
+    turn, or, when balancing, heaviest first to the lightest group.
+    '''
+    groups = [list() for idx in range(count)]
+    if mode == rsync.SHARD_BY_ENTRY:
+        for (idx, name) in enumerate(names):
+            groups[idx % count].append(name)
+    else:
+        weights = [(weigh(os.path.join(root, name), mode), name) for name in names]
+        totals = [0] * count
+        for (weight, name) in sorted(weights, reverse=True):
+            # ties go to the group with the fewest entries
+            lightest = min(range(count), key=lambda idx: (totals[idx], len(groups[idx])))
+            groups[lightest].append(name)
+            totals[lightest] += weight
+    return [group for group in groups if len(group) > 0]
+
+def escape(name):
+    '''
+    Escapes a file name for use as an rsync filter pattern.
+    '''
+    if '*' in name or '?' in name or '[' in name:
+        for char in '\\*?[':
+            name = name.replace(char, '\\' + char)
+    return name
+
+def split(command, reverse=False):
+    '''
+    Returns a list of commands that together do the work of command, one
+    per shard.  Commands that are not set up for sharding, or that cannot be
+    sharded because their source is remote or not a directory, are returned
+    alone.
+    '''
+    path = sender(command, reverse)
+    count = command.getShards()
+    options = command.getOptions()
+    if (count < 2 or path.getHost() != '' or path.getUser() != '' or
+        len([opt for opt in UNSHARDABLE if opt in options]) > 0):
+        return [command]
+
+    root = os.path.expanduser(path.getPath())
+    if not os.path.isdir(root):
+        return [command]
+    names = sorted(os.listdir(root))
+    groups = assign(root, names, count, command.getShardMode())
+    if len(groups) < 2:
+        return [command]
+
+    # filter patterns are anchored at the top of the transfer, which is the
+    # source directory itself if it ends with a slash, or its parent if not
+    if path.getPath().endswith('/'):
+        prefix = '/'
+        rules = list()
+    else:
+        prefix = '/' + escape(os.path.basename(root.rstrip('/'))) + '/'
+        rules = ['+ ' + prefix]
+
+    shards = list()
+    for group in groups:
+        shardRules = rules + ['+ ' + prefix + escape(name) for name in group]
+        shardRules.append('- ' + prefix + '*')
+        shards.append(filtered(command, shardRules))
+
+    # entries the receiver has but the source does not belong to no shard,
+    # so a deleting command gets one more pass over just the top level.  It
+    # only deletes, leaving every file to the shard that copies it.
+    if len([opt for opt in options if opt.startswith('del')]) > 0:
+        deletions = filtered(command, rules + ['- ' + prefix + '*/*'])
+        deletions.getOptions().enable('existing')
+        deletions.getOptions().enable('ignore-existing')
+        shards.append(deletions)
+    return shards
+
+def filtered(command, rules):
+    '''
+    Returns a copy of command limited by filter rules.
+    '''
+    options = command.getOptions().copy()
+    options.enable('filter', 'merge_' + rsync.filterFile(rules))
+    return rsync.Command(command.getSource(), command.getDestination(), options)
@@ -0,0 +1,137 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+Runs a profile as a series of backup snapshots; see rsync.Snapshot.  The
+commands of a snapshot profile copy into the incoming directory, with
+--link-dest pointing at the current snapshot, so unchanged files are hard
+links rather than copies.  Once every command has succeeded, the incoming
+directory is renamed to a time-stamped snapshot and the current link is
+replaced with one to it.  The work on the backup host is done by one shell
+script before the commands and one after, each in a single ssh session.
+'''
+import pipes
+import posixpath
+import shlex
+
+import rsync
+
+# Options that give the remote shell rsync uses, which is also used to run
+# the snapshot scripts
+RSH_OPTIONS = ('e', 'rsh')
+
+def parsePath(text):
+    '''
+    Reads a path written as rsync writes it, [[user@]host:]path.
+    '''
+    (user, host, path) = ('', '', text)
+    if ':' in text and not text.startswith('/'):
+        (host, path) = text.split(':', 1)
+        if '@' in host:
+            (user, host) = host.split('@', 1)
+    return rsync.Path(path, host, user)
+
+def location(snapshot, directory, command):
+    '''
+    Returns the path of a command's destination within one of the snapshot
+    directories.  The command's own destination path names a directory in
+    the snapshot, or the snapshot itself if it is empty.
+    '''
+    sub = command.getDestination().getPath().strip('/')
+    path = posixpath.join(snapshot.getRoot().getPath(), directory, sub)
+    if sub == '' or command.getDestination().getPath().endswith('/'):
+        path = path.rstrip('/') + '/'
+    return path
+
+def snapshotted(command, snapshot, reverse=False):
+    '''
+    Returns a copy of command that copies into the snapshot's incoming
+    directory, hard linking unchanged files to the current snapshot.  In
+    reverse, the copy restores from the current snapshot.
+    '''
+    root = snapshot.getRoot()
+    options = command.getOptions().copy()
+    if reverse:
+        path = location(snapshot, snapshot.getCurrent(), command)
+    else:
+        path = location(snapshot, snapshot.getIncoming(), command)
+        options.enable('link-dest', location(snapshot, snapshot.getCurrent(), command))
+    copy = rsync.Command(command.getSource(),
+                         rsync.Path(path, root.getHost(), root.getUser()), options)
+    copy.setShards(command.getShards())
+    copy.setShardMode(command.getShardMode())
+    copy.setIncremental(command.getIncremental())
+    return copy
+
+def remoteShell(commands):
+    '''
+    Returns the remote shell the commands use, which is ssh unless one of
+    them says otherwise.
+    '''
+    for command in commands:
+        options = command.getOptions()
+        for opt in RSH_OPTIONS:
+            if opt in options and options.getOptions()[opt][0] != '':
+                # the parameter is written as it would be on a command line
+                return ' '.join(shlex.split(options.getOptions()[opt][0]))
+    return 'ssh'
+
+def session(snapshot, script, shell='ssh'):
+    '''
+    Returns a command line that runs a shell script on the backup host, in
+    one session if it is remote.
+    '''
+    root = snapshot.getRoot()
+    if root.getHost() == '' and root.getUser() == '':
+        return "sh -c %s" % pipes.quote(script)
+    target = root.getHost() or 'localhost'
+    if root.getUser() != '':
+        target = root.getUser() + '@' + target
+    # the remote login shell might not be sh, so ask for sh explicitly
+    return "%s %s %s" % (shell, pipes.quote(target),
+                         pipes.quote("sh -c " + pipes.quote(script)))
+
+def prepareScript(snapshot, commands):
+    '''
+    Returns a script that creates the directories the commands copy into,
+    since rsync only creates the last directory of a destination.
+    '''
+    directories = [location(snapshot, snapshot.getIncoming(), command)
+                   for command in commands]
+    return "mkdir -p " + " ".join([pipes.quote(directory) for directory in directories])
+
+def rotateScript(snapshot):
+    '''
+    Returns a script that turns the incoming directory into a time-stamped
+    snapshot and makes it current.  The current link is replaced by
+    renaming a new link over it, so it always names a complete snapshot,
+    even if the script is interrupted.  If the time-stamped name is taken,
+    nothing is changed and the script fails.
+    '''
+    current = pipes.quote(snapshot.getCurrent())
+    return " && ".join([
+        "cd %s" % pipes.quote(snapshot.getRoot().getPath()),
+        "stamp=%s$(date +%%Y%%m%%d-%%H%%M%%S)" % pipes.quote(snapshot.getName() + '-'),
+        "test ! -e \"$stamp\"",
+        "mv %s \"$stamp\"" % pipes.quote(snapshot.getIncoming()),
+        "rm -f %s.new" % current,
+        "ln -s \"$stamp\" %s.new" % current,
+        # GNU mv needs -T and BSD mv needs -h to replace a link to a directory
+        "{ mv -T %s.new %s 2>/dev/null || mv -h %s.new %s; }" % (current, current,
+                                                                  current, current)])
@@ -0,0 +1,220 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+Accounts for the disk space a profile's backup snapshots use.  Snapshots
+share unchanged files through hard links, so the space a snapshot holds on
+its own, and the space all of them take together, depend on which inodes
+each one names.  Every inode seen is kept in a local database with the
+first and last snapshot it appears in and the number of snapshots that
+name it.  Snapshots do not change once made, so each is scanned only once,
+when it is first seen; a snapshot that has been deleted is taken out of the
+counts without scanning anything.
+
+This relies on the snapshots being made with --link-dest, where a file
+that stays the same is linked into each snapshot in turn, so the
+snapshots naming an inode are always a consecutive run of them.
+'''
+import hashlib
+import os
+import pipes
+import sqlite3
+import subprocess
+
+import prune
+import snapshot
+
+# Where the inode databases are kept
+SPACE_DIR = os.path.expanduser("~/.synctity/space")
+# The number of scanned entries written to the database at a time
+BATCH_SIZE = 10000
+# find and stat measure disk usage in blocks of this many bytes
+BLOCK_SIZE = 512
+
+def ordinal(name):
+    '''
+    Returns a number that orders a snapshot by its time stamp.
+    '''
+    return int(name[-15:].replace('-', ''))
+
+def scanScript(snap, names):
+    '''
+    Returns a script that writes the inode and disk usage of everything in
+    each of the named snapshots, one per line.  Each snapshot starts with a
+    line holding its name after a slash.  GNU find is used where it is
+    available, and BSD stat otherwise.
+    '''
+    scans = list()
+    for name in names:
+        quoted = pipes.quote(name)
+        scans.append("echo /%s && if [ -n \"$gnu\" ]; then find %s -printf '%%i %%b\\n'; "
+                     "else find %s -exec stat -f '%%i %%b' {} +; fi" % (quoted, quoted, quoted))
+    return ("cd %s && gnu= && { find . -maxdepth 0 -printf '' >/dev/null 2>&1 && gnu=1 || true; } && " %
+            pipes.quote(snap.getRoot().getPath()) + " && ".join(scans))
+
+class Accounting:
+    '''
+    The inodes of a profile's snapshots, kept in an SQLite database.
+    '''
+    def __init__(self, snap, shell='ssh'):
+        self.snapshot = snap
+        self.shell = shell
+        if not os.path.isdir(SPACE_DIR):
+            os.makedirs(SPACE_DIR)
+        key = hashlib.sha1("%s\0%s" % (snap.getRoot(), snap.getName())).hexdigest()
+        self.connection = sqlite3.connect(os.path.join(SPACE_DIR, key + '.db'))
+        self.connection.text_factory = str
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots (name TEXT PRIMARY KEY, "
+            "ordinal INTEGER, entries INTEGER, blocks INTEGER)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS inodes (inode INTEGER PRIMARY KEY, "
+            "blocks INTEGER, first INTEGER, last INTEGER, count INTEGER)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS inodes_first ON inodes (first)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS inodes_last ON inodes (last)")
+        self.connection.commit()
+
+    def known(self):
+        '''
+        Returns the names of the snapshots already counted.
+        '''
+        return set([row[0] for row in
+                    self.connection.execute("SELECT name FROM snapshots")])
+
+    def update(self):
+        '''
+        Brings the counts up to date with the snapshots on the backup host,
+        scanning new snapshots and forgetting deleted ones.  Returns the exit
+        status of the listing or the scan, which is 0 on success.
+        '''
+        listing = subprocess.Popen(snapshot.session(self.snapshot, prune.listScript(self.snapshot),
+                                                    self.shell),
+                                   shell=True, stdout=subprocess.PIPE, close_fds=True)
+        lines = listing.communicate()[0].splitlines()
+        if listing.returncode != 0:
+            return listing.returncode
+        names = set([name for (when, name) in prune.stamps(lines[1:], self.snapshot.getName())])
+        known = self.known()
+        for name in sorted(known - names, key=ordinal):
+            self.forget(name)
+        new = sorted(names - known, key=ordinal)
+        if len(new) == 0:
+            return 0
+        return self.scan(new)
+
+    def scan(self, names):
+        '''
+        Scans snapshots and adds their inodes to the counts, in one session.
+        A snapshot is only recorded once its scan is complete.
+        '''
+        scan = subprocess.Popen(snapshot.session(self.snapshot, scanScript(self.snapshot, names),
+                                                 self.shell),
+                                shell=True, stdout=subprocess.PIPE, close_fds=True)
+        name = None
+        batch = list()
+        # files hard linked within a snapshot are only counted once
+        seen = set()
+        for line in scan.stdout:
+            if line.startswith('/'):
+                self.add(name, batch)
+                name = line[1:].rstrip('\n')
+                batch = list()
+                seen = set()
+                continue
+            fields = line.split()
+            if name == None or len(fields) != 2 or fields[0] in seen:
+                continue
+            seen.add(fields[0])
+            batch.append((int(fields[0]), int(fields[1])))
+            if len(batch) >= BATCH_SIZE:
+                self.add(name, batch, False)
+                batch = list()
+        exitCode = scan.wait()
+        if exitCode == 0:
+            self.add(name, batch)
+        else:
+            # leave out the snapshot whose scan did not finish
+            self.connection.rollback()
+        return exitCode
+
+    def add(self, name, batch, complete=True):
+        '''
+        Counts a batch of (inode, blocks) pairs from a snapshot, and records
+        the snapshot once its last batch is in.
+        '''
+        if name == None:
+            return
+        position = ordinal(name)
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO inodes VALUES (?, ?, ?, ?, 0)",
+            [(inode, blocks, position, position) for (inode, blocks) in batch])
+        self.connection.executemany(
+            "UPDATE inodes SET count = count + 1, first = MIN(first, ?), "
+            "last = MAX(last, ?) WHERE inode = ?",
+            [(position, position, inode) for (inode, blocks) in batch])
+        self.connection.execute(
+            "INSERT OR IGNORE INTO snapshots VALUES (?, ?, 0, 0)", (name, position))
+        self.connection.execute(
+            "UPDATE snapshots SET entries = entries + ?, blocks = blocks + ? WHERE name = ?",
+            (len(batch), sum([blocks for (inode, blocks) in batch]), name))
+        if complete:
+            self.connection.commit()
+
+    def forget(self, name):
+        '''
+        Takes a deleted snapshot out of the counts.  Inodes no other snapshot
+        names are dropped, and the others now start or end at the snapshot
+        before or after it.
+        '''
+        position = ordinal(name)
+        self.connection.execute("DELETE FROM snapshots WHERE name = ?", (name,))
+        self.connection.execute(
+            "UPDATE inodes SET count = count - 1 WHERE first <= ? AND last >= ?",
+            (position, position))
+        self.connection.execute("DELETE FROM inodes WHERE count <= 0")
+        self.connection.execute(
+            "UPDATE inodes SET first = (SELECT MIN(ordinal) FROM snapshots "
+            "WHERE ordinal > ?) WHERE first = ?", (position, position))
+        self.connection.execute(
+            "UPDATE inodes SET last = (SELECT MAX(ordinal) FROM snapshots "
+            "WHERE ordinal < ?) WHERE last = ?", (position, position))
+        self.connection.commit()
+
+    def report(self):
+        '''
+        Returns a row for each snapshot, oldest first, with its name, its
+        size, the bytes it added over the snapshot before it, and the bytes
+        only it holds, which deleting it would free.  Also returns the total
+        of all sizes and the space all the snapshots take together.
+        '''
+        rows = list()
+        for (name, position, blocks) in self.connection.execute(
+                "SELECT name, ordinal, blocks FROM snapshots ORDER BY ordinal").fetchall():
+            added = self.connection.execute(
+                "SELECT TOTAL(blocks) FROM inodes WHERE first = ?", (position,)).fetchone()[0]
+            unique = self.connection.execute(
+                "SELECT TOTAL(blocks) FROM inodes WHERE first = ? AND last = ?",
+                (position, position)).fetchone()[0]
+            rows.append((name, blocks * BLOCK_SIZE, int(added) * BLOCK_SIZE,
+                         int(unique) * BLOCK_SIZE))
+        total = self.connection.execute("SELECT TOTAL(blocks) FROM inodes").fetchone()[0]
+        return (rows, sum([row[1] for row in rows]), int(total) * BLOCK_SIZE)
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,401 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+Keeps profiles in an SQLite database, each pickled in a record of its own,
+so that saving writes only the profiles that changed, in one transaction,
+and a damaged record costs only the profile it holds.  Files written by
+earlier versions, which pickled the whole list of profiles into a shelve,
+are still read; the first save moves such a file aside and writes the
+database in its place.
+
+Opening a file reads only the names of its profiles.  The rest of a profile
+is read when it is first wanted, and the least recently used profiles are
+dropped again once more than a few are held, unless they have changed.
+
+Each record also lists the filter files its profile's commands give rsync.
+Once a save is done, filter files none of them list are deleted if they
+have gone unused for a while; see rsync.pruneFilters.
+'''
+import cPickle
+import os
+import shelve
+import sqlite3
+import whichdb
+
+import rsync
+
+DEFAULT_CONFIG=os.path.expanduser("~/synctity.db")
+# Added to the name of a shelve file when it is replaced by a database
+SHELVE_SUFFIX=".shelve"
+# The files a shelve may be kept in, depending on the dbm module that made it
+SHELVE_EXTENSIONS=('', '.db', '.dat', '.dir', '.bak', '.pag')
+# The most unchanged profiles held at once
+CACHE_PROFILES=32
+
+def isDatabase(filename):
+    '''
+    Determines whether a file is an SQLite database.
+    '''
+    try:
+        header = open(filename, 'rb')
+        try:
+            return header.read(16) == "SQLite format 3\0"
+        finally:
+            header.close()
+    except IOError:
+        return False
+
+def isShelve(filename):
+    '''
+    Determines whether a file is a shelve, as written by earlier versions.
+    '''
+    return not isDatabase(filename) and bool(whichdb.whichdb(filename))
+
+def filterNames(profile):
+    '''
+    Lists the filter files a profile's commands give rsync, one per line.
+    '''
+    names = [command.getOptions().getFilterName() for command in profile]
+    return '\n'.join([name for name in names if name != None])
+
+def readShelve(filename):
+    '''
+    Loads the list of profiles pickled in a shelve.  Returns None if the
+    shelve does not hold Synctity profiles.
+    '''
+    # open the shelve file, and grab an object called profiles
+    old = shelve.open(filename, 'r')
+    try:
+        if "profiles" in old:
+            return old["profiles"]
+        return None
+    finally:
+        old.close()
+
+class Entry:
+    '''
+    A profile in the list a file holds.  Its name is read with the list,
+    and the profile itself only once it is wanted.
+    '''
+    def __init__(self, name, row=None, position=None, profile=None):
+        self.name = name
+        # the profile's record in the file, or None if it is not saved yet
+        self.row = row
+        self.position = position
+        self.profile = profile
+        # whether the profile has changed since it was read or written
+        self.dirty = row == None
+        # whether the profile's record could not be read
+        self.unreadable = False
+
+    def getName(self):
+        if self.profile != None:
+            return self.profile.getName()
+        return self.name
+
+def entry(profile):
+    '''
+    Returns an entry for a profile that is not saved yet.
+    '''
+    return Entry(profile.getName(), profile=profile)
+
+class Store:
+    '''
+    A file of profiles.  It keeps track of the entries it has read profiles
+    for, and is told which of those profiles are changed, so a save writes
+    just those and the new ones.
+    '''
+    def __init__(self, filename, cacheSize=CACHE_PROFILES):
+        self.filename = filename
+        self.cacheSize = cacheSize
+        # the records in the file
+        self.rows = set()
+        # entries whose profiles have been read or written, least recently
+        # used first
+        self.cache = list()
+        # id of each profile held -> its entry
+        self.loaded = dict()
+        # whether a save replaces every record in the file, as it does
+        # until the file has been read
+        self.replace = True
+
+    def connect(self, filename):
+        connection = sqlite3.connect(filename)
+        connection.text_factory = str
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS profiles (id INTEGER PRIMARY KEY, "
+            "position INTEGER, name TEXT, data BLOB, filters TEXT)")
+        # files written before filter files were listed lack the column
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(profiles)")]
+        if 'filters' not in columns:
+            connection.execute("ALTER TABLE profiles ADD COLUMN filters TEXT")
+        connection.commit()
+        return connection
+
+    def index(self):
+        '''
+        Reads the names of the profiles in the file, and returns an entry
+        for each, in order.  Returns None if the file does not hold Synctity
+        profiles.
+        '''
+        self.rows = set()
+        self.cache = list()
+        self.loaded = dict()
+        self.replace = True
+        if isShelve(self.filename):
+            # a shelve is read whole, and the first save writes every profile
+            profiles = readShelve(self.filename)
+            if profiles == None:
+                return None
+            return [entry(profile) for profile in profiles]
+        if not isDatabase(self.filename):
+            return None
+        connection = self.connect(self.filename)
+        try:
+            entries = [Entry(name, row, position) for (row, position, name) in
+                       connection.execute("SELECT id, position, name FROM profiles "
+                                          "ORDER BY position, id")]
+        finally:
+            connection.close()
+        self.rows = set([item.row for item in entries])
+        self.replace = False
+        return entries
+
+    def read(self, item):
+        '''
+        Reads an entry's profile from the file if it is not held, and
+        returns it.  Returns None if it cannot be read.
+        '''
+        if item.profile == None and item.row != None and not item.unreadable:
+            connection = self.connect(self.filename)
+            try:
+                found = connection.execute("SELECT data FROM profiles WHERE id = ?",
+                                           (item.row,)).fetchone()
+            finally:
+                connection.close()
+            try:
+                item.profile = cPickle.loads(str(found[0]))
+            except Exception:
+                item.unreadable = True
+        return item.profile
+
+    def get(self, item):
+        '''
+        Returns an entry's profile, reading it from the file if it is not
+        held, and dropping the least recently used others.  Returns None if
+        it cannot be read.
+        '''
+        profile = self.read(item)
+        if profile == None:
+            return None
+        if item.row != None:
+            self.loaded[id(profile)] = item
+            if item in self.cache:
+                self.cache.remove(item)
+            self.cache.append(item)
+            self.evict()
+        return profile
+
+    def evict(self):
+        '''
+        Drops the least recently used profiles held beyond the cache size.
+        Changed profiles are kept until they are saved.
+        '''
+        clean = [item for item in self.cache if not item.dirty]
+        for item in clean[:max(0, len(self.cache) - self.cacheSize)]:
+            self.cache.remove(item)
+            del self.loaded[id(item.profile)]
+            item.profile = None
+
+    def touch(self, profile):
+        '''
+        Notes that a profile has changed, so the next save writes it.
+        '''
+        if id(profile) in self.loaded:
+            self.loaded[id(profile)].dirty = True
+
+    def detach(self, entries):
+        '''
+        Reads the profiles of a list of entries and makes them new, so they
+        can be written to another file.
+        '''
+        for item in entries:
+            self.read(item)
+            item.row = None
+            item.position = None
+            item.dirty = True
+        self.cache = list()
+        self.loaded = dict()
+
+    def load(self):
+        '''
+        Loads the whole list of profiles in the file, in order, leaving out
+        those that cannot be read.  Returns None if the file does not hold
+        Synctity profiles.
+        '''
+        entries = self.index()
+        if entries == None:
+            return None
+        profiles = list()
+        for item in entries:
+            profile = self.read(item)
+            if profile != None:
+                profiles.append(profile)
+        return profiles
+
+    def write(self, entries):
+        '''
+        Saves a list of entries, writing only the profiles that are new or
+        have changed, and dropping those no longer in the list.  Nothing is
+        written if the save fails part way.  Returns the number of profiles
+        written.
+        '''
+        if isShelve(self.filename):
+            return self.replaceShelve(entries)
+        connection = self.connect(self.filename)
+        try:
+            if self.replace:
+                connection.execute("DELETE FROM profiles")
+                self.rows = set()
+            (placed, written) = self.update(connection, entries)
+            keep = self.filters(connection)
+            connection.commit()
+        except:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+        self.place(placed)
+        if keep != None:
+            rsync.pruneFilters(keep)
+        return written
+
+    def update(self, connection, entries):
+        '''
+        Writes the changes to a list of entries since they were last read
+        or written, without committing them.  Returns where each entry was
+        put, and the number of profiles written.
+        '''
+        placed = list()
+        written = 0
+        for (position, item) in enumerate(entries):
+            row = item.row
+            if row == None and item.profile == None:
+                # unreadable, and not in this file
+                continue
+            if row == None or item.dirty:
+                data = sqlite3.Binary(cPickle.dumps(item.profile, cPickle.HIGHEST_PROTOCOL))
+                filters = filterNames(item.profile)
+                if row == None:
+                    row = connection.execute(
+                        "INSERT INTO profiles (position, name, data, filters) "
+                        "VALUES (?, ?, ?, ?)",
+                        (position, str(item.getName()), data, filters)).lastrowid
+                else:
+                    connection.execute(
+                        "UPDATE profiles SET position = ?, name = ?, data = ?, "
+                        "filters = ? WHERE id = ?",
+                        (position, str(item.getName()), data, filters, row))
+                written += 1
+            elif item.position != position:
+                connection.execute("UPDATE profiles SET position = ? WHERE id = ?",
+                                   (position, row))
+            placed.append((item, row, position))
+        kept = set([row for (item, row, position) in placed])
+        connection.executemany("DELETE FROM profiles WHERE id = ?",
+                               [(row,) for row in self.rows - kept])
+        return (placed, written)
+
+    def filters(self, connection):
+        '''
+        Returns the set of filter files the saved profiles' commands give
+        rsync, listing them first for records saved before they were
+        listed.  Returns None if a record cannot be read, so which files are
+        still wanted is not known.
+        '''
+        unlisted = connection.execute(
+            "SELECT id, data FROM profiles WHERE filters IS NULL").fetchall()
+        for (row, data) in unlisted:
+            try:
+                filters = filterNames(cPickle.loads(str(data)))
+            except Exception:
+                return None
+            connection.execute("UPDATE profiles SET filters = ? WHERE id = ?",
+                               (filters, row))
+        keep = set()
+        for (filters,) in connection.execute("SELECT filters FROM profiles"):
+            keep.update(filters.split('\n'))
+        return keep
+
+    def place(self, placed):
+        '''
+        Records where a save put each entry.
+        '''
+        for (item, row, position) in placed:
+            if item.profile != None:
+                # the name shown once the profile is dropped is the one saved
+                item.name = item.profile.getName()
+            if item.dirty and item.profile != None:
+                self.loaded[id(item.profile)] = item
+                if item not in self.cache:
+                    self.cache.append(item)
+            (item.row, item.position, item.dirty) = (row, position, False)
+        self.rows = set([row for (item, row, position) in placed])
+        self.replace = False
+        self.evict()
+
+    def replaceShelve(self, entries):
+        '''
+        Writes a list of entries to a new database, then moves the shelve
+        it replaces aside, keeping it in case it is still wanted.
+        '''
+        temp = "%s.%d.tmp" % (self.filename, os.getpid())
+        if os.path.exists(temp):
+            os.remove(temp)
+        self.rows = set()
+        connection = self.connect(temp)
+        try:
+            (placed, written) = self.update(connection, entries)
+            keep = self.filters(connection)
+            connection.commit()
+        finally:
+            connection.close()
+        for extension in SHELVE_EXTENSIONS:
+            if os.path.exists(self.filename + extension):
+                os.rename(self.filename + extension,
+                          self.filename + SHELVE_SUFFIX + extension)
+        os.rename(temp, self.filename)
+        self.place(placed)
+        if keep != None:
+            rsync.pruneFilters(keep)
+        return written
+
+def load(filename):
+    '''
+    Loads the list of profiles stored in a file.  Returns None if the file
+    does not hold Synctity profiles.
+    '''
+    return Store(filename).load()
+
+def write(filename, profiles):
+    '''
+    Saves a list of profiles to a file.
+    '''
+    Store(filename).write([entry(profile) for profile in profiles])
@@ -19,42 +19,64 @@ along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
 Created on Nov 18, 2009
 '''
 from collections import deque
+import itertools
 import os
-import shelve
+import sqlite3
 import sys
+import threading
 from PyQt4 import QtCore, QtGui
 
-import command
+# the modules that run, preview and watch profiles are imported when first
+# used, so the window opens without them
 import rsync
-import about_ui
+import store
 import synctity_ui
 
 APPLICATION_NAME="Synctity"
 APPLICATION_VERSION="1.03"
 APPLICATION_WEBSITE="https://github.com/beastwood/synctity"
-DEFAULT_CONFIG=os.path.expanduser("~/synctity.db")
+DEFAULT_CONFIG=store.DEFAULT_CONFIG
+# console output is written to the screen this often, in milliseconds
+CONSOLE_INTERVAL=100
+# the console keeps at most this many lines, dropping the oldest
+CONSOLE_LINES=5000
+# the most unwritten console output held between updates, in bytes
+CONSOLE_PENDING=1024*1024
+# the most commands a profile may run at once, as scheduler.MAX_PROCESSES
+MAX_PROCESSES=8
 
 class ProfileModel(QtCore.QAbstractListModel):
     '''
-    A model that presents a set of profiles as a list.
+    A model that presents a set of profiles as a list.  It holds a store
+    entry for each profile, which is enough to show its name; the profile
+    itself is read from the store when it is first wanted.
     '''
     def __init__(self, parent=None):
         QtCore.QAbstractListModel.__init__(self, parent)
-        self.profiles = list()
+        self.entries = list()
+        self.store = None
         
-    def setProfiles(self, profiles):
-        self.profiles = profiles
+    def setEntries(self, entries, profileStore=None):
+        '''
+        Sets the entries this model shows, and the store that reads their
+        profiles.
+        '''
+        self.entries = entries
+        self.store = profileStore
         self.reset()
         
-    def getProfiles(self):
-        return self.profiles
+    def getEntries(self):
+        return self.entries
+        
+    def setStore(self, profileStore):
+        self.store = profileStore
         
     def isValid(self, index):
         '''
         Determines if an index references a profile in this model.  Index
         is a single number, not a QModelIndex.
         '''
-        return index >= 0 and index < len(self.profiles)
+        return index >= 0 and index < len(self.entries)
     
     def data(self, index, role=QtCore.Qt.DisplayRole):
         '''
@@ -65,7 +87,7 @@ class ProfileModel(QtCore.QAbstractListModel):
         if (role == QtCore.Qt.DisplayRole and
             index.isValid() and 
             self.isValid(index.row())):
-            data = self.profiles[index.row()].getName()
+            data = self.entries[index.row()].getName()
         else:
             data = QtCore.QVariant()
         return data
@@ -74,17 +96,17 @@ class ProfileModel(QtCore.QAbstractListModel):
         '''
         Gets the number of profiles stored in this model
         '''
-        return len(self.profiles)
+        return len(self.entries)
     
     def append(self, profile):
         '''
         Add a profile to this model, and return the new item's QModelIndex
         '''
         # find the index of inserting and notify any views
-        newIdx = len(self.profiles)
+        newIdx = len(self.entries)
         self.beginInsertRows(QtCore.QModelIndex(), newIdx, newIdx)
         # add the profile to the model
-        self.profiles.append(profile)
+        self.entries.append(store.entry(profile))
         # alert any views, and return a QModelIndex of the new element
         self.endInsertRows()
         return self.index(newIdx, 0)
@@ -97,23 +119,26 @@ class ProfileModel(QtCore.QAbstractListModel):
         if self.isValid(index):
             # notify any views and remove the profile
             self.beginRemoveRows(QtCore.QModelIndex(), index, index)
-            self.profiles.remove(self.profiles[index])
+            del self.entries[index]
             self.endRemoveRows()
     
     def get(self, index):
         '''
-        Get a reference to the profile at the given index.  Index is a single
-        number, not a QModelIndex.
+        Get a reference to the profile at the given index, reading it from
+        the store if need be.  Index is a single number, not a QModelIndex.
+        Returns None if the profile cannot be read.
         '''
         if self.isValid(index):
-            return self.profiles[index]
+            if self.store != None:
+                return self.store.get(self.entries[index])
+            return self.entries[index].profile
         
     def update(self, profile):
         '''
         Notify any views that the given profile has been modified.
         '''
-        idx = self.profiles.index(profile)
-        if self.isValid(idx):
+        found = [idx for (idx, entry) in enumerate(self.entries) if entry.profile is profile]
+        for idx in found:
             # build the QModelIndex, and emit the changed signal
             modelIdx = self.index(idx, 0)
             self.emit(QtCore.SIGNAL("dataChanged(QModelIndex, QModelIndex)"), 
@@ -198,8 +223,11 @@ class CommandModel(QtCore.QAbstractListModel):
         if self.isValid(index):
             # build a command form for editing the command
             selected = self.profile.get(index)
+            # the form is only loaded once a command is first edited, to
+            # keep it out of the start up time
+            import command
             dialog = command.CommandForm()
-            dialog.setCommand(selected)
+            dialog.setCommand(selected, self.profile.getCommands())
             
             # launch as a modal dialog
             dialog.exec_()
@@ -208,101 +236,398 @@ class CommandModel(QtCore.QAbstractListModel):
             self.emit(QtCore.SIGNAL("dataChanged(QModelIndex, QModelIndex)"), 
                       self.index(index, 0), self.index(index, 0))
             
+class ConsoleWriter:
+    '''
+    ConsoleWriter collects process output and writes it to a QPlainTextEdit
+    on a timer, so a flood of small chunks costs one screen update per
+    interval.  The console keeps a bounded number of lines, and carriage 
+    returns overwrite the current line the way a terminal does, so progress
+    output does not pile up.
+    '''
+    def __init__(self, textEdit, interval=CONSOLE_INTERVAL, maxLines=CONSOLE_LINES):
+        '''
+        Initialize a ConsoleWriter.  textEdit ought to be a QPlainTextEdit.
+        '''
+        self.textConsole = textEdit
+        self.textConsole.setMaximumBlockCount(maxLines)
+        
+        # output waiting to be written, as (text, error) chunks in the order
+        # they arrived, and their total size
+        self.pending = deque()
+        self.pendingSize = 0
+        # whether the last text written ended a line
+        self.lineStart = True
+        # whether the line on screen ended with a carriage return, so the
+        # next output on it replaces it
+        self.overwrite = False
+        
+        # text formats for standard output and standard error (red)
+        self.normalFormat = QtGui.QTextCharFormat()
+        self.errorFormat = QtGui.QTextCharFormat()
+        self.errorFormat.setForeground(QtGui.QBrush(QtGui.QColor.fromHsvF(0.0, 0.9, 0.7)))
+        
+        # pending output is flushed to the screen when the timer fires
+        self.timer = QtCore.QTimer()
+        self.timer.setInterval(interval)
+        QtGui.qApp.connect(self.timer, QtCore.SIGNAL("timeout()"), self.flush)
+        
+    def write(self, text, error=False):
+        '''
+        Queue process output to be written at the next update.
+        '''
+        if len(text) == 0:
+            return
+        self.pending.append((text, error))
+        self.pendingSize += len(text)
+        self.lineStart = text.endswith('\n')
+        
+        # drop the oldest output if more is waiting than could be shown,
+        # cutting into the oldest chunk after a line where there is one
+        while self.pendingSize > CONSOLE_PENDING:
+            (oldest, oldestError) = self.pending[0]
+            excess = self.pendingSize - CONSOLE_PENDING
+            cut = oldest.find('\n', excess - 1) + 1
+            if cut == 0:
+                cut = min(excess, len(oldest))
+            if cut == len(oldest):
+                self.pending.popleft()
+            else:
+                self.pending[0] = (oldest[cut:], oldestError)
+            self.pendingSize -= cut
+        
+        if not self.timer.isActive():
+            self.timer.start()
+            
+    def line(self, text):
+        '''
+        Queue a message to be written on its own line.
+        '''
+        if not self.lineStart:
+            text = '\n' + text
+        self.write(text + '\n')
+        
+    def flush(self):
+        '''
+        Write all pending output to the console.
+        '''
+        self.timer.stop()
+        if len(self.pending) == 0:
+            return
+        
+        # only follow the output if the user has not scrolled away from it
+        scroll = self.textConsole.verticalScrollBar()
+        following = scroll.value() == scroll.maximum()
+        
+        cursor = QtGui.QTextCursor(self.textConsole.document())
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.beginEditBlock()
+        # consecutive chunks of the same kind are written together
+        for (error, chunks) in itertools.groupby(self.pending, lambda chunk: chunk[1]):
+            text = ''.join([chunk[0] for chunk in chunks])
+            if error:
+                format = self.errorFormat
+            else:
+                format = self.normalFormat
+            lines = text.split('\n')
+            for (idx, line) in enumerate(lines):
+                if idx > 0:
+                    cursor.insertBlock()
+                    self.overwrite = False
+                self.insertLine(cursor, line, format)
+        cursor.endEditBlock()
+        self.pending = deque()
+        self.pendingSize = 0
+        
+        if following:
+            scroll.setValue(scroll.maximum())
+            
+    def insertLine(self, cursor, line, format):
+        '''
+        Write part of a line at the cursor.  A carriage return starts the 
+        line over, so only the text after the last one is kept.
+        '''
+        if line == '':
+            return
+        segments = line.split('\r')
+        text = segments[-1]
+        # a trailing carriage return means the next output replaces this text
+        trailing = len(segments) > 1 and text == ''
+        if trailing:
+            text = segments[-2]
+        
+        # replace what is on the line unless the only return is the trailing one
+        if trailing:
+            returns = len(segments) - 2
+        else:
+            returns = len(segments) - 1
+        if self.overwrite or returns > 0:
+            cursor.movePosition(QtGui.QTextCursor.StartOfBlock, 
+                                QtGui.QTextCursor.KeepAnchor)
+            cursor.removeSelectedText()
+        cursor.insertText(text, format)
+        self.overwrite = trailing
+        
 class ProfileRunner:
     '''
     ProfileRunner is responsible for running commands as separate processes 
-    and sending the output to a text window.  Commands are queued and started
-    as prior commands finish.
+    and sending the output to a text window.  Commands are queued in a
+    scheduler and started on a pool of processes as prior commands finish.
     '''
-    def __init__(self, textEdit):
+    def __init__(self, console, maxProcesses=MAX_PROCESSES, 
+                 listener=None, history=None):
         '''
-        Initialize a ProfileRunner.  textEdit ought to be a QTextEdit.
+        Initialize a ProfileRunner.  console ought to be a ConsoleWriter.  If
+        given, listener is called as listener(job, event) for each progress
+        event parsed from a job's output, and every finished job is recorded
+        in history, a history.History.
         '''
+        import scheduler
         # output is sent to a text box
-        self.textConsole = textEdit;
+        self.console = console
+        self.listener = listener
+        self.history = history
                 
-        # commands are held in a queue until ready to be run.
-        self.commands = deque()
+        # commands are held by a scheduler until ready to be run.
+        self.scheduler = scheduler.Scheduler(maxProcesses)
         
-        # commands are run through a QProcess
-        self.process = QtCore.QProcess()
+        # commands are run through a pool of QProcess workers, which are
+        # created as needed and reused.  jobs maps a busy worker to its job,
+        # and parsers maps it to the parser reading the job's output.
+        self.workers = list()
+        self.jobs = dict()
+        self.parsers = dict()
+        
+        # pruners report from their own threads, so their reports are passed
+        # to the main thread through a signal
+        QtGui.qApp.connect(QtGui.qApp, QtCore.SIGNAL("pruned(PyQt_PyObject)"),
+                           self.onPruned)
+        # so are profiles planned and jobs prepared on their own threads,
+        # since both may scan whole source trees
+        QtGui.qApp.connect(QtGui.qApp, QtCore.SIGNAL("planned(PyQt_PyObject)"),
+                           self.onPlanned)
+        QtGui.qApp.connect(QtGui.qApp, QtCore.SIGNAL("prepared(PyQt_PyObject)"),
+                           self.onPrepared)
+        
+    def worker(self):
+        '''
+        Returns an idle QProcess, creating a new one if all are busy.
+        '''
+        for process in self.workers:
+            if process not in self.jobs:
+                return process
+        
+        process = QtCore.QProcess()
         # connect the QProcess signals to our slots
-        QtGui.qApp.connect(self.process, QtCore.SIGNAL("started()"), self.onStarted)
-        QtGui.qApp.connect(self.process, QtCore.SIGNAL("readyReadStandardOutput()"), self.onStdout)
-        QtGui.qApp.connect(self.process, QtCore.SIGNAL("readyReadStandardError()"), self.onStderr)
-        QtGui.qApp.connect(self.process, QtCore.SIGNAL("finished(int)"), self.onFinished)
+        QtGui.qApp.connect(process, QtCore.SIGNAL("started()"), 
+                           lambda: self.onStarted(process))
+        QtGui.qApp.connect(process, QtCore.SIGNAL("readyReadStandardOutput()"), 
+                           lambda: self.onStdout(process))
+        QtGui.qApp.connect(process, QtCore.SIGNAL("readyReadStandardError()"), 
+                           lambda: self.onStderr(process))
+        QtGui.qApp.connect(process, QtCore.SIGNAL("finished(int)"), 
+                           lambda exitCode: self.onFinished(process, exitCode))
+        QtGui.qApp.connect(process, QtCore.SIGNAL("error(QProcess::ProcessError)"), 
+                           lambda error: self.onError(process, error))
+        self.workers.append(process)
+        return process
     
-    def onStarted(self):
+    def onStarted(self, process):
         '''
         Do nothing when the process launches.  Could print out the pid.
         '''
         pass
     
-    def onStdout(self):
+    def onStdout(self, process):
         '''
         When the process generates standard output, print it to the text box.
         '''
-        self.textConsole.insertPlainText(str(self.process.readAllStandardOutput()))
-        # auto scroll
-        scroll = self.textConsole.verticalScrollBar()
-        scroll.setValue(scroll.maximum())
+        data = str(process.readAllStandardOutput())
+        self.console.write(data)
+        if process in self.parsers:
+            self.parsers[process].feed(data)
         
-    def onStderr(self):
+    def onStderr(self, process):
         '''
         When the process generates standard error, print it to the text box in red.
         '''
-        color = self.textConsole.textColor()
-        self.textConsole.setTextColor(QtGui.QColor.fromHsvF(0.0, 0.9, 0.7))
-        self.textConsole.insertPlainText(str(self.process.readAllStandardError()))
-        self.textConsole.setTextColor(color)
-        # auto scroll
-        scroll = self.textConsole.verticalScrollBar()
-        scroll.setValue(scroll.maximum())
+        self.console.write(str(process.readAllStandardError()), True)
+        
+    def onProgress(self, job, event):
+        '''
+        Pass along an event parsed from a job's output.
+        '''
+        if job.listener != None:
+            job.listener(event)
+        if self.listener != None:
+            self.listener(job, event)
+        
+    def onError(self, process, error):
+        '''
+        A process that could not be launched never finishes, so report it as
+        a failure to free its slot.
+        '''
+        if error == QtCore.QProcess.FailedToStart:
+            self.onFinished(process, -1)
         
-    def onFinished(self, exitCode):
+    def onFinished(self, process, exitCode):
         '''
         Report the result of a finished command, and launch the next one.
         '''
-        if exitCode != 0:
-            message = "There may have been an error with the transfer."
-        else:
-            message = ""
-        self.textConsole.append("Finished (%d)\n%s" % (exitCode, message))
+        job = self.jobs.pop(process, None)
+        if job == None:
+            return
+        if exitCode != 0 and job.fallback != None:
+            # run the job's fallback on the same process, in the same slot
+            (job.commandline, job.argv) = job.fallback
+            job.fallback = None
+            self.jobs[process] = job
+            self.console.line("Failed (%d), so running: %s" % (exitCode, job.commandline))
+            process.start(job.argv[0], list(job.argv[1:]))
+            return
+        parser = self.parsers.pop(process)
+        parser.close()
+        job.stats = parser.stats
+        job.changes = parser.changes
+        # shards of a command are reported once, when the last one finishes
+        job = self.scheduler.finish(job, exitCode)
+        if job != None:
+            self.report(job)
 
         # launch the next command
         self.runNext()
         
-    def runProfile(self, profile, reverse=False):
+    def report(self, job):
+        '''
+        Report the result of a finished command.
+        '''
+        if self.history != None:
+            try:
+                self.history.record(job)
+            except sqlite3.Error, error:
+                # a run that cannot be recorded is still reported, and the
+                # queue carries on
+                self.console.line("Cannot record %s in the history: %s" %
+                                  (job.description, error))
+        
+        exitCode = job.exitCode
+        message = "Finished (%d) in %.1f s: %s" % (exitCode, job.duration(), job.commandline)
+        if exitCode != 0:
+            message += "\nThere may have been an error with the transfer."
+        elif job.changes != None and str(job.changes) != "":
+            message += "\nChanges: " + str(job.changes)
+        self.console.line(message)
+        
+    def onPruned(self, pruner):
         '''
-        Queue up all commands in a profile and start running them.
+        Report that old snapshots have been pruned.
         '''
-        if not reverse:
-            # forward direction runs any pre-sync and post-sync commands
-            if profile.getPreSync() != '':
-                self.commands.append(profile.getPreSync())
-            for command in profile:
-                self.commands.append(command.forward())
-            if profile.getPostSync() != '':
-                self.commands.append(profile.getPostSync())
-        else:
-            for command in profile:
-                self.commands.append(command.reverse())
+        self.scheduler.pruners.remove(pruner)
+        self.console.line(pruner.summary())
+        
+    def runProfile(self, profile, reverse=False, mode=None, release=None):
+        '''
+        Queue up all commands in a profile and start running them.  mode
+        previews the commands or applies their previews, and release is
+        called with each command once it has finished; see
+        scheduler.Scheduler.queueProfile.  Raises a ValueError if the
+        profile's commands depend on each other in a cycle.  The commands
+        are planned on a thread of their own, and queued once that is done.
+        '''
+        self.scheduler.check(profile)
+        thread = threading.Thread(target=self.plan, args=(profile, reverse, mode, release))
+        thread.daemon = True
+        thread.start()
+        
+    def plan(self, profile, reverse, mode, release):
+        '''
+        Plans the jobs that run a profile, and passes them, or the error
+        that stopped them, to the main thread.
+        '''
+        try:
+            planned = (profile, self.scheduler.plan(profile, reverse, mode, release), None)
+        except Exception, e:
+            planned = (profile, None, e)
+        QtGui.qApp.emit(QtCore.SIGNAL("planned(PyQt_PyObject)"), planned)
+        
+    def onPlanned(self, planned):
+        '''
+        Queue up the jobs planned for a profile and start running them.
+        '''
+        (profile, jobs, error) = planned
+        if error != None:
+            self.console.line("Cannot run profile %s: %s" % (profile.getName(), error))
+            return
+        self.scheduler.queueJobs(jobs)
+        for pruner in self.scheduler.pruners:
+            if pruner.report == None:
+                pruner.report = lambda pruner: QtGui.qApp.emit(
+                    QtCore.SIGNAL("pruned(PyQt_PyObject)"), pruner)
         
         # launch the next command
         self.runNext()
         
     def runNext(self):
         '''
-        Run the next command in the queue.
+        Run as many queued commands as the scheduler allows.
+        '''
+        job = self.scheduler.next()
+        while job != None:
+            if job.skipped:
+                self.console.line("Skipped: %s\nA command it depends on did not succeed." % 
+                                  job.commandline)
+                job = self.scheduler.next()
+                continue
+            if job.prepare != None:
+                thread = threading.Thread(target=self.prepare, args=(job,))
+                thread.daemon = True
+                thread.start()
+            else:
+                self.launch(job)
+            job = self.scheduler.next()
+    
+    def prepare(self, job):
+        '''
+        Prepares a job, and passes it, with the error that stopped it if
+        any, to the main thread to be launched.
         '''
-        # check if there are commands to run and that there is not a process
-        # currently running.
-        if (len(self.commands) > 0 and
-            self.process.state() == QtCore.QProcess.NotRunning):
-            # remove a command from the queue and start it
-            command = self.commands.popleft()
-            self.textConsole.append(command + '\n')
-            self.process.start(command)
+        try:
+            job.prepare(job)
+            error = None
+        except Exception, e:
+            error = e
+        QtGui.qApp.emit(QtCore.SIGNAL("prepared(PyQt_PyObject)"), (job, error))
+        
+    def onPrepared(self, prepared):
+        '''
+        Launch a prepared job, or report it as failed if it could not be
+        prepared.
+        '''
+        (job, error) = prepared
+        if error == None:
+            self.launch(job)
+            return
+        self.console.line("Cannot prepare %s: %s" % (job.description, error))
+        job = self.scheduler.finish(job, -1)
+        if job != None:
+            self.report(job)
+        self.runNext()
+        
+    def launch(self, job):
+        '''
+        Hand a job to an idle process and start it.
+        '''
+        process = self.worker()
+        import progress
+        self.jobs[process] = job
+        self.parsers[process] = progress.ProgressParser(
+            lambda event, job=job: self.onProgress(job, event))
+        self.console.line(job.commandline)
+        # rsync commands are run directly, and other tasks through the
+        # shell, as the command line interface does
+        if job.argv != None:
+            process.start(job.argv[0], list(job.argv[1:]))
+        else:
+            process.start("/bin/sh", ["-c", job.commandline])
         
         
 class SynctityWindow(QtGui.QMainWindow):
@@ -322,17 +647,105 @@ class SynctityWindow(QtGui.QMainWindow):
         self.ui.listProfiles.setModel(self.profileModel)
         self.commandModel = CommandModel(self)
         self.ui.listCommands.setModel(self.commandModel)
+        # note the profiles that change, so saving writes just those
+        self.connect(self.profileModel, QtCore.SIGNAL("dataChanged(QModelIndex, QModelIndex)"),
+                     self.onProfileChanged)
+        for signal in ("dataChanged(QModelIndex, QModelIndex)",
+                       "rowsInserted(QModelIndex, int, int)",
+                       "rowsRemoved(QModelIndex, int, int)"):
+            self.connect(self.commandModel, QtCore.SIGNAL(signal), self.onCommandsChanged)
+        
+        # add a setting for the number of commands a profile runs at once
+        label = QtGui.QLabel("Parallel", self.ui.groupProfile)
+        self.spinParallel = QtGui.QSpinBox(self.ui.groupProfile)
+        self.spinParallel.setRange(1, MAX_PROCESSES)
+        self.spinParallel.setToolTip("Number of commands to run at the same time")
+        self.ui.gridLayout.addWidget(label, 6, 0, 1, 1)
+        self.ui.gridLayout.addWidget(self.spinParallel, 6, 1, 1, 1)
+        self.connect(self.spinParallel, QtCore.SIGNAL("valueChanged(int)"), self.onParallel)
+        label = QtGui.QLabel("Per host", self.ui.groupProfile)
+        self.spinHostLimit = QtGui.QSpinBox(self.ui.groupProfile)
+        self.spinHostLimit.setRange(0, MAX_PROCESSES)
+        self.spinHostLimit.setSpecialValueText("No limit")
+        self.spinHostLimit.setToolTip("Number of commands to run against one host at the same time")
+        self.ui.gridLayout.addWidget(label, 7, 0, 1, 1)
+        self.ui.gridLayout.addWidget(self.spinHostLimit, 7, 1, 1, 1)
+        self.connect(self.spinHostLimit, QtCore.SIGNAL("valueChanged(int)"), self.onHostLimit)
+        self.checkFanOut = QtGui.QCheckBox("Share mirror transfers", self.ui.groupProfile)
+        self.checkFanOut.setToolTip("Copy commands with the same source and options once, "
+                                    "and replay the changes to the other destinations")
+        self.ui.gridLayout.addWidget(self.checkFanOut, 7, 2, 1, 1)
+        self.connect(self.checkFanOut, QtCore.SIGNAL("toggled(bool)"), self.onFanOut)
+        # add settings for keeping backup snapshots
+        label = QtGui.QLabel("Snapshots in", self.ui.groupProfile)
+        self.textSnapshotRoot = QtGui.QLineEdit(self.ui.groupProfile)
+        self.textSnapshotRoot.setToolTip("Directory to keep backup snapshots in, as [user@host:]/path; "
+                                         "leave empty to copy without snapshots")
+        self.ui.gridLayout.addWidget(label, 8, 0, 1, 1)
+        self.ui.gridLayout.addWidget(self.textSnapshotRoot, 8, 1, 1, 2)
+        self.connect(self.textSnapshotRoot, QtCore.SIGNAL("editingFinished()"), self.onSnapshot)
+        label = QtGui.QLabel("Snapshot name", self.ui.groupProfile)
+        self.textSnapshotName = QtGui.QLineEdit(self.ui.groupProfile)
+        self.textSnapshotName.setToolTip("Snapshots are named NAME-date-time, and the latest is NAME-current")
+        self.ui.gridLayout.addWidget(label, 9, 0, 1, 1)
+        self.ui.gridLayout.addWidget(self.textSnapshotName, 9, 1, 1, 2)
+        self.connect(self.textSnapshotName, QtCore.SIGNAL("editingFinished()"), self.onSnapshot)
+        label = QtGui.QLabel("Keep", self.ui.groupProfile)
+        layout = QtGui.QHBoxLayout()
+        self.spinRetention = list()
+        for period in rsync.RETENTION_PERIODS:
+            spin = QtGui.QSpinBox(self.ui.groupProfile)
+            spin.setRange(0, 999)
+            spin.setSuffix(" " + period)
+            spin.setToolTip("Number of %s snapshots to keep; when all are 0, every snapshot is kept" % period)
+            layout.addWidget(spin)
+            self.connect(spin, QtCore.SIGNAL("valueChanged(int)"), self.onRetention)
+            self.spinRetention.append((period, spin))
+        self.ui.gridLayout.addWidget(label, 10, 0, 1, 1)
+        self.ui.gridLayout.addLayout(layout, 10, 1, 1, 2)
         
         # initially disable profile editing
         self.ui.groupProfile.setEnabled(False)
         
-        # setup process for running profiles
-        self.runner = ProfileRunner(self.ui.textConsole)
+        # setup output for running profiles; the runner is made when the
+        # first profile is run
+        self.console = ConsoleWriter(self.ui.textConsole)
+        self.runner = None
         
-        # filename used to store profiles
+        # add buttons that preview the selected profile, and run it for real
+        # reusing the preview
+        self.buttonPreview = QtGui.QPushButton("Preview", self.ui.groupBox)
+        self.buttonPreview.setToolTip("Dry run the profile forward, and keep the changes it would make")
+        self.ui.horizontalLayout_3.addWidget(self.buttonPreview)
+        self.connect(self.buttonPreview, QtCore.SIGNAL("clicked()"), self.onPreview)
+        self.buttonApplyPreview = QtGui.QPushButton("Apply preview", self.ui.groupBox)
+        self.buttonApplyPreview.setToolTip("Run the profile forward for real, copying just the previewed changes "
+                                           "where the source has not changed since")
+        self.ui.horizontalLayout_3.addWidget(self.buttonApplyPreview)
+        self.connect(self.buttonApplyPreview, QtCore.SIGNAL("clicked()"), self.onApplyPreview)
+        
+        # add a button that keeps copying the selected profile's changes
+        self.buttonWatch = QtGui.QPushButton("Watch", self.ui.groupBox)
+        self.buttonWatch.setCheckable(True)
+        self.buttonWatch.setToolTip("Run the profile forward, then copy changes to its local sources as they happen")
+        self.ui.horizontalLayout_3.addWidget(self.buttonWatch)
+        self.connect(self.buttonWatch, QtCore.SIGNAL("toggled(bool)"), self.onWatch)
+        self.watcher = None
+        self.watchNotifier = None
+        self.watchTimer = QtCore.QTimer(self)
+        self.watchTimer.setSingleShot(True)
+        self.connect(self.watchTimer, QtCore.SIGNAL("timeout()"), self.onWatchTimer)
+        
+        # the window's icon is compiled into a resource module, which is
+        # loaded once the window has been shown
+        QtCore.QTimer.singleShot(0, self.loadIcon)
+        
+        # filename used to store profiles, which are loaded once the window
+        # has been shown
+        self.store = None
         if os.path.exists(DEFAULT_CONFIG):
             self.filename = DEFAULT_CONFIG
-            self.loadProfiles()
+            QtCore.QTimer.singleShot(0, self.loadProfiles)
         else:
             self.filename = None
             
@@ -391,9 +804,36 @@ class SynctityWindow(QtGui.QMainWindow):
             self.ui.textProfileName.setText(profile.getName())
             self.ui.textPreSync.setText(profile.getPreSync())
             self.ui.textPostSync.setText(profile.getPostSync())
+            # showing the settings is not a change to save
+            self.spinParallel.blockSignals(True)
+            self.spinParallel.setValue(profile.getParallel())
+            self.spinParallel.blockSignals(False)
+            self.spinHostLimit.blockSignals(True)
+            self.spinHostLimit.setValue(profile.getHostLimit())
+            self.spinHostLimit.blockSignals(False)
+            self.checkFanOut.blockSignals(True)
+            self.checkFanOut.setChecked(profile.getFanOut())
+            self.checkFanOut.blockSignals(False)
+            snap = profile.getSnapshot()
+            if snap != None:
+                self.textSnapshotRoot.setText(str(snap.getRoot()))
+                self.textSnapshotName.setText(snap.getName())
+                retention = snap.getRetention()
+            else:
+                self.textSnapshotRoot.setText('')
+                self.textSnapshotName.setText('')
+                retention = dict()
+            for (period, spin) in self.spinRetention:
+                spin.blockSignals(True)
+                spin.setValue(retention.get(period, 0))
+                spin.blockSignals(False)
             self.commandModel.setProfile(profile)
         else:
             self.ui.groupProfile.setEnabled(False)
+            self.commandModel.setProfile(None)
+            if self.profileModel.isValid(index.row()):
+                self.ui.statusbar.showMessage("Cannot read profile " +
+                                              self.profileModel.getEntries()[index.row()].getName())
         
     def onProfileName(self):
         '''
@@ -404,7 +844,7 @@ class SynctityWindow(QtGui.QMainWindow):
         profile = self.currentProfile()
         if profile != None:
             # update the profile name
-            profile.setName(self.ui.textProfileName.text())
+            profile.setName(str(self.ui.textProfileName.text()))
             # notify the model that underlying data has changed
             self.profileModel.update(profile)
             
@@ -416,11 +856,93 @@ class SynctityWindow(QtGui.QMainWindow):
         profile = self.currentProfile()
         if profile != None:
             # update the command
-            profile.setPreSync(self.ui.textPreSync.text())
-            profile.setPostSync(self.ui.textPostSync.text())
+            profile.setPreSync(str(self.ui.textPreSync.text()))
+            profile.setPostSync(str(self.ui.textPostSync.text()))
             # notify the model that underlying data has changed
             self.profileModel.update(profile)
     
+    def onParallel(self, value):
+        '''
+        Updates the number of commands the currently selected profile may run
+        at the same time.
+        '''
+        profile = self.currentProfile()
+        if profile != None:
+            profile.setParallel(value)
+            self.profileModel.update(profile)
+    
+    def onHostLimit(self, value):
+        '''
+        Updates the number of commands the currently selected profile may run
+        against a single host at the same time.
+        '''
+        profile = self.currentProfile()
+        if profile != None:
+            profile.setHostLimit(value)
+            self.profileModel.update(profile)
+    
+    def onFanOut(self, checked):
+        '''
+        Updates whether the currently selected profile copies mirrors of one
+        source with a single transfer.
+        '''
+        profile = self.currentProfile()
+        if profile != None:
+            profile.setFanOut(checked)
+            self.profileModel.update(profile)
+    
+    def onSnapshot(self):
+        '''
+        Updates where the currently selected profile keeps backup snapshots.
+        '''
+        profile = self.currentProfile()
+        if profile == None:
+            return
+        root = str(self.textSnapshotRoot.text()).strip()
+        if root == '':
+            profile.setSnapshot(None)
+            self.profileModel.update(profile)
+            return
+        name = str(self.textSnapshotName.text()).strip()
+        if name == '':
+            name = profile.getName()
+            self.textSnapshotName.setText(name)
+        import snapshot
+        snap = rsync.Snapshot(snapshot.parsePath(root), name)
+        profile.setSnapshot(snap)
+        self.onRetention()
+        
+    def onRetention(self, value=None):
+        '''
+        Updates how many snapshots the currently selected profile keeps.
+        '''
+        profile = self.currentProfile()
+        if profile == None or profile.getSnapshot() == None:
+            return
+        retention = dict()
+        for (period, spin) in self.spinRetention:
+            if spin.value() > 0:
+                retention[period] = spin.value()
+        profile.getSnapshot().setRetention(retention)
+        self.profileModel.update(profile)
+    
+    def onProfileChanged(self, first, last):
+        '''
+        Notes that the profiles between two QModelIndexes have changed.
+        '''
+        if self.store != None:
+            for row in range(first.row(), last.row() + 1):
+                profile = self.profileModel.get(row)
+                if profile != None:
+                    self.store.touch(profile)
+
+    def onCommandsChanged(self, *args):
+        '''
+        Notes that the commands of the profile being edited have changed.
+        '''
+        if self.store != None and self.commandModel.profile != None:
+            self.store.touch(self.commandModel.profile)
+    
     def onPreSync(self):
         qfile = QtGui.QFileDialog.getOpenFileName(self, "Select pre-sync command...")
         if qfile != None and qfile != '':
@@ -463,7 +985,7 @@ class SynctityWindow(QtGui.QMainWindow):
         '''
         profile = self.currentProfile()
         if profile != None:
-            self.runner.runProfile(profile, False)
+            self.runProfile(profile, False)
     
     def onReverse(self):
         '''
@@ -472,21 +994,156 @@ class SynctityWindow(QtGui.QMainWindow):
         '''
         profile = self.currentProfile()
         if profile != None:
-            self.runner.runProfile(profile, True)
+            self.runProfile(profile, True)
                         
+    def onPreview(self):
+        '''
+        Dry runs the currently selected profile forward, keeping the changes
+        its commands would make.
+        '''
+        import preview
+        profile = self.currentProfile()
+        if profile != None:
+            self.runProfile(profile, False, preview.DRY_RUN)
+    
+    def onApplyPreview(self):
+        '''
+        Runs the currently selected profile forward for real, copying just
+        the previewed changes of commands whose sources have not changed.
+        '''
+        import preview
+        profile = self.currentProfile()
+        if profile != None:
+            self.runProfile(profile, False, preview.APPLY)
+                        
+    def runProfile(self, profile, reverse, mode=None, release=None):
+        '''
+        Runs a profile, warning the user if it cannot be run.  Returns 
+        whether the profile was run.
+        '''
+        try:
+            self.getRunner().runProfile(profile, reverse, mode, release)
+        except ValueError, e:
+            QtGui.QMessageBox.warning(self, "Cannot run profile", 
+                      "Sorry, this profile cannot be run:\n" + str(e))
+            return False
+        return True
+    
+    def getRunner(self):
+        '''
+        Returns the runner that runs profiles, making it the first time, when
+        the run history is opened as well.
+        '''
+        if self.runner == None:
+            import history
+            try:
+                runs = history.History()
+            except:
+                # run without recording history if the database cannot be opened
+                runs = None
+            self.runner = ProfileRunner(self.console, listener=self.onRunProgress,
+                                        history=runs)
+        return self.runner
+        
+    def onWatch(self, checked):
+        '''
+        Starts or stops watching the currently selected profile.  Watching
+        runs the profile forward, then runs just the changed paths of its
+        commands' local sources whenever they change.
+        '''
+        if not checked:
+            self.stopWatching()
+            return
+        
+        import watch
+        profile = self.currentProfile()
+        if profile == None:
+            self.buttonWatch.setChecked(False)
+            return
+        try:
+            self.watcher = watch.Watcher(profile)
+        except OSError, e:
+            QtGui.QMessageBox.warning(self, "Cannot watch profile", 
+                      "Sorry, this profile cannot be watched:\n" + e.strerror)
+            self.buttonWatch.setChecked(False)
+            return
+        except ValueError, e:
+            QtGui.QMessageBox.warning(self, "Cannot watch profile", 
+                      "Sorry, this profile cannot be watched:\n" + str(e))
+            self.buttonWatch.setChecked(False)
+            return
+        self.watchNotifier = QtCore.QSocketNotifier(self.watcher.fileno(), 
+                                                    QtCore.QSocketNotifier.Read, self)
+        self.connect(self.watchNotifier, QtCore.SIGNAL("activated(int)"), self.onWatchEvents)
+        if not self.runProfile(profile, False):
+            self.buttonWatch.setChecked(False)
+            return
+        self.ui.statusbar.showMessage("Watching " + profile.getName())
+        
+    def stopWatching(self):
+        '''
+        Stops watching a profile, dropping any changes not yet run.
+        '''
+        self.watchTimer.stop()
+        if self.watchNotifier != None:
+            self.watchNotifier.setEnabled(False)
+            self.watchNotifier.deleteLater()
+            self.watchNotifier = None
+        if self.watcher != None:
+            self.watcher.close()
+            self.watcher = None
+            self.ui.statusbar.clearMessage()
+        
+    def onWatchEvents(self, fd):
+        '''
+        Collects changes to the watched profile, and sets a timer for when
+        they are due to be run.
+        '''
+        self.watcher.process()
+        timeout = self.watcher.timeout()
+        if timeout != None:
+            self.watchTimer.start(int(timeout * 1000))
+        
+    def onWatchTimer(self):
+        '''
+        Runs the changes to the watched profile, if they are due.
+        '''
+        if self.watcher == None:
+            return
+        if self.watcher.ready():
+            self.runProfile(self.watcher.take(), False, release=self.watcher.release)
+        elif self.watcher.timeout() != None:
+            self.watchTimer.start(int(self.watcher.timeout() * 1000))
+    
+    def onRunProgress(self, job, event):
+        '''
+        Shows the progress of a running command in the status bar.
+        '''
+        import progress
+        if isinstance(event, progress.Progress):
+            self.ui.statusbar.showMessage("%s: %s" % (job.commandline, event))
+                        
+    def loadIcon(self):
+        '''
+        Sets the window's icon, loading the resources it is kept in.
+        '''
+        import resources_rc
+        self.setWindowIcon(QtGui.QIcon(":/synctity.png"))
+        
     def loadProfiles(self):
         '''
         Loads a set of profiles from a file.
         '''
         try:
-            # open the shelve file, and grab an object called profiles
-            store = shelve.open(self.filename)
-            if "profiles" in store:
-                self.profileModel.setProfiles(store["profiles"])
+            # only the names are read now, and each profile when it is
+            # first selected or run
+            self.store = store.Store(self.filename)
+            entries = self.store.index()
+            if entries != None:
+                self.profileModel.setEntries(entries, self.store)
             else:
                 QtGui.QMessageBox.warning(self, "Cannot read file", 
                       "Sorry, this file is not a valid Synctus file:\n" + self.filename)
-            store.close()
             self.ui.statusbar.showMessage("Loaded profiles from " + self.filename)
         except:
             # opening shelve databases can easily throw an error if the file
@@ -499,10 +1156,14 @@ class SynctityWindow(QtGui.QMainWindow):
         Saves the set of profiles to a file.
         '''
         try:
-            # open the shelve file, and store the profiles
-            store = shelve.open(self.filename)
-            store["profiles"] = self.profileModel.getProfiles()
-            store.close()
+            # only the profiles changed since the file was read are written
+            if self.store == None or self.store.filename != self.filename:
+                # a new file takes a copy of every profile
+                if self.store != None:
+                    self.store.detach(self.profileModel.getEntries())
+                self.store = store.Store(self.filename)
+                self.profileModel.setStore(self.store)
+            self.store.write(self.profileModel.getEntries())
             self.ui.statusbar.showMessage("Wrote profiles to " + self.filename)
         except:
             # exceptions are common when dealing with file IO
@@ -548,7 +1209,8 @@ class SynctityWindow(QtGui.QMainWindow):
         '''
         Displays information about the application.
         '''
-        # build the help dialog
+        # build the help dialog, loading it the first time
+        import about_ui
         dialog = QtGui.QDialog(self)
         ui = about_ui.Ui_Dialog()
         ui.setupUi(dialog)
@@ -27,9 +27,6 @@ class Ui_Synctity(object):
     def setupUi(self, Synctity):
         Synctity.setObjectName(_fromUtf8("Synctity"))
         Synctity.resize(700, 600)
-        icon = QtGui.QIcon()
-        icon.addPixmap(QtGui.QPixmap(_fromUtf8(":/synctity.png")), QtGui.QIcon.Normal, QtGui.QIcon.Off)
-        Synctity.setWindowIcon(icon)
         self.centralwidget = QtGui.QWidget(Synctity)
         self.centralwidget.setObjectName(_fromUtf8("centralwidget"))
         self.gridLayout_3 = QtGui.QGridLayout(self.centralwidget)
@@ -137,14 +134,14 @@ class Ui_Synctity(object):
         self.dockWidgetContents.setObjectName(_fromUtf8("dockWidgetContents"))
         self.verticalLayout = QtGui.QVBoxLayout(self.dockWidgetContents)
         self.verticalLayout.setObjectName(_fromUtf8("verticalLayout"))
-        self.textConsole = QtGui.QTextEdit(self.dockWidgetContents)
+        self.textConsole = QtGui.QPlainTextEdit(self.dockWidgetContents)
         self.textConsole.setMinimumSize(QtCore.QSize(0, 0))
         font = QtGui.QFont()
         font.setFamily(_fromUtf8("Courier New"))
         font.setPointSize(14)
         self.textConsole.setFont(font)
         self.textConsole.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAsNeeded)
-        self.textConsole.setLineWrapMode(QtGui.QTextEdit.NoWrap)
+        self.textConsole.setLineWrapMode(QtGui.QPlainTextEdit.NoWrap)
         self.textConsole.setObjectName(_fromUtf8("textConsole"))
         self.verticalLayout.addWidget(self.textConsole)
         self.dockConsole.setWidget(self.dockWidgetContents)
@@ -212,5 +209,3 @@ class Ui_Synctity(object):
         self.actionSaveAs.setText(_translate("Synctity", "Save as...", None))
         self.actionSaveAs.setShortcut(_translate("Synctity", "Ctrl+Shift+S", None))
         self.actionRunAway.setText(_translate("Synctity", "Run Away", None))
-
-import resources_rc
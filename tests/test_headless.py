@@ -0,0 +1,76 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+Checks that the command line runner reports commands that cannot be run,
+rather than waiting for them forever.
+'''
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import headless
+import rsync
+
+def failingRun(command, output=None):
+    raise OSError(2, "No such file or directory")
+
+class RunProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.run = rsync.run
+        rsync.run = failingRun
+
+    def tearDown(self):
+        rsync.run = self.run
+
+    def runProfile(self, profile):
+        ''' Runs a profile on a thread, returning None if it is still
+        running after a while. '''
+        result = list()
+        thread = threading.Thread(target=lambda: result.append(headless.runProfile(profile)))
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        if len(result) == 0:
+            return None
+        return result[0]
+
+    def testFailingRun(self):
+        profile = rsync.Profile("failing")
+        profile.setPreSync("true")
+        for idx in range(2):
+            profile.add(rsync.Command(rsync.Path("/source/%d" % idx),
+                                      rsync.Path("/dest/%d" % idx)))
+        # the pre-sync task and both commands are each reported as failed
+        self.assertEqual(self.runProfile(profile), 3)
+
+    def testFailingDependency(self):
+        profile = rsync.Profile("failing")
+        first = rsync.Command(rsync.Path("/source/first"), rsync.Path("/dest/first"))
+        second = rsync.Command(rsync.Path("/source/second"), rsync.Path("/dest/second"))
+        second.setDepends([first])
+        profile.add(first)
+        profile.add(second)
+        self.assertEqual(self.runProfile(profile), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+Checks that profiles saved from the window can be read back without Qt,
+as the command line interface does.
+'''
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rsync
+import store
+
+class QString(object):
+    '''
+    Stands in for PyQt4's QString, which the window's text fields hand
+    back: pickling one names a class in PyQt4.QtCore.
+    '''
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return self.text
+
+QString.__module__ = 'PyQt4.QtCore'
+
+class ProfilePickleTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="synctity-test-")
+        self.filename = os.path.join(self.dir, "profiles.db")
+        self.modules = dict([(name, sys.modules.get(name))
+                             for name in ('PyQt4', 'PyQt4.QtCore')])
+
+    def tearDown(self):
+        for (name, module) in self.modules.items():
+            if module == None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+        shutil.rmtree(self.dir)
+
+    def provideQt(self):
+        ''' Makes the stand-in QString importable from PyQt4.QtCore. '''
+        package = types.ModuleType('PyQt4')
+        core = types.ModuleType('PyQt4.QtCore')
+        core.QString = QString
+        package.QtCore = core
+        sys.modules['PyQt4'] = package
+        sys.modules['PyQt4.QtCore'] = core
+
+    def blockQt(self):
+        ''' Makes importing PyQt4 fail, as it does where Qt is missing. '''
+        sys.modules['PyQt4'] = None
+        sys.modules['PyQt4.QtCore'] = None
+
+    def testReadWithoutQt(self):
+        self.provideQt()
+        profile = rsync.Profile()
+        # as the window does, before it converted its text to str
+        profile.setName(QString("Home"))
+        profile.setPreSync(QString("echo before"))
+        profile.setPostSync(QString("echo after"))
+        command = rsync.Command()
+        command.getSource().setPath(QString("/home/user"))
+        command.getDestination().setHost(QString("backup"))
+        command.getDestination().setPath(QString("/backups/user"))
+        profile.add(command)
+        # a profile held since before the setters converted their values
+        profile.presync = QString("echo before")
+        store.write(self.filename, [profile])
+
+        self.blockQt()
+        self.assertRaises(ImportError, __import__, 'PyQt4.QtCore')
+        entries = store.Store(self.filename).index()
+        self.assertEqual([entry.getName() for entry in entries], ["Home"])
+        (loaded,) = store.load(self.filename)
+        self.assertEqual(loaded.getName(), "Home")
+        self.assertEqual(loaded.getPreSync(), "echo before")
+        self.assertEqual(loaded.getPostSync(), "echo after")
+        self.assertEqual(type(loaded.getPreSync()), str)
+        command = loaded.getCommands()[0]
+        self.assertEqual(str(command.getSource()), "/home/user")
+        self.assertEqual(str(command.getDestination()), "backup:/backups/user")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,351 @@
+'''
+Copyright 2009, 2010 Brian S. Eastwood.
+
+This file is part of Synctity.
+
+Synctity is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Synctity is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Synctity.  If not, see <http://www.gnu.org/licenses/>.
+
+Created on Oct 18, 2026
+
+Watches the local sources of a profile's commands for changes, using the
+Linux inotify interface, and turns each batch of changes into a profile
+that copies just the changed paths.
+'''
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import time
+
+import index
+import rsync
+
+# Changes are run once none have arrived for this many seconds, or once the
+# first of them has waited this long, whichever comes first
+DEBOUNCE = 2.0
+MAX_DELAY = 30.0
+# Where the lists of changed paths are written
+WATCH_DIR = os.path.expanduser("~/.synctity/watch")
+
+# inotify flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+# The events watched for in every directory
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+# The fixed part of each event read: watch, mask, cookie and name length
+EVENT = struct.Struct('iIII')
+
+libc = None
+
+def available():
+    '''
+    Determines whether this system supports inotify.
+    '''
+    global libc
+    if libc == None:
+        name = ctypes.util.find_library('c')
+        if name == None:
+            return False
+        libc = ctypes.CDLL(name, use_errno=True)
+    return hasattr(libc, 'inotify_init1')
+
+class Inotify:
+    '''
+    A thin wrapper around an inotify instance.
+    '''
+    def __init__(self):
+        if not available():
+            raise OSError(errno.ENOSYS, "File change notification is not supported here")
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+    def fileno(self):
+        return self.fd
+
+    def add(self, path):
+        '''
+        Watches a directory, and returns the watch descriptor.
+        '''
+        wd = libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), path)
+        return wd
+
+    def remove(self, wd):
+        '''
+        Stops a watch.  Watches on directories that are already gone are
+        removed by the kernel, so failures are ignored.
+        '''
+        libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        '''
+        Returns the events waiting to be read as (wd, mask, name) tuples, or
+        an empty list if there are none.
+        '''
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return list()
+            raise
+        events = list()
+        offset = 0
+        while offset < len(data):
+            (wd, mask, cookie, length) = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def watchable(command):
+    '''
+    Determines whether a command's source can be watched: it must be a local
+    directory.
+    '''
+    path = command.getSource()
+    return (path.getHost() == '' and path.getUser() == '' and
+            os.path.isdir(os.path.expanduser(path.getPath())))
+
+class Watcher:
+    '''
+    Watches the local source directories of a profile's commands, and
+    collects the paths that change.  Call process() when fileno() is ready
+    to read, and take() once ready() says a batch is due.
+
+    If the kernel drops events, or a directory cannot be watched, the
+    affected commands are run in full with the next batch.
+
+    Profiles that keep snapshots cannot be watched, since every snapshot
+    must hold the whole of each source, not just what changed.
+    '''
+    def __init__(self, profile):
+        if profile.getSnapshot() != None:
+            raise ValueError("A profile that keeps snapshots cannot copy just "
+                             "the files that changed")
+        self.profile = profile
+        self.inotify = Inotify()
+        # watch descriptors, mapped to a command and a directory in its source
+        self.directories = dict()
+        # changed paths of each command, relative to its source
+        self.changed = dict()
+        # commands that need a full run
+        self.full = set()
+        # when the first and the latest pending change arrived
+        self.first = None
+        self.last = None
+        # the list of changed paths each queued command copies, and the
+        # number of queued commands that copy each list
+        self.lists = dict()
+        self.readers = dict()
+        for command in profile:
+            if watchable(command):
+                self.addTree(command, '')
+        if len(self.full) > 0:
+            self.close()
+            raise OSError(errno.ENOSPC, "Cannot watch every directory; the system "
+                          "limit on watches (fs.inotify.max_user_watches) may be too low")
+
+    def fileno(self):
+        return self.inotify.fileno()
+
+    def close(self):
+        self.inotify.close()
+
+    def root(self, command):
+        return os.path.expanduser(command.getSource().getPath())
+
+    def addTree(self, command, relative):
+        '''
+        Watches a directory and everything below it.  Returns the paths of
+        everything found below it, relative to the command's source.
+        '''
+        found = list()
+        top = os.path.join(self.root(command), relative)
+        for (dirpath, dirnames, filenames) in os.walk(top):
+            current = os.path.relpath(dirpath, top)
+            if current == '.':
+                current = relative
+            elif relative != '':
+                current = os.path.join(relative, current)
+            try:
+                self.directories[self.inotify.add(dirpath)] = (command, current)
+            except OSError:
+                # out of watches, or the directory went away
+                self.full.add(command)
+            found.extend([os.path.join(current, name) for name in dirnames + filenames])
+        return found
+
+    def forget(self, command, relative):
+        '''
+        Stops watching a directory of a command's source and everything
+        below it.
+        '''
+        for (wd, (watched, current)) in self.directories.items():
+            if watched is command and (current == relative or 
+                                       current.startswith(relative + '/')):
+                self.inotify.remove(wd)
+                del self.directories[wd]
+
+    def process(self):
+        '''
+        Reads the waiting change events.
+        '''
+        for (wd, mask, name) in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, so everything has to be checked
+                self.full.update([command for command in self.profile if watchable(command)])
+                self.pending()
+                continue
+            if wd not in self.directories:
+                continue
+            (command, relative) = self.directories[wd]
+            if mask & IN_IGNORED:
+                # the directory is gone, or no longer watched
+                del self.directories[wd]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if relative == '':
+                    # the source itself went away
+                    self.full.add(command)
+                    self.pending()
+                continue
+            paths = self.changed.setdefault(command, set())
+            path = os.path.join(relative, name)
+            paths.add(path)
+            if relative != '':
+                # the directory's modification time changed too
+                paths.add(relative)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # a new directory may have been filled before it was watched
+                paths.update(self.addTree(command, path))
+            if mask & IN_ISDIR and mask & IN_MOVED_FROM:
+                # watches below a directory moved away would report changes
+                # under its old name
+                self.forget(command, path)
+            self.pending()
+
+    def pending(self):
+        '''
+        Notes the arrival of a change.
+        '''
+        self.last = time.time()
+        if self.first == None:
+            self.first = self.last
+
+    def timeout(self, now=None):
+        '''
+        Returns the number of seconds until the pending changes are due, or
+        None if there are none.
+        '''
+        if self.first == None:
+            return None
+        if now == None:
+            now = time.time()
+        due = min(self.last + DEBOUNCE, self.first + MAX_DELAY)
+        return max(0, due - now)
+
+    def ready(self, now=None):
+        '''
+        Determines whether a batch of changes is due.
+        '''
+        timeout = self.timeout(now)
+        return timeout != None and timeout <= 0
+
+    def take(self):
+        '''
+        Returns a profile that copies the pending changes, with the same
+        concurrency and mirror settings as the watched profile but no
+        pre-sync or post-sync tasks, and starts a new batch.  Its commands
+        depend on each other as the watched commands do, where both are in
+        the batch.  Pass each of its commands to release() once it has
+        finished, to delete the list of paths it copied.
+        '''
+        batch = rsync.Profile(self.profile.getName())
+        batch.setParallel(self.profile.getParallel())
+        batch.setHostLimit(self.profile.getHostLimit())
+        batch.setFanOut(self.profile.getFanOut())
+        # the batch's copy of each watched command in it
+        copies = dict()
+        for command in self.profile:
+            if command in self.full:
+                copy = rsync.Command(command.getSource(), command.getDestination(),
+                                     command.getOptions())
+                copy.setShards(command.getShards())
+                copy.setShardMode(command.getShardMode())
+                copy.setIncremental(command.getIncremental())
+            elif command in self.changed:
+                root = self.root(command)
+                paths = self.changed[command]
+                existing = sorted([path for path in paths
+                                   if os.path.lexists(os.path.join(root, path))])
+                deleted = sorted([path for path in paths
+                                  if not os.path.lexists(os.path.join(root, path))])
+                copy = index.narrow(command, False, existing, deleted, WATCH_DIR)
+                listed = copy.getOptions().getOptions()['files-from'][0]
+                self.lists[copy] = listed
+                self.readers[listed] = self.readers.get(listed, 0) + 1
+            else:
+                continue
+            copies[command] = copy
+            batch.add(copy)
+        for (command, copy) in copies.items():
+            copy.setDepends([copies[depend] for depend in command.getDepends()
+                             if depend in copies])
+        self.changed = dict()
+        self.full = set()
+        self.first = None
+        self.last = None
+        return batch
+
+    def release(self, command):
+        '''
+        Notes that a command of a batch has finished, and deletes the list
+        of paths it copied once no other queued command copies the same
+        list.
+        '''
+        listed = self.lists.pop(command, None)
+        if listed == None:
+            return
+        self.readers[listed] -= 1
+        if self.readers[listed] == 0:
+            del self.readers[listed]
+            try:
+                os.remove(listed)
+            except OSError:
+                pass